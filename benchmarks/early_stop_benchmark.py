@@ -0,0 +1,97 @@
+"""Measures the output tokens and time per task saved by stopping responses at their first action."""
+import logging
+import os
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+
+from codebuddy.script import Script
+from codebuddy.stub_server import StubServer
+from codebuddy.tmux_module import LocalTmuxModule
+from codebuddy.utils import TRIPLE_BACKTICKS
+
+T = TRIPLE_BACKTICKS
+
+SPECULATION = (
+    "If the output shows a failure, the most likely cause is the configuration loader, which "
+    "reads the settings before the defaults are applied. In that case I will update the loader "
+    "so that the defaults are merged first, then rerun the checks to confirm the fix. If the "
+    "output looks correct, the next step is to review the remaining modules for the same pattern "
+    "and add a regression test that covers the missing setting. "
+)
+
+
+def make_task(idx: int, n_steps: int) -> list:
+    """Returns the scripted responses of one task. Each step runs a command and then speculates
+    about its output and the commands that would follow."""
+    responses = [
+        f"Let me look at the project first.\n{T}terminal\nls -la && echo step {idx}-{step}\n{T}\n"
+        + SPECULATION * 2
+        + f"\n{T}terminal\ngrep -rn settings . | head -5\n{T}\n"
+        + SPECULATION
+        for step in range(n_steps)
+    ]
+    return responses + ["The task is complete."]
+
+
+@dataclass
+class EarlyStopBenchmark(Script):
+    """Compare output tokens per task with and without early stopping, using a stub server."""
+    n_tasks: int = field(default=5, metadata={"help": "Number of scripted tasks."})
+    n_steps: int = field(default=3, metadata={"help": "Number of command steps per task."})
+    token_delay: float = field(
+        default=0.005, metadata={"help": "Seconds between streamed tokens of the stub server."}
+    )
+    project_path: str = field(
+        default="", metadata={"help": "Project directory. Defaults to a temporary directory."}
+    )
+    python_env: str = field(default=sys.prefix, metadata={"help": "Path to the Python environment."})
+
+    def run_tasks(self, early_stop: bool, project_path: str) -> dict:
+        responses = [x for idx in range(self.n_tasks) for x in make_task(idx, self.n_steps)]
+        server = StubServer(responses=responses, token_delay=self.token_delay).start()
+        module = LocalTmuxModule(
+            base_url=server.base_url,
+            prompt_template="You are a coding assistant.\n{{project}}",
+            project_path=project_path,
+            python_env=self.python_env,
+            terminal_session_id=f"early-stop-benchmark-{os.getpid()}",
+            python_session_id=f"early-stop-benchmark-python-{os.getpid()}",
+            python_executor="pipe",
+            transcript_dir="",
+            checkpoint_edits=False,
+            max_calls=self.n_steps + 2,
+            early_stop=early_stop,
+        )
+        try:
+            start = time.monotonic()
+            for idx in range(self.n_tasks):
+                for _ in module(f"Task {idx}", clear=True):
+                    pass
+            elapsed = time.monotonic() - start
+        finally:
+            module.close()
+            server.stop()
+        return {"elapsed": elapsed, **module.tokens}
+
+    def run(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            project_path = self.project_path or tmp
+            if not self.project_path:
+                with open(os.path.join(tmp, "settings.py"), "w") as file:
+                    file.write("settings = {}\n")
+            results = {x: self.run_tasks(x, project_path) for x in (False, True)}
+        for early_stop, result in results.items():
+            print(
+                f"early_stop={early_stop}: {result['output_tokens'] / self.n_tasks:.0f} output "
+                f"tokens per task, {result['llm_calls'] / self.n_tasks:.1f} LLM calls per task, "
+                f"{result['elapsed'] / self.n_tasks:.2f}s per task"
+            )
+        saved = 1 - results[True]["output_tokens"] / results[False]["output_tokens"]
+        print(f"Output tokens saved: {saved:.0%}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    EarlyStopBenchmark.parse_args().run()
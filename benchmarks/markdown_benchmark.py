@@ -0,0 +1,87 @@
+"""Compares the markdown scanner with the previous regex and line filtering pipeline."""
+import re
+import timeit
+from dataclasses import dataclass, field
+
+from codebuddy.markdown import scan_markdown
+from codebuddy.script import Script
+from codebuddy.utils import TRIPLE_BACKTICKS
+
+KEYWORDS = [
+    "OVERWRITE", "DELETE", "APPEND", "REPLACE", "RECALL", "SEARCH",
+    "JOBS", "JOB_OUTPUT", "JOB_WAIT", "JOB_KILL", "HISTORY", "HISTORY_SEARCH",
+]
+
+
+def legacy_split_markdown(text):
+    """The regex based split_markdown that the scanner replaced."""
+    pattern = re.compile(rf"{TRIPLE_BACKTICKS}(\w+)?\n(.*?){TRIPLE_BACKTICKS}", re.DOTALL)
+    chunks = []
+    last_index = 0
+    for match in pattern.finditer(text):
+        if last_index < match.start():
+            chunks.append({"type": "text", "content": text[last_index : match.start()]})
+        chunks.append({"type": match.group(1) or "code", "content": match.group(2)})
+        last_index = match.end()
+    if last_index < len(text):
+        chunks.append({"type": "text", "content": text[last_index:].strip()})
+    return [x for x in chunks if x["content"]]
+
+
+def legacy_process_chunks(chunks, keywords):
+    """The line filtering process_chunks that the scanner replaced."""
+    filtered = []
+    for chunk in chunks:
+        if chunk["type"] != "text":
+            filtered.append(chunk)
+            continue
+        lines = [
+            line for line in chunk["content"].splitlines()
+            if any(line.startswith(keyword) for keyword in keywords)
+        ]
+        if lines:
+            filtered.append({"type": "text", "content": "\n".join(lines)})
+    return filtered
+
+
+def make_response(n_bytes: int, code_fraction: float) -> str:
+    """Builds a response of prose, keyword lines and code blocks of about `n_bytes`."""
+    prose = (
+        "The function reads the configuration and validates each field before the run starts.\n"
+    )
+    code = "".join(f"    value_{idx} = compute(value_{idx - 1}, options)\n" for idx in range(1, 30))
+    block = f"{TRIPLE_BACKTICKS}python\n{code}{TRIPLE_BACKTICKS}\n"
+    n_prose = max(int(len(block) * (1 - code_fraction) / max(code_fraction, 1e-3) / len(prose)), 1)
+    unit = prose * n_prose + "SEARCH compute options\n" + block
+    return unit * (n_bytes // len(unit) + 1)
+
+
+@dataclass
+class MarkdownBenchmark(Script):
+    """Time the markdown scanner against the previous parsing pipeline."""
+    size_kb: int = field(default=500, metadata={"help": "Approximate response size in KB."})
+    repeat: int = field(default=20, metadata={"help": "Number of timed runs per case."})
+
+    def run(self):
+        for code_fraction in (0.1, 0.5, 0.9):
+            text = make_response(self.size_kb * 1000, code_fraction)
+            legacy = legacy_process_chunks(legacy_split_markdown(text), KEYWORDS)
+            chunks = scan_markdown(text, KEYWORDS)
+            assert [(x["type"], x["content"]) for x in legacy] == [
+                (x.type, x.content) for x in chunks
+            ]
+            old = min(timeit.repeat(
+                lambda: legacy_process_chunks(legacy_split_markdown(text), KEYWORDS),
+                number=1, repeat=self.repeat,
+            ))
+            new = min(timeit.repeat(
+                lambda: scan_markdown(text, KEYWORDS), number=1, repeat=self.repeat
+            ))
+            print(
+                f"{len(text) / 1000:.0f} KB, {code_fraction:.0%} code: legacy {old * 1000:.2f} ms, "
+                f"scanner {new * 1000:.2f} ms, {old / new:.1f}x faster"
+            )
+
+
+if __name__ == "__main__":
+    MarkdownBenchmark.parse_args().run()
@@ -0,0 +1,60 @@
+"""Measures how long each workspace strategy takes to create and remove an isolated project copy."""
+import logging
+import os
+import tempfile
+import time
+from dataclasses import dataclass, field
+
+from codebuddy.script import Script
+from codebuddy.workspace import WorkspaceManager
+
+
+def make_project(path: str, n_dirs: int, n_files: int, file_bytes: int):
+    """Writes a synthetic project of n_dirs directories with n_files files each."""
+    for idx in range(n_dirs):
+        directory = os.path.join(path, f"module_{idx}")
+        os.makedirs(directory)
+        for jdx in range(n_files):
+            with open(os.path.join(directory, f"file_{jdx}.py"), "w") as file:
+                file.write("x = 1\n" * (file_bytes // 6))
+
+
+@dataclass
+class WorkspaceBenchmark(Script):
+    """Compare workspace creation and removal times across strategies."""
+    project_path: str = field(
+        default="", metadata={"help": "Project to copy. Defaults to a synthetic project."}
+    )
+    n_dirs: int = field(default=200, metadata={"help": "Directories in the synthetic project."})
+    n_files: int = field(default=100, metadata={"help": "Files per synthetic directory."})
+    file_bytes: int = field(default=1200, metadata={"help": "Bytes per synthetic file."})
+    strategies: str = field(
+        default="overlay,hardlink,reflink,copy", metadata={"help": "Comma separated strategies."}
+    )
+
+    def run(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            project_path = self.project_path
+            if not project_path:
+                project_path = os.path.join(tmp, "project")
+                make_project(project_path, self.n_dirs, self.n_files, self.file_bytes)
+            for strategy in self.strategies.split(","):
+                manager = WorkspaceManager(root=os.path.join(tmp, "workspaces"), strategy=strategy)
+                start = time.monotonic()
+                try:
+                    workspace = manager.create(project_path, strategy)
+                except OSError as ex:
+                    print(f"{strategy}: not available ({ex})")
+                    continue
+                created = time.monotonic() - start
+                workspace.close()
+                removed = time.monotonic() - start - created
+                print(
+                    f"{strategy}: created as {workspace.strategy} in {created:.3f}s, "
+                    f"removed in {removed:.3f}s"
+                )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    WorkspaceBenchmark.parse_args().run()
@@ -1,6 +1,8 @@
-from .utils import run_bash, Message, Dialog, PromptTemplate
+from .utils import run_bash, Message, Dialog, PromptTemplate, CompiledPromptTemplate
 # from .openai_module import OpenaiModule
 from .openai_backend import OpenaiBackend
 from .bedrock_backend import BedrockBackend
+from .hedged_backend import HedgedBackend
+from .routing_backend import RoutingBackend
 # from .tmux_module import TmuxModule
 from .script import Script
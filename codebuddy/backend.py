@@ -1,8 +1,31 @@
+import time
 from dataclasses import dataclass, field
-from typing import List, Tuple
+from typing import Dict, Iterator, List, Tuple
 
 from codebuddy.utils import Message
 
+import logging
+logger = logging.getLogger(__name__)
+
+
+USAGE_FIELDS = ("input_tokens", "output_tokens", "cache_read_tokens", "cache_write_tokens")
+
+
+def estimate_prompt_tokens(messages: List[dict]) -> int:
+    """Estimates the tokens of formatted request messages at four characters per token, for
+    responses that are cancelled before the server reports their usage."""
+    return sum(len(str(x.get("content") or "")) for x in messages) // 4
+
+
+@dataclass
+class BatchResult:
+    """The result of one request in a batch."""
+
+    request_id: str  #: The id the request was submitted with
+    content: str = None  #: The response content, or None if the request failed
+    usage: Tuple[int, ...] = (0, 0, 0, 0)  #: Token usage, in the order of USAGE_FIELDS
+    error: str = None  #: The error message of a failed request
+
 
 @dataclass
 class Backend:
@@ -15,6 +38,14 @@ class Backend:
         default_factory=lambda: [],
         metadata={"help": "A list of output token counts for each message"},
     )
+    cache_read_tokens: List[int] = field(
+        default_factory=lambda: [],
+        metadata={"help": "A list of input token counts read from the provider prompt cache"},
+    )
+    cache_write_tokens: List[int] = field(
+        default_factory=lambda: [],
+        metadata={"help": "A list of input token counts written to the provider prompt cache"},
+    )
 
     @property
     def tokens(self):
@@ -22,8 +53,23 @@ class Backend:
             "llm_calls": len(self.input_tokens),
             "input_tokens": sum(self.input_tokens),
             "output_tokens": sum(self.output_tokens),
+            "cache_read_tokens": sum(self.cache_read_tokens),
+            "cache_write_tokens": sum(self.cache_write_tokens),
         }
 
+    def usage_since(self, offsets: Tuple[int, ...]) -> Tuple[int, ...]:
+        """Returns the token usage recorded after the given offsets into the usage lists."""
+        return tuple(sum(getattr(self, k)[n:]) for k, n in zip(USAGE_FIELDS, offsets))
+
+    def usage_offsets(self) -> Tuple[int, ...]:
+        """Returns the current lengths of the usage lists."""
+        return tuple(len(getattr(self, k)) for k in USAGE_FIELDS)
+
+    def record_usage(self, usage: Tuple[int, ...]):
+        """Appends token usage to the usage lists."""
+        for k, v in zip(USAGE_FIELDS, usage):
+            getattr(self, k).append(v)
+
     def request_base(self):
         """Returns a dictionary that can be used as a base for an API request."""
         raise NotImplementedError
@@ -31,3 +77,61 @@ class Backend:
     def call_api(self, messages: List[Message], retries: int = 0) -> str:
         "Returns API response and updates input and output token counts."
         raise NotImplementedError
+
+    def stream_api(self, messages: List[Message], retries: int = 0) -> Iterator[str]:
+        """Yields the response content as it is generated and updates the token counts.
+
+        Closing the generator early cancels the response. Backends that do not stream yield the
+        whole response at once.
+        """
+        yield self.call_api(messages, retries=retries)
+
+    def call_api_with_tools(
+        self, messages: List[Message], tools: List[dict], retries: int = 0
+    ) -> Message:
+        """Returns the API response as an assistant message, with any tool calls the model made,
+        and updates input and output token counts. Tools are declared in the format of
+        `codebuddy.tools.TOOLS`."""
+        raise NotImplementedError
+
+    def submit_batch(self, requests: Dict[str, List[Message]]) -> str:
+        """Submits requests, keyed by request id, to the provider's batch API and returns the
+        batch id."""
+        raise NotImplementedError
+
+    def batch_status(self, batch_id: str) -> str:
+        """Returns the status of a batch: "running", "completed" or "failed"."""
+        raise NotImplementedError
+
+    def batch_results(self, batch_id: str) -> Dict[str, BatchResult]:
+        """Returns the results of a completed batch, keyed by request id."""
+        raise NotImplementedError
+
+    def run_batch(
+        self,
+        requests: Dict[str, List[Message]],
+        poll_interval: float = 30.,
+        timeout: float = None,
+    ) -> Dict[str, BatchResult]:
+        """Submits a batch, waits for it to complete and returns the results keyed by request id.
+
+        Requests without a result in the batch output are returned as errors. The usage of every
+        successful result is added to the token counts.
+        """
+        batch_id = self.submit_batch(requests)
+        logger.info(f"Submitted batch {batch_id} with {len(requests)} requests")
+        start = time.monotonic()
+        while (status := self.batch_status(batch_id)) == "running":
+            if timeout is not None and time.monotonic() - start > timeout:
+                raise TimeoutError(f"Batch {batch_id} did not complete within {timeout}s.")
+            time.sleep(poll_interval)
+        if status == "failed":
+            raise RuntimeError(f"Batch {batch_id} failed.")
+
+        results = self.batch_results(batch_id)
+        for request_id in requests:
+            if request_id not in results:
+                results[request_id] = BatchResult(request_id, error="Not in the batch output.")
+            elif results[request_id].error is None:
+                self.record_usage(results[request_id].usage)
+        return {k: results[k] for k in requests}
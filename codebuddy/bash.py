@@ -0,0 +1,239 @@
+"""Persistent bash processes that run commands without a fork/exec of a new shell per call."""
+import asyncio
+import atexit
+import functools
+import os
+import queue
+import selectors
+import shlex
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import List, Optional
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BashResult:
+    """The result of a bash command."""
+
+    stdout: str  #: Standard output of the command
+    stderr: str  #: Standard error of the command (empty if merged into stdout)
+    returncode: Optional[int]  #: Exit code, or None if the command timed out
+    timed_out: bool = False  #: True if the command was killed after its timeout
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0
+
+
+class BashWorker:
+    """A bash process that runs one command at a time.
+
+    Each command runs in a subshell with stdin from /dev/null, in the caller's working directory
+    and environment, so it cannot change the state of the worker. Its stdout and stderr are
+    followed by a unique sentinel line carrying the exit code. A command that times out is
+    killed with its process group and the worker is restarted.
+    """
+
+    def __init__(self):
+        self._process = None
+        self._env = None
+        self.start()
+
+    def start(self):
+        """Starts (or restarts) the bash process."""
+        self.close()
+        self._env = dict(os.environ)
+        self._process = subprocess.Popen(
+            ["bash", "--noprofile", "--norc"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True,
+        )
+
+    def close(self):
+        """Kills the bash process and any commands it is running."""
+        if self._process is None:
+            return
+        if self._process.poll() is None:
+            try:
+                os.killpg(self._process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            self._process.wait()
+        for pipe in (self._process.stdin, self._process.stdout, self._process.stderr):
+            pipe.close()
+        self._process = None
+
+    def run(
+        self,
+        command: str,
+        timeout: Optional[float] = None,
+        cwd: Optional[str] = None,
+        merge_stderr: bool = False,
+    ) -> BashResult:
+        """Runs a command and returns its output and exit code.
+
+        Args:
+            command (str): The bash command to execute.
+            timeout (float): Seconds before the command is killed. None waits indefinitely.
+            cwd (str): Working directory of the command. Defaults to the current directory.
+            merge_stderr (bool): If True, stderr is redirected to stdout.
+        """
+        # The worker is restarted if it died or the caller's environment changed since it started
+        if self._process is None or self._process.poll() is not None or self._env != os.environ:
+            self.start()
+        sentinel = f"__CODEBUDDY_{uuid.uuid4().hex}__"
+        redirect = " 2>&1" if merge_stderr else ""
+        # eval keeps syntax errors in the command from consuming the sentinel lines
+        script = (
+            f"(cd {shlex.quote(cwd or os.getcwd())} && eval {shlex.quote(command)}) < /dev/null{redirect}\n"
+            f"printf '\\n{sentinel} %d\\n' $?\n"
+            f"printf '\\n{sentinel}\\n' >&2\n"
+        )
+        self._process.stdin.write(script.encode())
+        self._process.stdin.flush()
+
+        buffers = {self._process.stdout: b"", self._process.stderr: b""}
+        markers = {
+            self._process.stdout: f"\n{sentinel} ".encode(),
+            self._process.stderr: f"\n{sentinel}\n".encode(),
+        }
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with selectors.DefaultSelector() as selector:
+            for pipe in buffers:
+                selector.register(pipe, selectors.EVENT_READ)
+            pending = set(buffers)
+            while pending:
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    break
+                for key, _ in selector.select(remaining):
+                    data = os.read(key.fileobj.fileno(), 65536)
+                    if not data:
+                        pending.discard(key.fileobj)
+                        selector.unregister(key.fileobj)
+                        continue
+                    buffers[key.fileobj] += data
+                    if markers[key.fileobj] in buffers[key.fileobj] and (
+                        key.fileobj is self._process.stderr
+                        or buffers[key.fileobj].endswith(b"\n")
+                    ):
+                        pending.discard(key.fileobj)
+                        selector.unregister(key.fileobj)
+
+        stdout, _, status = buffers[self._process.stdout].partition(markers[self._process.stdout])
+        stderr = buffers[self._process.stderr].partition(markers[self._process.stderr])[0]
+        stdout, stderr = stdout.decode(errors="replace"), stderr.decode(errors="replace")
+        if pending:
+            logger.warning(f"Command timed out after {timeout:g}s: {command}")
+            self.start()
+            return BashResult(stdout, stderr, None, timed_out=True)
+        returncode = int(status.strip() or -1)
+        return BashResult(stdout, stderr, returncode)
+
+
+class BashPool:
+    """A pool of bash workers shared by threads. Workers are started on demand."""
+
+    def __init__(self, size: int = 4):
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._workers: List[BashWorker] = []
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> BashWorker:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._workers) < self.size:
+                worker = BashWorker()
+                self._workers.append(worker)
+                return worker
+        return self._idle.get()
+
+    def run(self, command: str, timeout: Optional[float] = None, **kwargs) -> BashResult:
+        """Runs a command on an idle worker. See `BashWorker.run`."""
+        worker = self._acquire()
+        try:
+            return worker.run(command, timeout=timeout, **kwargs)
+        except BaseException:
+            # The unread output of an interrupted command would be returned to the next caller
+            worker.start()
+            raise
+        finally:
+            self._idle.put(worker)
+
+    def close(self):
+        """Kills all workers."""
+        with self._lock:
+            for worker in self._workers:
+                worker.close()
+            self._workers = []
+            self._idle = queue.LifoQueue()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _default_pool() -> BashPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BashPool()
+            atexit.register(_pool.close)
+        return _pool
+
+
+def _forget_pool():
+    # A forked child must not share the parent's workers
+    global _pool, _pool_lock
+    _pool, _pool_lock = None, threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_pool)
+
+
+def bash(
+    command: str,
+    timeout: Optional[float] = None,
+    cwd: Optional[str] = None,
+    merge_stderr: bool = False,
+) -> BashResult:
+    """
+    Runs a bash command on the shared worker pool.
+
+    Args:
+        command (str): The bash command to execute.
+        timeout (float): Seconds before the command is killed. None waits indefinitely.
+        cwd (str): Working directory of the command. Defaults to the current directory.
+        merge_stderr (bool): If True, stderr is redirected to stdout.
+
+    Returns:
+        BashResult: The stdout, stderr and exit code of the command.
+    """
+    return _default_pool().run(command, timeout=timeout, cwd=cwd, merge_stderr=merge_stderr)
+
+
+async def bash_async(
+    command: str,
+    timeout: Optional[float] = None,
+    cwd: Optional[str] = None,
+    merge_stderr: bool = False,
+) -> BashResult:
+    """Runs a bash command on the shared worker pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, functools.partial(bash, command, timeout=timeout, cwd=cwd, merge_stderr=merge_stderr)
+    )
@@ -0,0 +1,205 @@
+import difflib
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+import yaml
+
+from codebuddy.backend import USAGE_FIELDS
+from codebuddy.bedrock_backend import BedrockBackend
+from codebuddy.conversation_store import ConversationStore
+from codebuddy.local_batch_backend import LocalBatchBackend
+from codebuddy.openai_backend import OpenaiBackend
+from codebuddy.script import Script
+from codebuddy.utils import Message, PromptTemplate
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+BATCH_BACKENDS = {
+    "openai": OpenaiBackend,
+    "bedrock": BedrockBackend,
+    "local": LocalBatchBackend,
+}
+
+
+def load_dialogs(dialogs_path: str = "", store_path: str = "") -> Dict[str, List[Message]]:
+    """Loads recorded dialogs, keyed by id.
+
+    Dialogs are read from a JSONL file with an `id` and `messages` on each line (e.g., batch
+    runner results), and from the finished dialogs of a conversation store.
+    """
+    dialogs = {}
+    if dialogs_path:
+        with open(os.path.expanduser(dialogs_path), "r") as f:
+            for idx, line in enumerate(f):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get("messages"):
+                    dialogs[str(record.get("id", idx))] = [Message(**x) for x in record["messages"]]
+    if store_path:
+        store = ConversationStore(store_path)
+        for conversation_id, _, _ in store.conversations():
+            for dialog_id in store.dialog_ids(conversation_id):
+                dialogs[f"{conversation_id}:{dialog_id}"] = store.load_dialog(dialog_id).turns
+        store.close()
+    return dialogs
+
+
+def split_reference(messages: List[Message]) -> Tuple[List[Message], str]:
+    """Splits a dialog into the messages before its last assistant message and that message.
+
+    Returns None if the dialog has no assistant message after its first message.
+    """
+    for idx in range(len(messages) - 1, 0, -1):
+        if messages[idx].role == "assistant":
+            return messages[:idx], messages[idx].content
+    return None
+
+
+def load_instruction(prompt_path: str) -> str:
+    """Returns the system prompt of a prompt config yaml file, without a project tree."""
+    with open(os.path.expanduser(prompt_path), "r") as f:
+        config = yaml.safe_load(f)
+    template = config.get("prompt_template") or config.get("instruction") or ""
+    return PromptTemplate(template).format(project="")
+
+
+@dataclass
+class BatchEval(Script):
+    """Replay recorded dialogs through a batch inference API to compare prompts or models.
+
+    The last assistant response of each dialog is regenerated from the messages before it, once
+    per prompt variant, and compared with the recorded response. Recorded dialogs do not include
+    the system prompt they ran with, so at least one prompt config is required.
+    """
+    backend: str = field(
+        default="local", metadata={"help": "Backend name: openai, bedrock or local."}
+    )
+    model: str = field(
+        default="", metadata={"help": "Model ID. Uses the backend default if empty."}
+    )
+    dialogs_path: str = field(
+        default="", metadata={"help": "JSONL file of dialogs with an id and messages."}
+    )
+    store_path: str = field(
+        default="", metadata={"help": "SQLite conversation store to read finished dialogs from."}
+    )
+    prompt_paths: List[str] = field(
+        default_factory=list,
+        metadata={
+            "help": (
+                "Prompt config yaml files to compare. Each replaces the system prompt of the "
+                "dialogs. At least one is required."
+            )
+        },
+    )
+    max_dialogs: int = field(default=0, metadata={"help": "Maximum number of dialogs (0 for all)."})
+    output_path: str = field(
+        default="batch_eval.jsonl", metadata={"help": "JSONL file that results are written to."}
+    )
+    batch_dir: str = field(
+        default="~/.codebuddy/batches", metadata={"help": "Batch directory of the local backend."}
+    )
+    batch_s3_uri: str = field(
+        default="", metadata={"help": "S3 prefix for the inputs and outputs of Bedrock batches."}
+    )
+    batch_role_arn: str = field(
+        default="", metadata={"help": "Service role ARN that Bedrock batch jobs run with."}
+    )
+    poll_interval: float = field(
+        default=30., metadata={"help": "Seconds between batch status checks."}
+    )
+    timeout: float = field(
+        default=0., metadata={"help": "Seconds to wait for the batch (0 waits indefinitely)."}
+    )
+
+    def make_backend(self):
+        kwargs = {}
+        if self.backend == "local":
+            kwargs["batch_dir"] = self.batch_dir
+        if self.backend == "bedrock":
+            kwargs.update(batch_s3_uri=self.batch_s3_uri, batch_role_arn=self.batch_role_arn)
+        if self.model:
+            kwargs["model_id" if self.backend == "bedrock" else "model"] = self.model
+        return BATCH_BACKENDS[self.backend](**kwargs)
+
+    def make_requests(self, dialogs: Dict[str, List[Message]]) -> Tuple[dict, dict]:
+        """Returns the requests keyed by request id, and the variant, dialog id and reference
+        response of each request."""
+        if not self.prompt_paths:
+            raise ValueError(
+                "BatchEval requires prompt_paths, since recorded dialogs have no system prompt."
+            )
+        variants = {
+            os.path.splitext(os.path.basename(x))[0]: load_instruction(x) for x in self.prompt_paths
+        }
+        requests, references = {}, {}
+        for dialog_id, messages in dialogs.items():
+            split = split_reference(messages)
+            if split is None:
+                continue
+            history, reference = split
+            for variant, instruction in variants.items():
+                request_id = f"{variant}:{dialog_id}"
+                requests[request_id] = [Message("system", instruction)] + [
+                    x for x in history if x.role != "system"
+                ]
+                references[request_id] = (variant, dialog_id, reference)
+        return requests, references
+
+    def run(self):
+        dialogs = load_dialogs(self.dialogs_path, self.store_path)
+        if self.max_dialogs:
+            dialogs = dict(list(dialogs.items())[: self.max_dialogs])
+        requests, references = self.make_requests(dialogs)
+        if not requests:
+            logger.info("No dialogs with an assistant response to replay.")
+            return {}
+        logger.info(f"Replaying {len(dialogs)} dialogs as {len(requests)} batch requests")
+
+        backend = self.make_backend()
+        results = backend.run_batch(
+            requests, poll_interval=self.poll_interval, timeout=self.timeout or None
+        )
+        summary = {}
+        with open(os.path.expanduser(self.output_path), "w") as f:
+            for request_id, result in results.items():
+                variant, dialog_id, reference = references[request_id]
+                similarity = None
+                if result.content is not None:
+                    similarity = difflib.SequenceMatcher(None, result.content, reference).ratio()
+                record = {
+                    "id": request_id,
+                    "variant": variant,
+                    "dialog_id": dialog_id,
+                    "response": result.content,
+                    "reference": reference,
+                    "similarity": similarity,
+                    "error": result.error,
+                    **dict(zip(USAGE_FIELDS, result.usage)),
+                }
+                f.write(json.dumps(record) + "\n")
+                stats = summary.setdefault(variant, {"requests": 0, "errors": 0, "similarity": 0.})
+                stats["requests"] += 1
+                stats["errors"] += result.error is not None
+                stats["similarity"] += similarity or 0.
+                for key, value in zip(USAGE_FIELDS, result.usage):
+                    stats[key] = stats.get(key, 0) + value
+        for variant, stats in summary.items():
+            n_ok = stats["requests"] - stats["errors"]
+            stats["similarity"] = stats["similarity"] / n_ok if n_ok else 0.
+            logger.info(f"{variant}: {stats}")
+        return summary
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    BatchEval.parse_args().run()
@@ -0,0 +1,248 @@
+import json
+import multiprocessing
+import os
+import re
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field, asdict, replace
+from typing import List, Set
+
+from codebuddy.script import Script
+from codebuddy.workspace import WorkspaceManager
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Spaces calls evenly so that all processes together make at most `requests_per_minute`.
+
+    The next free slot is kept in shared memory, so the limiter must be passed to worker
+    processes when they are created (e.g. through a pool initializer).
+    """
+
+    def __init__(self, requests_per_minute: float):
+        self.interval = 60. / requests_per_minute if requests_per_minute > 0 else 0.
+        self._next_slot = multiprocessing.Value("d", 0.)
+
+    def wait(self):
+        """Blocks until the caller may make a request."""
+        if not self.interval:
+            return
+        with self._next_slot.get_lock():
+            now = time.time()
+            slot = max(now, self._next_slot.value)
+            self._next_slot.value = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def load_tasks(path: str) -> List[dict]:
+    """Reads tasks from a JSONL file. Tasks without an id are numbered by line."""
+    tasks = []
+    with open(os.path.expanduser(path), "r") as f:
+        for idx, line in enumerate(f):
+            if not line.strip():
+                continue
+            task = json.loads(line)
+            task["id"] = str(task.get("id", idx))
+            if "prompt" in task:
+                task["prompts"] = [task.pop("prompt")]
+            tasks.append(task)
+    return tasks
+
+
+def completed_ids(path: str, retry_failed: bool = True) -> Set[str]:
+    """Returns the ids of tasks that already have a result in an output file."""
+    path = os.path.expanduser(path)
+    if not os.path.exists(path):
+        return set()
+    ids = set()
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if result.get("status") == "ok" or not retry_failed:
+                ids.add(str(result["id"]))
+    return ids
+
+
+def _safe_name(task_id: str) -> str:
+    """Returns a task id that can be used in tmux session names and paths."""
+    return re.sub(r"[^A-Za-z0-9_-]", "_", task_id)
+
+
+_rate_limiter = None
+
+
+def _initialize_worker(rate_limiter: RateLimiter):
+    global _rate_limiter
+    _rate_limiter = rate_limiter
+
+
+def _run_task(config: dict, task: dict) -> dict:
+    """Runs one task in a worker process and returns its result."""
+    from codebuddy.tmux_module import TMUX_MODULES
+
+    name = _safe_name(task["id"])
+    project_path = os.path.expanduser(task.get("project_path", config["project_path"]))
+    result = {
+        "id": task["id"],
+        "workspace": os.path.join(config["workspace_dir"], name),
+        "started": time.time(),
+    }
+    module = None
+    # Kept workspaces are left for inspection, so they are not garbage collected
+    manager = WorkspaceManager(
+        root=config["workspace_dir"],
+        strategy=config["workspace_strategy"],
+        collect_garbage=not config["keep_workspaces"],
+    )
+    try:
+        workspace = manager.create(project_path, name)
+        result["workspace_strategy"] = workspace.strategy
+        module = TMUX_MODULES[task.get("backend", config["backend"])](
+            config_path=config["config_path"],
+            max_calls=task.get("max_calls", config["max_calls"]),
+            python_env=task.get("python_env", config["python_env"]),
+            # The module keeps its checkpoints in the workspace, which is removed or kept below
+            workspace=replace(workspace, manager=None),
+            python_executor=config["python_executor"],
+            terminal_session_id=f"batch-{name}",
+            python_session_id=f"batch-{name}-python",
+        )
+        if _rate_limiter is not None:
+            # Every LLM call made by this worker waits for a shared slot
+            call_api = module.call_api
+
+            def rate_limited_call_api(*args, **kwargs):
+                _rate_limiter.wait()
+                return call_api(*args, **kwargs)
+
+            module.call_api = rate_limited_call_api
+        for prompt in task["prompts"]:
+            for _ in module(prompt):
+                pass
+        result["status"] = "ok"
+    except Exception as ex:
+        logger.exception(f"Task {task['id']} failed")
+        result["status"] = "error"
+        result["error"] = f"{type(ex).__name__}: {ex}"
+        result["traceback"] = traceback.format_exc()
+    finally:
+        if module is not None:
+            result["messages"] = [asdict(x) for x in module.messages]
+            result["tokens"] = module.tokens
+            module.close()
+        if not config["keep_workspaces"]:
+            manager.remove(name)
+        else:
+            # Kept overlays would stay mounted after the worker exits
+            manager.detach(name)
+    result["duration"] = time.time() - result["started"]
+    return result
+
+
+@dataclass
+class BatchRunner(Script):
+    """Run scripted coding tasks from a JSONL file across worker processes.
+
+    Each line of the task file is a JSON object with a list of `prompts` (or a single `prompt`)
+    and optionally an `id`, `project_path`, `python_env`, `backend` and `max_calls`. Each task
+    runs on its own copy of the project with its own tmux sessions. Results are appended to the
+    output file as tasks finish, and tasks that already have a result are skipped on restart.
+    """
+    tasks_path: str = field(default="tasks.jsonl", metadata={"help": "Path to the JSONL task file."})
+    output_path: str = field(
+        default="results.jsonl", metadata={"help": "Path to the JSONL file results are appended to."}
+    )
+    backend: str = field(default="openai", metadata={"help": "Backend name"})
+    prompt_name: str = field(
+        default="codebuddy-openai", metadata={"help": "The name of the prompt config yaml file."}
+    )
+    max_calls: int = field(default=5, metadata={"help": "Maximum number of LLM API calls per message."})
+    python_env: str = field(
+        default=os.path.dirname(os.path.dirname(__file__)) + "/codebuddy-venv",
+        metadata={"help": "Path to the Python environment."}
+    )
+    project_path: str = field(
+        default="~/demo", metadata={"help": "Project directory copied for tasks that do not set one."}
+    )
+    python_executor: str = field(
+        default="pipe",
+        metadata={"help": 'Run ipython blocks in a "tmux" python session or a "pipe" worker.'}
+    )
+    workers: int = field(default=4, metadata={"help": "Number of worker processes."})
+    requests_per_minute: float = field(
+        default=0, metadata={"help": "Global limit on LLM requests per minute. 0 disables the limit."}
+    )
+    workspace_dir: str = field(
+        default="/tmp/codebuddy-batch", metadata={"help": "Directory for the per-task project copies."}
+    )
+    workspace_strategy: str = field(
+        default="auto",
+        metadata={"help": "How project copies are made: auto, overlay, reflink, hardlink or copy."}
+    )
+    keep_workspaces: bool = field(
+        default=True, metadata={"help": "If True, keeps each task's project copy after it finishes."}
+    )
+    retry_failed: bool = field(
+        default=True, metadata={"help": "If True, reruns tasks whose previous result was an error."}
+    )
+
+    def run(self):
+        prompt_basepath = os.path.dirname(os.path.dirname(__file__))
+        config = {
+            "config_path": os.path.join(prompt_basepath, "prompts", self.prompt_name + ".yaml"),
+            "backend": self.backend,
+            "max_calls": self.max_calls,
+            "python_env": self.python_env,
+            "project_path": self.project_path,
+            "python_executor": self.python_executor,
+            "workspace_dir": os.path.expanduser(self.workspace_dir),
+            "workspace_strategy": self.workspace_strategy,
+            "keep_workspaces": self.keep_workspaces,
+        }
+        os.makedirs(config["workspace_dir"], exist_ok=True)
+        output_path = os.path.expanduser(self.output_path)
+        done = completed_ids(output_path, retry_failed=self.retry_failed)
+        tasks = [x for x in load_tasks(self.tasks_path) if x["id"] not in done]
+        logger.info(f"Running {len(tasks)} tasks ({len(done)} already completed)")
+
+        start = time.time()
+        n_failed = 0
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_initialize_worker,
+            initargs=(RateLimiter(self.requests_per_minute),),
+        ) as executor, open(output_path, "a") as output:
+            futures = {executor.submit(_run_task, config, task): task for task in tasks}
+            for idx, future in enumerate(as_completed(futures)):
+                try:
+                    result = future.result()
+                except Exception as ex:
+                    # The worker process died
+                    task = futures[future]
+                    result = {"id": task["id"], "status": "error", "error": f"{type(ex).__name__}: {ex}"}
+                n_failed += result["status"] != "ok"
+                output.write(json.dumps(result) + "\n")
+                output.flush()
+                logger.info(
+                    f"[{idx + 1}/{len(tasks)}] Task {result['id']}: {result['status']} "
+                    f"in {result.get('duration', 0):.1f}s"
+                )
+        logger.info(
+            f"Finished {len(tasks)} tasks in {time.time() - start:.1f}s with {n_failed} failures"
+        )
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    BatchRunner.parse_args().run()
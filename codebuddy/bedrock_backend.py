@@ -1,11 +1,12 @@
 import json
 import time
-from dataclasses import dataclass, field, asdict
-from typing import List, Tuple
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Tuple
 
 import boto3
 
-from codebuddy.backend import Backend
+from codebuddy.backend import Backend, BatchResult
 from codebuddy.utils import Message
 
 
@@ -13,6 +14,30 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+def _split_s3_uri(uri: str) -> Tuple[str, str]:
+    """Returns the bucket and key of an s3:// URI."""
+    bucket, _, key = uri[len("s3://"):].partition("/")
+    return bucket, key
+
+
+def parse_bedrock_batch_record(record: dict) -> BatchResult:
+    """Returns the result of one record of a Bedrock batch inference output file."""
+    if record.get("error") or "modelOutput" not in record:
+        return BatchResult(record["recordId"], error=str(record.get("error") or "No model output."))
+    output = record["modelOutput"]
+    usage = output.get("usage") or {}
+    return BatchResult(
+        record["recordId"],
+        content="".join(x["text"] for x in output.get("content") or [] if x["type"] == "text"),
+        usage=(
+            usage.get("input_tokens") or 0,
+            usage.get("output_tokens") or 0,
+            usage.get("cache_read_input_tokens") or 0,
+            usage.get("cache_creation_input_tokens") or 0,
+        ),
+    )
+
+
 @dataclass
 class BedrockBackend(Backend):
     """Backend for Claude models on the AWS Bedrock API."""
@@ -40,6 +65,23 @@ class BedrockBackend(Backend):
     anthropic_version: str = field(
         metadata={"help": "The version of the Anthropic API to use"}, default="bedrock-2023-05-31"
     )
+    prompt_caching: bool = field(
+        metadata={
+            "help": (
+                "If True, adds prompt cache breakpoints after the first system message and the "
+                "last history turn. Requires a model that supports prompt caching."
+            )
+        },
+        default=False,
+    )
+    batch_s3_uri: str = field(
+        metadata={"help": "S3 prefix (s3://bucket/prefix) for batch inference inputs and outputs"},
+        default="",
+    )
+    batch_role_arn: str = field(
+        metadata={"help": "ARN of the service role that batch inference jobs run with"},
+        default="",
+    )
 
     def request_base(self):
         return {
@@ -51,36 +93,209 @@ class BedrockBackend(Backend):
             ]
         }
 
-    def call_api(self, messages: List[Message], retries: int = 0) -> str:
-        bedrock = boto3.client(service_name="bedrock-runtime")
+    @staticmethod
+    def format_message(msg: Message) -> dict:
+        """Returns a message in the format of the Anthropic messages API.
+
+        Tool calls become tool use blocks, and tool messages become user messages with a tool
+        result block.
+        """
+        if msg.role == "tool":
+            result = {"type": "tool_result", "tool_use_id": msg.tool_call_id}
+            return {"role": "user", "content": [{**result, "content": msg.content}]}
+        if not msg.tool_calls:
+            return {"role": msg.role, "content": msg.content}
+        content = [{"type": "text", "text": msg.content}] if msg.content else []
+        content += [
+            {
+                "type": "tool_use",
+                "id": x["id"],
+                "name": x["name"],
+                "input": x["arguments"] if isinstance(x["arguments"], dict) else {},
+            }
+            for x in msg.tool_calls
+        ]
+        return {"role": msg.role, "content": content}
+
+    def format_messages(self, messages: List[Message]) -> List[dict]:
+        """Returns request messages. Tool results and any user message that follows them are
+        merged into one user message, since roles must alternate."""
+        formatted = []
+        for msg in messages:
+            item = self.format_message(msg)
+            previous = formatted[-1] if formatted else None
+            if (
+                previous is not None and previous["role"] == item["role"] == "user"
+                and isinstance(previous["content"], list)
+            ):
+                if isinstance(item["content"], str):
+                    item["content"] = [{"type": "text", "text": item["content"]}]
+                previous["content"] += item["content"]
+            else:
+                formatted.append(item)
+        return formatted
+
+    def request_body(self, messages: List[Message], tools: List[dict] = None) -> dict:
+        """Returns the request body for a list of messages.
+
+        Leading system messages become system prompt blocks. With prompt caching enabled, the
+        first system block and the last history turn before the new message are marked as cache
+        breakpoints, so the stable prefix of the conversation is read from the cache.
+        """
         body = self.request_base()
-        if messages[0].role == "system":
-            body["messages"] = [asdict(msg) for msg in messages[1:]]
-            body["system"] = messages[0].content
-        else:
-            body["messages"] = [asdict(msg) for msg in messages]
+        n_system = next(
+            (idx for idx, msg in enumerate(messages) if msg.role != "system"), len(messages)
+        )
+        system = [msg.content for msg in messages[:n_system] if msg.content]
+        body["messages"] = self.format_messages(messages[n_system:])
+        if tools:
+            body["tools"] = [
+                {
+                    "name": x["name"],
+                    "description": x["description"],
+                    "input_schema": x["parameters"],
+                }
+                for x in tools
+            ]
+        if not self.prompt_caching:
+            if system:
+                body["system"] = "".join(system)
+            return body
 
+        cache_control = {"type": "ephemeral"}
+        if system:
+            body["system"] = [{"type": "text", "text": x} for x in system]
+            body["system"][0]["cache_control"] = cache_control
+        if len(body["messages"]) > 1:
+            msg = body["messages"][-2]
+            if isinstance(msg["content"], str):
+                msg["content"] = [{"type": "text", "text": msg["content"]}]
+            msg["content"][-1]["cache_control"] = cache_control
+        return body
+
+    def _send(self, method: str, body: dict, retries: int = 0) -> dict:
+        """Sends a request with a bedrock-runtime client method, retrying throttled requests and
+        expired tokens, and returns the response."""
+        bedrock = boto3.client(service_name="bedrock-runtime")
         try:
-            response = bedrock.invoke_model(body=json.dumps(body), modelId=self.model_id)
-            response_body = json.loads(response.get("body").read())
-            response_content = response_body.get("content")[0]["text"]
+            return getattr(bedrock, method)(body=json.dumps(body), modelId=self.model_id)
 
         except Exception as ex:
             if "ThrottlingException" in str(ex) and retries < 3:
                 logger.info("Throttled. Sleeping for 5s and trying again.")
                 time.sleep(5)
-                return self.call_api(messages, retries=retries + 1)
+                return self._send(method, body, retries=retries + 1)
             elif "ExpiredTokenException" in str(ex) and retries < 3:
                 logger.info("Token expired. Refreshing and trying again.")
                 from importlib import reload
                 reload(boto3)
-                return self.call_api(messages, retries=retries + 1)
+                return self._send(method, body, retries=retries + 1)
             else:
                 raise ex
 
-        self.input_tokens.append(response_body["usage"]["input_tokens"])
-        self.output_tokens.append(response_body["usage"]["output_tokens"])
-        return response_content
+    def _record_usage(self, usage: dict):
+        self.input_tokens.append(usage.get("input_tokens") or 0)
+        self.output_tokens.append(usage.get("output_tokens") or 0)
+        self.cache_read_tokens.append(usage.get("cache_read_input_tokens") or 0)
+        self.cache_write_tokens.append(usage.get("cache_creation_input_tokens") or 0)
+
+    def _invoke(self, body: dict, retries: int = 0) -> dict:
+        """Sends a request and returns the response body after updating the token counts."""
+        response = self._send("invoke_model", body, retries=retries)
+        response_body = json.loads(response.get("body").read())
+        self._record_usage(response_body["usage"])
+        return response_body
+
+    def stream_api(self, messages: List[Message], retries: int = 0) -> Iterator[str]:
+        response = self._send(
+            "invoke_model_with_response_stream", self.request_body(messages), retries=retries
+        )
+        stream = response.get("body")
+        usage = {}
+        n_pieces = 0
+        try:
+            for event in stream:
+                chunk = json.loads(event["chunk"]["bytes"])
+                if chunk["type"] == "message_start":
+                    usage.update(chunk["message"].get("usage") or {})
+                elif chunk["type"] == "message_delta":
+                    usage.update(chunk.get("usage") or {})
+                elif chunk["type"] == "content_block_delta" and "text" in chunk["delta"]:
+                    n_pieces += 1
+                    yield chunk["delta"]["text"]
+        except GeneratorExit:
+            # Closing the stream stops generation. Output tokens are estimated as one per chunk.
+            stream.close()
+            self._record_usage({**usage, "output_tokens": n_pieces})
+            raise
+        self._record_usage(usage)
+
+    def call_api(self, messages: List[Message], retries: int = 0) -> str:
+        response_body = self._invoke(self.request_body(messages), retries=retries)
+        return response_body.get("content")[0]["text"]
+
+    def call_api_with_tools(
+        self, messages: List[Message], tools: List[dict], retries: int = 0
+    ) -> Message:
+        response_body = self._invoke(self.request_body(messages, tools), retries=retries)
+        blocks = response_body.get("content") or []
+        tool_calls = [
+            {"id": x["id"], "name": x["name"], "arguments": x.get("input") or {}}
+            for x in blocks if x["type"] == "tool_use"
+        ]
+        content = "".join(x["text"] for x in blocks if x["type"] == "text")
+        return Message("assistant", content, tool_calls=tool_calls or None)
+
+    def submit_batch(self, requests: Dict[str, List[Message]]) -> str:
+        """Uploads the requests to S3 and starts a batch inference job. Returns the job ARN.
+
+        Bedrock requires a minimum number of records per job (100 at the time of writing).
+        """
+        if not self.batch_s3_uri or not self.batch_role_arn:
+            raise ValueError("Batch inference requires batch_s3_uri and batch_role_arn.")
+        job_name = f"codebuddy-{uuid.uuid4().hex[:12]}"
+        prefix = f"{self.batch_s3_uri.rstrip('/')}/{job_name}"
+        data = "".join(
+            json.dumps({"recordId": k, "modelInput": self.request_body(v)}) + "\n"
+            for k, v in requests.items()
+        )
+        bucket, key = _split_s3_uri(f"{prefix}/input.jsonl")
+        boto3.client("s3").put_object(Bucket=bucket, Key=key, Body=data.encode())
+        job = boto3.client("bedrock").create_model_invocation_job(
+            jobName=job_name,
+            roleArn=self.batch_role_arn,
+            modelId=self.model_id,
+            inputDataConfig={"s3InputDataConfig": {"s3Uri": f"{prefix}/input.jsonl"}},
+            outputDataConfig={"s3OutputDataConfig": {"s3Uri": f"{prefix}/output/"}},
+        )
+        return job["jobArn"]
+
+    def batch_status(self, batch_id: str) -> str:
+        status = boto3.client("bedrock").get_model_invocation_job(jobIdentifier=batch_id)["status"]
+        # Partially completed and expired jobs keep the results of the records that completed
+        if status in ("Completed", "PartiallyCompleted", "Expired"):
+            return "completed"
+        if status in ("Failed", "Stopping", "Stopped"):
+            return "failed"
+        return "running"
+
+    def batch_results(self, batch_id: str) -> Dict[str, BatchResult]:
+        job = boto3.client("bedrock").get_model_invocation_job(jobIdentifier=batch_id)
+        output_uri = job["outputDataConfig"]["s3OutputDataConfig"]["s3Uri"].rstrip("/")
+        # Outputs are written under a folder named after the job id, the last part of the ARN
+        bucket, prefix = _split_s3_uri(f"{output_uri}/{batch_id.split('/')[-1]}/")
+        s3 = boto3.client("s3")
+        results = {}
+        for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+            for item in page.get("Contents", []):
+                if not item["Key"].endswith(".jsonl.out"):
+                    continue
+                body = s3.get_object(Bucket=bucket, Key=item["Key"])["Body"].read().decode()
+                for line in body.splitlines():
+                    if line.strip():
+                        result = parse_bedrock_batch_record(json.loads(line))
+                        results[result.request_id] = result
+        return results
 
 
 if __name__ == "__main__":
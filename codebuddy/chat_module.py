@@ -1,12 +1,15 @@
 import os
+import uuid
 from dataclasses import dataclass, field, asdict
-from typing import List
+from typing import List, Sequence
 
 import yaml
 
 from codebuddy.backend import Backend
 from codebuddy.openai_backend import OpenaiBackend
 from codebuddy.bedrock_backend import BedrockBackend
+from codebuddy.http_backend import HttpBackend
+from codebuddy.conversation_store import ConversationStore, DialogHistory
 from codebuddy.script import Script
 from codebuddy.utils import Dialog, Message
 
@@ -39,9 +42,26 @@ class ChatModule(Backend):
         default_factory=lambda: [],
         metadata={"help": "A list of messages in the dialog"},
     )
-    dialog_history: List[Dialog] = field(
+    dialog_history: Sequence[Dialog] = field(
         default_factory=lambda: [], metadata={"help": "A history of dialogs"}
     )
+    store_path: str = field(
+        metadata={
+            "help": (
+                "Path to a SQLite conversation store. If set, messages are persisted as they are "
+                "produced and past dialogs are loaded from the store on demand."
+            )
+        },
+        default="",
+    )
+    conversation_id: str = field(
+        metadata={"help": "Id of this conversation in the store. Defaults to a new id."},
+        default="",
+    )
+    max_cached_dialogs: int = field(
+        metadata={"help": "Number of past dialogs kept in memory when using a store"},
+        default=10,
+    )
 
     def __post_init__(self):
         self.config_path = os.path.expanduser(self.config_path)
@@ -50,6 +70,21 @@ class ChatModule(Backend):
                 module_data = yaml.safe_load(file)
             for field_name, value in module_data.items():
                 setattr(self, field_name, value)
+        self._initialize_store()
+
+    def _initialize_store(self):
+        """Replaces the in-memory dialog history with one backed by a conversation store."""
+        if not self.store_path:
+            return
+        self.conversation_id = self.conversation_id or uuid.uuid4().hex
+        self.dialog_history = DialogHistory(
+            ConversationStore(self.store_path), self.conversation_id, self.max_cached_dialogs
+        )
+
+    def _record_messages(self):
+        """Writes new messages to the conversation store, if there is one."""
+        if isinstance(self.dialog_history, DialogHistory):
+            self.dialog_history.record(self.messages)
 
     def clear(self):
         """Clear the message history."""
@@ -60,10 +95,13 @@ class ChatModule(Backend):
     def __call__(self, msg: str, messages: List[Message] = None, clear: bool = False) -> str:
         if messages is not None:
             self.messages = messages
+            self._record_messages()
         if clear:
             self.clear()
         for chunk in self.forward(msg):
+            self._record_messages()
             yield chunk
+        self._record_messages()
         logger.info(f"Total tokens: {self.tokens}")
 
     def get_gradio_interface(self, **kwargs):
@@ -122,9 +160,15 @@ class BedrockChatModule(ChatModule, BedrockBackend):
     """A chat module using BedrockBackend."""
 
 
+@dataclass
+class LocalChatModule(ChatModule, HttpBackend):
+    """A chat module using HttpBackend."""
+
+
 CHAT_MODULES = {
     "openai": OpenaiChatModule,
-    "bedrock": BedrockChatModule
+    "bedrock": BedrockChatModule,
+    "local": LocalChatModule,
 }
 
 @dataclass
@@ -132,11 +176,12 @@ class ChatbotLauncher(Script):
     """Launch a OpenAI chatbot gradio gui."""
     backend: str = field(default="openai", metadata={"help": "Backend name"})
     prompt_name: str = field(default="omni", metadata={"help": "The name of the prompt config yaml file."})
+    store_path: str = field(default="", metadata={"help": "Path to a SQLite conversation store."})
 
     def run(self):
         prompt_basepath = os.path.dirname(os.path.dirname(__file__))
         prompt_path = os.path.join(prompt_basepath, "prompts", self.prompt_name + ".yaml")
-        module = CHAT_MODULES[self.backend](config_path=prompt_path)
+        module = CHAT_MODULES[self.backend](config_path=prompt_path, store_path=self.store_path)
         gui = module.get_gradio_interface()
         gui.launch(share=False)
 
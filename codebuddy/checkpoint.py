@@ -0,0 +1,318 @@
+import difflib
+import fcntl
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional
+
+from codebuddy.script import Script
+from codebuddy.utils import clone_file
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _hash_file(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+@dataclass
+class CheckpointStore:
+    """Content-addressed checkpoints of a project directory.
+
+    Every file version is stored once as a read-only blob named by its hash, and a checkpoint is
+    a manifest of paths, hashes and stats. Files whose size, mtime and inode match the previous
+    checkpoint reuse its hash without being read, so a checkpoint only reads and stores the files
+    that changed. Blobs are reflinked when the filesystem supports it and copied otherwise.
+
+    Several threads or processes can share a store: creating a checkpoint holds a lock on it, and
+    a checkpoint is not written unless every file could be stored.
+    """
+
+    project_path: str = "~/demo"  #: Directory to checkpoint
+    root: str = ""  #: Directory for blobs and manifests. Defaults to ~/.codebuddy/checkpoints/<project>
+    exclude_dirs: List[str] = field(
+        default_factory=lambda: [
+            ".git", "node_modules", "__pycache__", ".venv", "venv", ".mypy_cache", ".pytest_cache",
+            ".tox",
+        ]
+    )  #: Directory names that are not checkpointed
+    max_file_bytes: int = 50_000_000  #: Larger files are not checkpointed
+    max_checkpoints: int = 100  #: Older checkpoints are pruned
+
+    def __post_init__(self):
+        self.project_path = os.path.realpath(os.path.expanduser(self.project_path))
+        if not self.root:
+            digest = hashlib.sha256(self.project_path.encode()).hexdigest()[:8]
+            self.root = os.path.join(
+                "~/.codebuddy/checkpoints", f"{os.path.basename(self.project_path)}-{digest}"
+            )
+        self.root = os.path.expanduser(self.root)
+        os.makedirs(os.path.join(self.root, "blobs"), exist_ok=True)
+        os.makedirs(os.path.join(self.root, "manifests"), exist_ok=True)
+
+    @contextmanager
+    def _lock(self) -> Iterator[None]:
+        """Holds an exclusive lock on the store. Locks are per open file, so threads of one
+        process exclude each other as well as other processes."""
+        with open(os.path.join(self.root, "lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, "blobs", digest[:2], digest)
+
+    def _manifest_path(self, checkpoint_id: int) -> str:
+        return os.path.join(self.root, "manifests", f"{checkpoint_id:06d}.json")
+
+    def _scan(self) -> Dict[str, list]:
+        """Returns [mode, size, mtime_ns, inode] for every file in the project by relative path."""
+        files = {}
+        for root, dirs, names in os.walk(self.project_path):
+            dirs[:] = [x for x in dirs if x not in self.exclude_dirs]
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.lstat(path)
+                except OSError:
+                    continue
+                if stat.S_ISREG(st.st_mode) and st.st_size <= self.max_file_bytes:
+                    rel_path = os.path.relpath(path, self.project_path)
+                    files[rel_path] = [st.st_mode, st.st_size, st.st_mtime_ns, st.st_ino]
+        return files
+
+    def _store(self, path: str) -> str:
+        """Stores a file as a blob and returns its hash."""
+        digest = _hash_file(path)
+        blob_path = self._blob_path(digest)
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(blob_path))
+            os.close(fd)
+            try:
+                clone_file(path, tmp_path)
+                os.chmod(tmp_path, 0o444)
+                os.replace(tmp_path, blob_path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        return digest
+
+    def ids(self) -> List[int]:
+        """Returns the ids of all checkpoints, oldest first."""
+        names = os.listdir(os.path.join(self.root, "manifests"))
+        return sorted(int(x[:-5]) for x in names if x.endswith(".json"))
+
+    def load(self, checkpoint_id: int) -> dict:
+        """Returns a checkpoint manifest."""
+        path = self._manifest_path(checkpoint_id)
+        if not os.path.exists(path):
+            raise KeyError(f"Checkpoint {checkpoint_id} does not exist.")
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def _current(self, previous: Optional[dict]) -> Dict[str, dict]:
+        """Returns the hash and stats of every project file, storing blobs for changed files.
+
+        Files deleted since the scan are left out. Raises OSError if any other file cannot be
+        stored, since a restore would delete the files missing from a checkpoint.
+        """
+        previous_files = previous["files"] if previous else {}
+        files = {}
+        for rel_path, stats in self._scan().items():
+            entry = previous_files.get(rel_path)
+            if entry is not None and entry["stat"] == stats:
+                files[rel_path] = entry
+                continue
+            path = os.path.join(self.project_path, rel_path)
+            try:
+                digest = self._store(path)
+            except FileNotFoundError:
+                if os.path.lexists(path):
+                    raise
+                continue
+            files[rel_path] = {"hash": digest, "stat": stats}
+        return files
+
+    def create(self, label: str = "") -> int:
+        """Checkpoints the project and returns the checkpoint id.
+
+        If nothing changed since the latest checkpoint, its id is returned instead. Raises OSError,
+        without writing a checkpoint, if a file cannot be stored.
+        """
+        with self._lock():
+            return self._create(label)
+
+    def _create(self, label: str) -> int:
+        ids = self.ids()
+        previous = self.load(ids[-1]) if ids else None
+        files = self._current(previous)
+        if previous is not None and {k: v["hash"] for k, v in files.items()} == {
+            k: v["hash"] for k, v in previous["files"].items()
+        }:
+            if files != previous["files"]:
+                # Refresh stats so the next checkpoint can skip these files
+                previous["files"] = files
+                self._write_manifest(previous)
+            return previous["id"]
+
+        checkpoint_id = ids[-1] + 1 if ids else 1
+        self._write_manifest(
+            {"id": checkpoint_id, "label": label, "created": time.time(), "files": files}
+        )
+        logger.info(f"Created checkpoint {checkpoint_id}: {label}")
+        if len(ids) + 1 > self.max_checkpoints:
+            self._prune(self.max_checkpoints)
+        return checkpoint_id
+
+    def _write_manifest(self, manifest: dict):
+        path = self._manifest_path(manifest["id"])
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+        with os.fdopen(fd, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+
+    def list(self) -> List[dict]:
+        """Returns the id, label, creation time and number of files of every checkpoint."""
+        checkpoints = []
+        for checkpoint_id in self.ids():
+            manifest = self.load(checkpoint_id)
+            checkpoints.append({
+                "id": checkpoint_id,
+                "label": manifest["label"],
+                "created": manifest["created"],
+                "files": len(manifest["files"]),
+            })
+        return checkpoints
+
+    def _hashes(self, checkpoint_id: Optional[int]) -> Dict[str, str]:
+        """Returns the file hashes of a checkpoint, or of the working tree if the id is None."""
+        if checkpoint_id is not None:
+            return {k: v["hash"] for k, v in self.load(checkpoint_id)["files"].items()}
+        with self._lock():
+            ids = self.ids()
+            files = self._current(self.load(ids[-1]) if ids else None)
+        return {k: v["hash"] for k, v in files.items()}
+
+    def diff(self, checkpoint_id: int, other_id: Optional[int] = None) -> Dict[str, List[str]]:
+        """Returns the files added, removed and modified between a checkpoint and another one.
+
+        If `other_id` is None, the checkpoint is compared to the current project.
+        """
+        old, new = self._hashes(checkpoint_id), self._hashes(other_id)
+        return {
+            "added": sorted(new.keys() - old.keys()),
+            "removed": sorted(old.keys() - new.keys()),
+            "modified": sorted(k for k in old.keys() & new.keys() if old[k] != new[k]),
+        }
+
+    def _read(self, digest: Optional[str], path: str) -> List[str]:
+        """Returns the lines of a blob, or of a project file if the digest is None."""
+        if digest is None and not os.path.exists(path):
+            return []
+        with open(self._blob_path(digest) if digest else path, "r", errors="replace") as f:
+            return f.readlines()
+
+    def unified_diff(self, checkpoint_id: int, other_id: Optional[int] = None) -> str:
+        """Returns a unified diff of the text changes between a checkpoint and another one."""
+        old, new = self._hashes(checkpoint_id), self._hashes(other_id)
+        changes = self.diff(checkpoint_id, other_id)
+        lines = []
+        for rel_path in sorted(changes["added"] + changes["removed"] + changes["modified"]):
+            old_lines = self._read(old[rel_path], "") if rel_path in old else []
+            if rel_path not in new:
+                new_lines = []
+            elif other_id is None:
+                new_lines = self._read(None, os.path.join(self.project_path, rel_path))
+            else:
+                new_lines = self._read(new[rel_path], "")
+            lines += difflib.unified_diff(old_lines, new_lines, f"a/{rel_path}", f"b/{rel_path}")
+        return "".join(lines)
+
+    def restore(self, checkpoint_id: int, paths: Optional[List[str]] = None) -> List[str]:
+        """Restores the project, or only the given relative paths, to a checkpoint.
+
+        Files that are unchanged are not touched, and files created after the checkpoint are
+        deleted. The current state is checkpointed first, so a restore can be undone. Returns
+        the paths that were changed.
+        """
+        manifest = self.load(checkpoint_id)
+        current = self.load(self.create(f"Before restoring checkpoint {checkpoint_id}"))["files"]
+        wanted = set(paths) if paths is not None else set(manifest["files"]) | set(current)
+        changed = []
+        for rel_path in sorted(wanted):
+            path = os.path.join(self.project_path, rel_path)
+            entry = manifest["files"].get(rel_path)
+            if entry is None:
+                if rel_path in current:
+                    os.remove(path)
+                    changed.append(rel_path)
+                continue
+            if rel_path in current and current[rel_path]["hash"] == entry["hash"]:
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.lexists(path):
+                os.remove(path)
+            clone_file(self._blob_path(entry["hash"]), path)
+            os.chmod(path, stat.S_IMODE(entry["stat"][0]))
+            changed.append(rel_path)
+        logger.info(f"Restored {len(changed)} files to checkpoint {checkpoint_id}")
+        return changed
+
+    def prune(self, keep: int):
+        """Deletes all but the latest `keep` checkpoints and the blobs only they reference."""
+        with self._lock():
+            self._prune(keep)
+
+    def _prune(self, keep: int):
+        ids = self.ids()
+        for checkpoint_id in ids[: max(len(ids) - keep, 0)]:
+            os.remove(self._manifest_path(checkpoint_id))
+        referenced = set()
+        for checkpoint_id in self.ids():
+            referenced |= {x["hash"] for x in self.load(checkpoint_id)["files"].values()}
+        blob_dir = os.path.join(self.root, "blobs")
+        for prefix in os.listdir(blob_dir):
+            for name in os.listdir(os.path.join(blob_dir, prefix)):
+                if name not in referenced:
+                    os.remove(os.path.join(blob_dir, prefix, name))
+
+
+@dataclass
+class Checkpoints(Script):
+    """List, diff or restore the checkpoints of a project."""
+    project_path: str = field(default="~/demo", metadata={"help": "Path to the project directory."})
+    action: str = field(default="list", metadata={"help": "One of list, diff or restore."})
+    checkpoint_id: int = field(default=0, metadata={"help": "Checkpoint to diff or restore."})
+
+    def run(self):
+        store = CheckpointStore(project_path=self.project_path)
+        if self.action == "list":
+            for x in store.list():
+                created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(x["created"]))
+                print(f"{x['id']}\t{created}\t{x['files']} files\t{x['label']}")
+        elif self.action == "diff":
+            print(store.unified_diff(self.checkpoint_id))
+        elif self.action == "restore":
+            for path in store.restore(self.checkpoint_id):
+                print(f"Restored {path}")
+        else:
+            raise ValueError(f"Unknown action {self.action}.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    Checkpoints.parse_args().run()
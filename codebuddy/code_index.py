@@ -0,0 +1,290 @@
+import ast
+import math
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+from codebuddy.utils import TRIPLE_BACKTICKS
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+TOKEN_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+SUBWORD_PATTERN = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+JS_SYMBOL_PATTERNS = [
+    ("function", re.compile(r"^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\s*\*?\s*([A-Za-z_$][\w$]*)")),
+    ("class", re.compile(r"^\s*(?:export\s+)?(?:default\s+)?(?:abstract\s+)?class\s+([A-Za-z_$][\w$]*)")),
+    ("function", re.compile(
+        r"^\s*(?:export\s+)?(?:const|let|var)\s+([A-Za-z_$][\w$]*)\s*(?::[^=]+)?=\s*(?:async\s+)?"
+        r"(?:function\b|\([^)]*\)\s*(?::[^=]+)?=>|[A-Za-z_$][\w$]*\s*=>)"
+    )),
+    ("interface", re.compile(r"^\s*(?:export\s+)?(?:interface|type|enum)\s+([A-Za-z_$][\w$]*)")),
+]
+JS_EXTENSIONS = (".js", ".jsx", ".mjs", ".cjs", ".ts", ".tsx")
+
+
+def tokenize(text: str) -> List[str]:
+    """Splits text into lowercase identifier tokens, adding the parts of snake and camel case names.
+
+    Args:
+        text (str): Code or a natural language query.
+
+    Returns:
+        List[str]: Tokens such as `outputcompactor`, `output` and `compactor` for `OutputCompactor`.
+    """
+    tokens = []
+    for word in TOKEN_PATTERN.findall(text):
+        tokens.append(word.lower())
+        parts = [x.lower() for x in SUBWORD_PATTERN.findall(word)]
+        if len(parts) > 1:
+            tokens += parts
+    return tokens
+
+
+@dataclass
+class Symbol:
+    """A class or function definition."""
+
+    name: str  #: Qualified name, e.g. `Class.method`
+    kind: str  #: "class", "function" or "interface"
+    path: str  #: File path relative to the project
+    line: int  #: 1-based line number of the definition
+
+
+@dataclass
+class SearchResult:
+    """A snippet of a file that matched a query."""
+
+    path: str  #: File path relative to the project
+    start_line: int  #: 1-based first line of the snippet
+    end_line: int  #: 1-based last line of the snippet
+    score: float  #: Relevance score
+    text: str  #: The snippet
+
+    def __repr__(self):
+        return f"{self.path}:{self.start_line}-{self.end_line}"
+
+
+@dataclass
+class _IndexedFile:
+    mtime_ns: int
+    size: int
+    lines: List[str]
+    chunks: List[Tuple[int, int, Counter]]  # (start index, end index, term frequencies)
+    symbols: List[Symbol]
+
+
+def python_symbols(source: str, path: str) -> List[Symbol]:
+    """Returns the classes and functions defined in Python source, including methods."""
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return []
+    symbols = []
+
+    def visit(node, prefix):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                kind = "class" if isinstance(child, ast.ClassDef) else "function"
+                name = prefix + child.name
+                symbols.append(Symbol(name, kind, path, child.lineno))
+                visit(child, name + ".")
+
+    visit(tree, "")
+    return symbols
+
+
+def js_symbols(source: str, path: str) -> List[Symbol]:
+    """Returns the classes, functions and types defined in JavaScript or TypeScript source."""
+    symbols = []
+    for idx, line in enumerate(source.splitlines()):
+        for kind, pattern in JS_SYMBOL_PATTERNS:
+            match = pattern.match(line)
+            if match:
+                symbols.append(Symbol(match.group(1), kind, path, idx + 1))
+                break
+    return symbols
+
+
+@dataclass
+class CodeIndex:
+    """A BM25 index of the text files in a project, with Python and JavaScript symbols.
+
+    The index is built on first use. Each search re-stats the project and re-indexes only the
+    files whose mtime or size changed, so it stays current with edits made by any tool.
+    """
+
+    project_path: str = "~"  #: Root directory of the indexed project
+    extensions: List[str] = field(
+        default_factory=lambda: [
+            ".py", ".pyi", ".js", ".jsx", ".mjs", ".cjs", ".ts", ".tsx", ".md", ".rst", ".txt",
+            ".toml", ".yaml", ".yml", ".json", ".cfg", ".ini", ".sh", ".html", ".css", ".sql",
+        ]
+    )  #: File extensions to index
+    exclude_dirs: List[str] = field(
+        default_factory=lambda: [
+            ".git", "node_modules", "__pycache__", ".venv", "venv", "env", "build", "dist",
+            ".mypy_cache", ".pytest_cache", ".tox", ".idea", ".vscode",
+        ]
+    )  #: Directory names that are never indexed
+    max_file_bytes: int = 500_000  #: Larger files are skipped
+    max_files: int = 20_000  #: Stop indexing after this many files
+    chunk_lines: int = 40  #: Lines per indexed snippet
+    chunk_overlap: int = 10  #: Lines shared by consecutive snippets
+    k1: float = 1.2  #: BM25 term frequency saturation
+    b: float = 0.75  #: BM25 length normalization
+    symbol_boost: float = 2.0  #: Score added to snippets defining a symbol named in the query
+    files: Dict[str, _IndexedFile] = field(default_factory=dict)  #: Indexed files by relative path
+
+    def __post_init__(self):
+        self.project_path = os.path.expanduser(self.project_path).rstrip("/")
+        self._postings: Dict[str, Dict[Tuple[str, int], int]] = {}
+        self._lengths: Dict[Tuple[str, int], int] = {}
+        self._total_length = 0
+        self._symbols: Dict[str, List[Symbol]] = {}
+
+    def _iter_files(self):
+        extensions = tuple(self.extensions)
+        for root, dirs, files in os.walk(self.project_path):
+            dirs[:] = sorted(x for x in dirs if x not in self.exclude_dirs and not x.startswith("."))
+            for name in sorted(files):
+                if name.endswith(extensions):
+                    yield os.path.join(root, name)
+
+    def _add(self, path: str, entry: _IndexedFile):
+        self.files[path] = entry
+        for chunk_idx, (_, _, counts) in enumerate(entry.chunks):
+            key = (path, chunk_idx)
+            for term, count in counts.items():
+                self._postings.setdefault(term, {})[key] = count
+            length = sum(counts.values())
+            self._lengths[key] = length
+            self._total_length += length
+        for symbol in entry.symbols:
+            for name in {symbol.name.lower(), symbol.name.rsplit(".", 1)[-1].lower()}:
+                self._symbols.setdefault(name, []).append(symbol)
+
+    def _remove(self, path: str):
+        entry = self.files.pop(path)
+        for chunk_idx, (_, _, counts) in enumerate(entry.chunks):
+            key = (path, chunk_idx)
+            for term in counts:
+                postings = self._postings[term]
+                del postings[key]
+                if not postings:
+                    del self._postings[term]
+            self._total_length -= self._lengths.pop(key)
+        for symbol in entry.symbols:
+            for name in {symbol.name.lower(), symbol.name.rsplit(".", 1)[-1].lower()}:
+                remaining = [x for x in self._symbols.get(name, []) if x.path != path]
+                if remaining:
+                    self._symbols[name] = remaining
+                else:
+                    self._symbols.pop(name, None)
+
+    def _index_file(self, full_path: str, path: str, st: os.stat_result) -> _IndexedFile:
+        with open(full_path, "r", errors="replace") as f:
+            source = f.read()
+        lines = source.splitlines()
+        step = max(self.chunk_lines - self.chunk_overlap, 1)
+        chunks = []
+        for start in range(0, max(len(lines), 1), step):
+            end = min(start + self.chunk_lines, len(lines))
+            # The path is indexed with every chunk so that file names match queries
+            counts = Counter(tokenize(path + "\n" + "\n".join(lines[start:end])))
+            chunks.append((start, end, counts))
+            if end >= len(lines):
+                break
+        if path.endswith((".py", ".pyi")):
+            symbols = python_symbols(source, path)
+        elif path.endswith(JS_EXTENSIONS):
+            symbols = js_symbols(source, path)
+        else:
+            symbols = []
+        return _IndexedFile(st.st_mtime_ns, st.st_size, lines, chunks, symbols)
+
+    def refresh(self) -> int:
+        """Re-indexes new and modified files and drops deleted ones. Returns the number changed."""
+        seen = set()
+        changed = 0
+        for full_path in self._iter_files():
+            if len(seen) >= self.max_files:
+                logger.warning(f"Code index stopped at {self.max_files} files.")
+                break
+            path = os.path.relpath(full_path, self.project_path)
+            try:
+                st = os.stat(full_path)
+            except OSError:
+                continue
+            if st.st_size > self.max_file_bytes:
+                continue
+            seen.add(path)
+            entry = self.files.get(path)
+            if entry is not None and (entry.mtime_ns, entry.size) == (st.st_mtime_ns, st.st_size):
+                continue
+            try:
+                new_entry = self._index_file(full_path, path, st)
+            except OSError:
+                continue
+            if entry is not None:
+                self._remove(path)
+            self._add(path, new_entry)
+            changed += 1
+        for path in [x for x in self.files if x not in seen]:
+            self._remove(path)
+            changed += 1
+        if changed:
+            logger.info(f"Code index updated {changed} files ({len(self.files)} indexed).")
+        return changed
+
+    def find_symbol(self, name: str) -> List[Symbol]:
+        """Returns the definitions of a symbol, matched by qualified or unqualified name."""
+        self.refresh()
+        return list(self._symbols.get(name.lower(), []))
+
+    def search(self, query: str, k: int = 5) -> List[SearchResult]:
+        """Returns the `k` snippets that best match a query."""
+        self.refresh()
+        terms = set(tokenize(query))
+        n_chunks = len(self._lengths)
+        if not terms or not n_chunks:
+            return []
+        avg_length = self._total_length / n_chunks
+        scores = Counter()
+        for term in terms:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_chunks - len(postings) + 0.5) / (len(postings) + 0.5))
+            for key, count in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[key] / avg_length)
+                scores[key] += idf * count * (self.k1 + 1) / (count + norm)
+
+        for word in set(TOKEN_PATTERN.findall(query)):
+            for symbol in self._symbols.get(word.lower(), []):
+                entry = self.files[symbol.path]
+                for chunk_idx, (start, end, _) in enumerate(entry.chunks):
+                    if start < symbol.line <= end:
+                        scores[(symbol.path, chunk_idx)] += self.symbol_boost
+                        break
+
+        results = []
+        for (path, chunk_idx), score in scores.most_common(k):
+            entry = self.files[path]
+            start, end, _ = entry.chunks[chunk_idx]
+            text = "\n".join(entry.lines[start:end])
+            results.append(SearchResult(path, start + 1, end, score, text))
+        return results
+
+    def format_results(self, results: List[SearchResult]) -> str:
+        """Formats search results as file locations followed by fenced snippets."""
+        if not results:
+            return "No matches found."
+        return "\n\n".join(
+            f"{x.path}:{x.start_line}-{x.end_line}\n{TRIPLE_BACKTICKS}\n{x.text}\n{TRIPLE_BACKTICKS}"
+            for x in results
+        )
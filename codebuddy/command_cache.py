@@ -0,0 +1,206 @@
+import glob
+import os
+import re
+import shlex
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+UNSAFE_PATTERN = re.compile(r"[;&<>`]|\$\(")
+VARIABLE_PATTERN = re.compile(r"\$(\w+|\{\w+\})")
+GLOB_PATTERN = re.compile(r"[*?\[]")
+
+
+@dataclass
+class CommandCache:
+    """Caches the output of read-only terminal commands.
+
+    A block is cacheable if every line (and every part of a pipeline) starts with an allowlisted
+    command. Entries are validated against the mtimes and inodes of the paths the command reads,
+    so a hit is only returned while those paths are unchanged. Any other command or file edit
+    should call `invalidate`. The cache may be shared by threads running blocks concurrently.
+    """
+
+    allowlist: List[str] = field(
+        default_factory=lambda: [
+            "cat", "ls", "tree", "pwd", "head", "tail", "wc", "grep", "rg", "find", "file", "stat",
+            "git status", "git diff", "git log", "git show", "git branch",
+        ]
+    )  #: Side-effect-free commands, matched against the leading words of each command
+    recursive: List[str] = field(
+        default_factory=lambda: ["tree", "find", "git", "rg"]
+    )  #: Commands whose output depends on every file below their path arguments
+    unsafe_args: List[str] = field(
+        default_factory=lambda: [
+            "-exec", "-execdir", "-ok", "-okdir", "-delete", "-fprint", "-fprintf", "-fls",
+            "-o", "--output",
+        ]
+    )  #: Arguments that make an allowlisted command unsafe to cache
+    variables: Dict[str, str] = field(
+        default_factory=dict
+    )  #: Shell variables of the terminal, e.g. PROJECT_PATH, used to expand path arguments
+    max_walk_entries: int = 5000  #: Recursive commands over larger trees are not cached
+    hits: int = 0  #: Number of cache hits
+    misses: int = 0  #: Number of cacheable commands that were not cached
+    entries: Dict[Tuple[str, str], Tuple[tuple, str]] = field(
+        default_factory=dict
+    )  #: Cached signatures and outputs keyed by (cwd, command)
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def hit_rate(self) -> float:
+        """Returns the fraction of cacheable commands answered from the cache."""
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.
+
+    def _parse(self, command: str) -> Optional[List[List[str]]]:
+        """Returns the argument lists of every command in a block, or None if not read-only."""
+        commands = []
+        for line in command.splitlines():
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if UNSAFE_PATTERN.search(line):
+                return None
+            for part in line.split("|"):
+                try:
+                    args = shlex.split(part)
+                except ValueError:
+                    return None
+                if not args or any(x in self.unsafe_args for x in args):
+                    return None
+                if not any(args[: len(x.split())] == x.split() for x in self.allowlist):
+                    return None
+                commands.append(args)
+        return commands or None
+
+    def is_read_only(self, command: str) -> bool:
+        """Returns True if every command in a block is allowlisted."""
+        return self._parse(command) is not None
+
+    def _walk(self, path: str, stats: list) -> bool:
+        """Appends the stats of every entry below a directory. Returns False if it is too big."""
+        for root, dirs, files in os.walk(path):
+            dirs[:] = [x for x in dirs if x != ".git"]
+            for name in dirs + files:
+                if len(stats) > self.max_walk_entries:
+                    return False
+                stats.append(self._stat(os.path.join(root, name)))
+        return True
+
+    def _is_recursive(self, args: List[str]) -> bool:
+        """Returns True if a command reads everything below its path arguments."""
+        if args[0] in self.recursive or "--recursive" in args:
+            return True
+        # Catches option clusters such as `grep -rn` and `ls -laR`
+        return any(x.startswith("-") and not x.startswith("--") and x.lower().count("r") for x in args)
+
+    @staticmethod
+    def _stat(path: str) -> tuple:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return (path, None)
+        return (path, st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _expand(self, arg: str) -> Optional[str]:
+        """Expands the variables and home directory of an argument like the shell would, or
+        returns None if a variable is unknown."""
+        def variable(match):
+            name = match.group(1).strip("{}")
+            value = self.variables.get(name, os.environ.get(name))
+            if value is None:
+                raise KeyError(name)
+            return value
+
+        try:
+            arg = VARIABLE_PATTERN.sub(variable, arg)
+        except KeyError:
+            return None
+        return os.path.expanduser(arg)
+
+    def _paths(self, args: List[str], cwd: str) -> Optional[List[str]]:
+        """Returns the paths a command may read, or None if its arguments cannot be resolved.
+
+        Glob patterns add the directory they are matched in, so new matches change the
+        signature, followed by their current matches.
+        """
+        paths = []
+        for arg in args[1:]:
+            if arg.startswith("-"):
+                continue
+            arg = self._expand(arg)
+            if arg is None or "$" in arg or "{" in arg:
+                return None
+            path = os.path.join(cwd, arg)
+            if GLOB_PATTERN.search(arg):
+                paths.append(os.path.dirname(path) or cwd)
+                paths += sorted(glob.glob(path))
+            else:
+                paths.append(path)
+        return paths
+
+    def signature(self, command: str, cwd: str) -> Optional[tuple]:
+        """Returns the filesystem state a read-only block depends on, or None if not cacheable."""
+        commands = self._parse(command)
+        if commands is None or not cwd:
+            return None
+        stats = []
+        for args in commands:
+            is_recursive = self._is_recursive(args)
+            paths = self._paths(args, cwd)
+            if paths is None:
+                return None
+            if not paths or args[0] == "git":
+                paths.append(cwd)
+            if args[0] == "git":
+                git_dir = os.path.join(cwd, ".git")
+                for name in ("HEAD", "index", "logs/HEAD"):
+                    stats.append(self._stat(os.path.join(git_dir, name)))
+            for path in paths:
+                stats.append(self._stat(path))
+                if not os.path.isdir(path):
+                    continue
+                if is_recursive:
+                    if not self._walk(path, stats):
+                        return None
+                else:
+                    try:
+                        stats += [self._stat(x.path) for x in os.scandir(path)]
+                    except OSError:
+                        return None
+        return tuple(stats)
+
+    def get(self, command: str, cwd: str, signature: Optional[tuple] = None) -> Optional[str]:
+        """Returns the cached output of a block if it is still valid."""
+        signature = signature if signature is not None else self.signature(command, cwd)
+        if signature is None:
+            return None
+        with self._lock:
+            entry = self.entries.get((cwd, command))
+            if entry is not None and entry[0] == signature:
+                self.hits += 1
+                logger.info(f"Command cache hit ({self.hit_rate:.0%} hit rate)")
+                return entry[1]
+            self.misses += 1
+        return None
+
+    def put(self, command: str, cwd: str, output: str, signature: Optional[tuple] = None):
+        """Caches the output of a read-only block, or invalidates the cache for any other block."""
+        signature = signature if signature is not None else self.signature(command, cwd)
+        if signature is None:
+            self.invalidate()
+            return
+        with self._lock:
+            self.entries[(cwd, command)] = (signature, output)
+
+    def invalidate(self):
+        """Removes all cached outputs."""
+        with self._lock:
+            self.entries.clear()
@@ -0,0 +1,117 @@
+import re
+from dataclasses import dataclass, field
+from itertools import groupby
+from typing import List
+
+
+ANSI_PATTERN = re.compile(r"\x1b\[[0-9;?]*[ -/]*[@-~]|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)|\x1b[=>()][0-9A-Za-z]?")
+
+
+def strip_ansi(text: str) -> str:
+    """Removes ANSI escape sequences and carriage-return overwrites from terminal output.
+
+    Args:
+        text (str): Raw terminal output.
+
+    Returns:
+        str: The output as it would be left on screen, one line per line.
+    """
+    text = ANSI_PATTERN.sub("", text)
+    if "\r" not in text:
+        return text
+    lines = []
+    for line in text.split("\n"):
+        line = line.rstrip("\r")
+        lines.append(line.rsplit("\r", 1)[-1])
+    return "\n".join(lines)
+
+
+def estimate_tokens(text: str) -> int:
+    """Returns a rough token count for a string (about 4 characters per token)."""
+    return (len(text) + 3) // 4
+
+
+@dataclass
+class OutputCompactor:
+    """Compacts terminal output before it is sent to an LLM.
+
+    Outputs are cleaned of escape codes and progress bars, repeated lines are collapsed and long
+    outputs are cut down to their head, tail and error lines. Every compacted output is stored in
+    full and can be retrieved with `recall`.
+    """
+
+    remove_ansi: bool = True  #: Strip ANSI escape codes and carriage-return progress bars
+    collapse_repeats: bool = True  #: Collapse runs of three or more identical lines
+    max_tokens: int = 2000  #: Estimated token budget per output
+    max_line_chars: int = 1000  #: Lines longer than this are shortened
+    head_lines: int = 40  #: Lines to keep from the start of a truncated output
+    tail_lines: int = 80  #: Lines to keep from the end of a truncated output
+    error_pattern: str = (
+        r"(?i)\b(error|exception|traceback|failed|failure|fatal|warning)\b|^E\s"
+    )  #: Regex for lines that are kept from the middle of a truncated output
+    outputs: List[str] = field(default_factory=list)  #: Full original outputs
+
+    def __post_init__(self):
+        self._error_regex = re.compile(self.error_pattern)
+
+    def recall(self, output_id: int) -> str:
+        """Returns the full original output with the given id."""
+        return self.outputs[output_id]
+
+    def _collapse(self, lines: List[str]) -> List[str]:
+        collapsed = []
+        for line, group in groupby(lines):
+            count = sum(1 for _ in group)
+            if count > 2:
+                collapsed += [line, f"[previous line repeated {count - 1} times]"]
+            else:
+                collapsed += [line] * count
+        return collapsed
+
+    def _truncate(self, lines: List[str]) -> List[str]:
+        head = lines[: self.head_lines]
+        tail = lines[max(self.head_lines, len(lines) - self.tail_lines):]
+        budget = self.max_tokens - estimate_tokens("\n".join(head + tail))
+        middle = lines[len(head) : len(lines) - len(tail)]
+        kept = []
+        for idx, line in enumerate(middle):
+            if not self._error_regex.search(line):
+                continue
+            budget -= estimate_tokens(line)
+            if budget < 0:
+                break
+            kept.append((idx, line))
+
+        truncated = list(head)
+        last_idx = -1
+        for idx, line in kept:
+            if idx > last_idx + 1:
+                truncated.append(f"[... {idx - last_idx - 1} lines omitted ...]")
+            truncated.append(line)
+            last_idx = idx
+        if len(middle) > last_idx + 1:
+            truncated.append(f"[... {len(middle) - last_idx - 1} lines omitted ...]")
+        return truncated + tail
+
+    def __call__(self, output: str) -> str:
+        """Returns a compacted copy of a terminal output."""
+        text = strip_ansi(output) if self.remove_ansi else output
+        lines = text.splitlines()
+        n_lines = len(lines)
+        if self.collapse_repeats:
+            lines = self._collapse(lines)
+        shortened = False
+        for idx, line in enumerate(lines):
+            if len(line) > self.max_line_chars:
+                omitted = len(line) - self.max_line_chars
+                lines[idx] = line[: self.max_line_chars] + f" [... {omitted} characters omitted]"
+                shortened = True
+        if estimate_tokens("\n".join(lines)) > self.max_tokens:
+            lines = self._truncate(lines)
+        if len(lines) >= n_lines and not shortened:
+            return "\n".join(lines)
+        self.outputs.append(output)
+        return "\n".join(lines) + (
+            f"\n[Output compacted from {n_lines} to {len(lines)} lines. "
+            f"Use `RECALL {len(self.outputs) - 1}` to view the full output.]"
+        )
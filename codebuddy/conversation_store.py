@@ -0,0 +1,246 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Sequence
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from codebuddy.utils import Dialog, Message
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dialogs (
+    id INTEGER PRIMARY KEY,
+    conversation_id TEXT NOT NULL,
+    started REAL NOT NULL,
+    ended REAL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    dialog_id INTEGER NOT NULL REFERENCES dialogs(id),
+    conversation_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created REAL NOT NULL,
+    tool_calls TEXT,
+    tool_call_id TEXT
+);
+CREATE INDEX IF NOT EXISTS dialogs_by_conversation ON dialogs (conversation_id, started);
+CREATE INDEX IF NOT EXISTS messages_by_dialog ON messages (dialog_id, position);
+CREATE INDEX IF NOT EXISTS messages_by_conversation ON messages (conversation_id, created);
+"""
+
+# Columns added to the messages table after it was created, with their types
+MESSAGE_COLUMNS = {"tool_calls": "TEXT", "tool_call_id": "TEXT"}
+
+# Message fields in the order they are selected
+MESSAGE_FIELDS = "role, content, tool_calls, tool_call_id"
+
+
+def _row_message(
+    role: str, content: str, tool_calls: Optional[str], tool_call_id: Optional[str]
+) -> Message:
+    return Message(role, content, json.loads(tool_calls) if tool_calls else None, tool_call_id)
+
+
+@dataclass
+class ConversationStore:
+    """An append-only SQLite store of dialogs and their messages.
+
+    Messages are indexed by dialog, and by conversation and creation time. A conversation is
+    one module session, identified by a `conversation_id`. The store can be shared by threads.
+    """
+
+    path: str = "~/.codebuddy/conversations.db"  #: SQLite database file
+
+    def __post_init__(self):
+        self.path = os.path.expanduser(self.path)
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._connection:
+            if self.path != ":memory:":
+                self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+            # Stores created before a column existed get it added, with NULL for old messages
+            columns = {x[1] for x in self._connection.execute("PRAGMA table_info(messages)")}
+            for column, column_type in MESSAGE_COLUMNS.items():
+                if column not in columns:
+                    self._connection.execute(f"ALTER TABLE messages ADD COLUMN {column} {column_type}")
+
+    def _execute(self, query: str, params: tuple = ()) -> List[tuple]:
+        with self._lock, self._connection:
+            return self._connection.execute(query, params).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def new_dialog(self, conversation_id: str) -> int:
+        """Starts a dialog and returns its id."""
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO dialogs (conversation_id, started) VALUES (?, ?)",
+                (conversation_id, time.time()),
+            )
+            return cursor.lastrowid
+
+    def end_dialog(self, dialog_id: int):
+        """Marks a dialog as finished."""
+        self._execute("UPDATE dialogs SET ended = ? WHERE id = ?", (time.time(), dialog_id))
+
+    def append(self, dialog_id: int, messages: List[Message], start: int = 0):
+        """Appends messages to a dialog. `start` is the position of the first message."""
+        with self._lock, self._connection:
+            conversation_id = self._connection.execute(
+                "SELECT conversation_id FROM dialogs WHERE id = ?", (dialog_id,)
+            ).fetchone()[0]
+            now = time.time()
+            self._connection.executemany(
+                "INSERT INTO messages (dialog_id, conversation_id, position, role, content, created, "
+                "tool_calls, tool_call_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        dialog_id, conversation_id, start + idx, x.role, x.content, now,
+                        json.dumps(x.tool_calls) if x.tool_calls is not None else None,
+                        x.tool_call_id,
+                    )
+                    for idx, x in enumerate(messages)
+                ],
+            )
+
+    def dialog_ids(self, conversation_id: str, finished: bool = True) -> List[int]:
+        """Returns the ids of the dialogs in a conversation, oldest first."""
+        query = "SELECT id FROM dialogs WHERE conversation_id = ?"
+        if finished:
+            query += " AND ended IS NOT NULL"
+        return [x[0] for x in self._execute(query + " ORDER BY id", (conversation_id,))]
+
+    def load_dialog(self, dialog_id: int, start: int = 0, limit: int = -1) -> Dialog:
+        """Loads the messages of a dialog, optionally only those from position `start`."""
+        rows = self._execute(
+            f"SELECT {MESSAGE_FIELDS} FROM messages WHERE dialog_id = ? AND position >= ? "
+            "ORDER BY position LIMIT ?",
+            (dialog_id, start, limit),
+        )
+        return Dialog([_row_message(*x) for x in rows])
+
+    def conversations(self) -> List[Tuple[str, float, int]]:
+        """Returns the id, start time and number of dialogs of every conversation."""
+        return self._execute(
+            "SELECT conversation_id, MIN(started), COUNT(*) FROM dialogs "
+            "GROUP BY conversation_id ORDER BY MIN(started)"
+        )
+
+    def find_messages(
+        self,
+        conversation_id: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: int = 100,
+    ) -> List[Tuple[int, float, Message]]:
+        """Returns the dialog id, creation time and message of matching messages, oldest first.
+
+        Args:
+            conversation_id (str): Only return messages from this conversation.
+            since (float): Only return messages created at or after this unix time.
+            until (float): Only return messages created before this unix time.
+            limit (int): Maximum number of messages to return.
+        """
+        conditions, params = [], []
+        for condition, value in (
+            ("conversation_id = ?", conversation_id), ("created >= ?", since), ("created < ?", until)
+        ):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._execute(
+            f"SELECT dialog_id, created, {MESSAGE_FIELDS} FROM messages {where} "
+            "ORDER BY created, id LIMIT ?",
+            tuple(params) + (limit,),
+        )
+        return [(x[0], x[1], _row_message(*x[2:])) for x in rows]
+
+
+class DialogHistory(Sequence):
+    """A module's dialog history, backed by a `ConversationStore`.
+
+    Messages of the current dialog are written to the store as they are recorded. Finished
+    dialogs are loaded from the store on access, and only the most recently used ones are kept
+    in memory.
+    """
+
+    def __init__(self, store: ConversationStore, conversation_id: str, max_cached: int = 10):
+        self.store = store
+        self.conversation_id = conversation_id
+        self.max_cached = max_cached
+        self._cache = OrderedDict()
+        self._dialog_id = None
+        self._messages = None
+        self._n_stored = 0
+
+    def record(self, messages: List[Message]):
+        """Writes the messages of the current dialog that are not stored yet.
+
+        If the message list was replaced by a shorter one, the current dialog is finished and
+        a new one is started.
+        """
+        if messages is not self._messages:
+            if len(messages) < self._n_stored:
+                self._finish()
+            self._messages = messages
+        if len(messages) <= self._n_stored:
+            return
+        if self._dialog_id is None:
+            self._dialog_id = self.store.new_dialog(self.conversation_id)
+        self.store.append(self._dialog_id, messages[self._n_stored:], start=self._n_stored)
+        self._n_stored = len(messages)
+
+    def _finish(self):
+        if self._dialog_id is not None:
+            self.store.end_dialog(self._dialog_id)
+        self._dialog_id, self._messages, self._n_stored = None, None, 0
+
+    def append(self, dialog: Dialog):
+        """Finishes the current dialog, storing any of its messages that are not stored yet."""
+        self.record(dialog.turns)
+        dialog_id = self._dialog_id
+        self._finish()
+        if dialog_id is not None:
+            self._cache_dialog(dialog_id, dialog)
+
+    def _cache_dialog(self, dialog_id: int, dialog: Dialog):
+        self._cache[dialog_id] = dialog
+        self._cache.move_to_end(dialog_id)
+        while len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+
+    def _load(self, dialog_id: int) -> Dialog:
+        dialog = self._cache.get(dialog_id)
+        if dialog is None:
+            dialog = self.store.load_dialog(dialog_id)
+        self._cache_dialog(dialog_id, dialog)
+        return dialog
+
+    def __len__(self):
+        return len(self.store.dialog_ids(self.conversation_id))
+
+    def __iter__(self):
+        for dialog_id in self.store.dialog_ids(self.conversation_id):
+            yield self._load(dialog_id)
+
+    def __getitem__(self, idx):
+        dialog_ids = self.store.dialog_ids(self.conversation_id)
+        if isinstance(idx, slice):
+            return [self._load(x) for x in dialog_ids[idx]]
+        return self._load(dialog_ids[idx])
@@ -0,0 +1,259 @@
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field, asdict
+from typing import List
+
+from codebuddy.backend import USAGE_FIELDS
+from codebuddy.bedrock_backend import BedrockBackend
+from codebuddy.chat_module import ChatModule
+from codebuddy.checkpoint import CheckpointStore
+from codebuddy.file_locks import FileLocks
+from codebuddy.http_backend import HttpBackend
+from codebuddy.openai_backend import OpenaiBackend
+from codebuddy.script import Script
+from codebuddy.tmux_module import TMUX_MODULES
+from codebuddy.utils import Message
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+SPLIT_INSTRUCTION = """You coordinate a team of coding agents that work on the same project at the same time. Each agent can run terminal commands and edit files.
+
+Split the user's task into independent subtasks that can be done in parallel. Subtasks must not depend on each other's results and should not edit the same files. Write each subtask so that it can be understood without the original task. If the task cannot be split, return a single subtask.
+
+Respond with only a JSON list of at most {max_subtasks} objects with "title" and "task" keys, for example:
+
+[{{"title": "Docstrings for utils.py", "task": "Add Google style docstrings to every function in utils.py."}}]"""
+
+MERGE_INSTRUCTION = """Several coding agents worked in parallel on subtasks of the user's task. Summarize what was done for the user in one response. Mention any subtasks that failed or were left incomplete, and any conflicts between the agents' changes."""
+
+
+def parse_subtasks(response: str, max_subtasks: int) -> List[dict]:
+    """Returns the subtasks in a model response, or an empty list if none can be parsed."""
+    match = re.search(r"\[.*\]", response, flags=re.DOTALL)
+    if match is None:
+        return []
+    try:
+        subtasks = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return []
+    if not isinstance(subtasks, list):
+        return []
+    subtasks = [
+        {"title": str(x.get("title", "")) or str(x["task"])[:60], "task": str(x["task"])}
+        for x in subtasks
+        if isinstance(x, dict) and x.get("task")
+    ]
+    return subtasks[:max_subtasks]
+
+
+@dataclass
+class FanoutModule(ChatModule):
+    """A module that splits a task into subtasks and runs each on its own worker `TmuxModule`.
+
+    Workers share the project but have their own conversations and tmux sessions, and at most
+    `max_workers` run at once. A file edited by one worker cannot be edited by another. When all
+    workers finish, their results are merged into one summary.
+
+    Workers do not checkpoint the project, since rolling back one worker would revert the others.
+    Instead the coordinator checkpoints it once before the workers start.
+    """
+    split_instruction: str = SPLIT_INSTRUCTION  #: System prompt used to split tasks
+    merge_instruction: str = MERGE_INSTRUCTION  #: System prompt used to summarize worker results
+    worker_backend: str = "openai"  #: Name of the worker module in `TMUX_MODULES`
+    worker_config_path: str = ""  #: Prompt config yaml for the workers
+    max_calls: int = 5  #: Maximum number of LLM API calls per worker
+    python_env: str = os.path.dirname(os.path.dirname(__file__)) + "/codebuddy-venv"  #: Path to the Python environment
+    project_path: str = "~/demo"  #: Path to the project directory
+    max_workers: int = 4  #: Maximum number of workers running at once
+    max_subtasks: int = 8  #: Maximum number of subtasks per task
+    max_result_chars: int = 4000  #: Characters of each worker's final response used in the summary
+    file_locks: FileLocks = None  #: File ownership shared by the workers
+    checkpoint_edits: bool = True  #: If True, checkpoints the project before the workers start
+    checkpoints: CheckpointStore = None  #: Checkpoints of the project
+    step_info: dict = field(default_factory=dict)  #: Signals describing the current task
+
+    def __post_init__(self):
+        super().__post_init__()
+        self.project_path = os.path.expanduser(self.project_path).rstrip("/")
+        self.python_env = os.path.expanduser(self.python_env)
+        if self.file_locks is None:
+            self.file_locks = FileLocks()
+        if self.checkpoints is None and self.checkpoint_edits:
+            self.checkpoints = CheckpointStore(project_path=self.project_path)
+
+    def rollback(self, checkpoint_id: int) -> List[str]:
+        """Restores the project to a checkpoint and returns the paths that changed."""
+        return self.checkpoints.restore(checkpoint_id)
+
+    def split(self, task: str) -> List[dict]:
+        """Asks the model to split a task into independent subtasks."""
+        instruction = self.split_instruction.format(max_subtasks=self.max_subtasks)
+        response = self.call_api([Message("system", instruction), Message("user", task)])
+        subtasks = parse_subtasks(response, self.max_subtasks)
+        if not subtasks:
+            logger.warning("Could not parse subtasks. Running the task on a single worker.")
+            subtasks = [{"title": "Task", "task": task}]
+        return subtasks
+
+    def _run_worker(self, idx: int, subtask: dict, task: str, subtasks: List[dict]) -> dict:
+        """Runs one subtask on a new worker module and returns its result."""
+        others = "\n".join(f"- {x['title']}" for x in subtasks if x is not subtask)
+        prompt = subtask["task"]
+        if others:
+            prompt += (
+                f"\n\nThis is part of a larger task: {task}\n\nOther agents are working on these "
+                f"subtasks at the same time, so leave their files alone:\n{others}"
+            )
+        name = f"fanout-{os.getpid()}-{idx}"
+        result = {"title": subtask["title"], "status": "ok", "response": "", "started": time.time()}
+        worker = None
+        try:
+            worker = TMUX_MODULES[self.worker_backend](
+                config_path=self.worker_config_path,
+                max_calls=self.max_calls,
+                python_env=self.python_env,
+                project_path=self.project_path,
+                terminal_session_id=name,
+                python_session_id=f"{name}-python",
+                python_executor="pipe",
+                file_locks=self.file_locks,
+                checkpoint_edits=False,
+            )
+            for _ in worker(prompt):
+                pass
+            responses = [x.content for x in worker.messages if x.role == "assistant"]
+            result["response"] = responses[-1] if responses else ""
+            if worker.step_info.get("edit_failed"):
+                result["status"] = "edit failed"
+        except Exception as ex:
+            logger.exception(f"Worker {idx} failed")
+            result["status"] = f"error: {type(ex).__name__}: {ex}"
+        finally:
+            self.file_locks.release(name)
+            if worker is not None:
+                result["messages"] = [asdict(x) for x in worker.messages]
+                result["tokens"] = worker.tokens
+                # Recorded by the coordinator's thread, so its usage lists stay in step
+                result["usage"] = {k: list(getattr(worker, k)) for k in USAGE_FIELDS}
+                worker.close()
+        result["duration"] = time.time() - result["started"]
+        return result
+
+    def _report(self, results: List[dict]) -> str:
+        """Formats worker results for the merge prompt and the conversation."""
+        reports = []
+        for result in results:
+            response = result["response"]
+            if len(response) > self.max_result_chars:
+                response = response[-self.max_result_chars:]
+            reports.append(
+                f"# {result['title']}\n\nStatus: {result['status']} ({result['duration']:.0f}s)\n\n"
+                f"{response}"
+            )
+        return "\n\n".join(reports)
+
+    def forward(self, message: str = "", depth: int = 0) -> str:
+        """Splits a task, runs the subtasks in parallel and summarizes the results."""
+        self.messages.append(Message("user", message))
+        subtasks = self.split(message)
+        plan = "\n".join(f"{idx + 1}. {x['title']}" for idx, x in enumerate(subtasks))
+        plan = f"Running {len(subtasks)} subtasks:\n\n{plan}\n"
+        self.messages.append(Message("assistant", plan))
+        yield plan
+
+        self.step_info = {}
+        if self.checkpoints is not None:
+            label = (message.strip().splitlines() or [""])[0][:80]
+            try:
+                self.step_info["checkpoint"] = self.checkpoints.create(label)
+            except OSError as ex:
+                logger.warning(f"Could not checkpoint the project: {ex}")
+        results = [None] * len(subtasks)
+        progress = plan
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self._run_worker, idx, x, message, subtasks): idx
+                for idx, x in enumerate(subtasks)
+            }
+            for future in as_completed(futures):
+                idx = futures[future]
+                results[idx] = future.result()
+                # Worker usage counts towards the coordinator's totals
+                for k, v in results[idx].get("usage", {}).items():
+                    getattr(self, k).extend(v)
+                progress += f"\nFinished {subtasks[idx]['title']}: {results[idx]['status']}"
+                yield progress
+
+        report = self._report(results)
+        self.messages.append(Message("user", report))
+        summary = self.call_api(
+            [Message("system", self.merge_instruction), Message("user", f"Task: {message}\n\n{report}")]
+        )
+        self.messages.append(Message("assistant", summary))
+        yield summary
+
+
+@dataclass
+class OpenaiFanoutModule(FanoutModule, OpenaiBackend):
+    """A fan-out module using OpenaiBackend."""
+
+
+@dataclass
+class BedrockFanoutModule(FanoutModule, BedrockBackend):
+    """A fan-out module using BedrockBackend."""
+
+
+@dataclass
+class LocalFanoutModule(FanoutModule, HttpBackend):
+    """A fan-out module using HttpBackend."""
+
+
+FANOUT_MODULES = {
+    "openai": OpenaiFanoutModule,
+    "bedrock": BedrockFanoutModule,
+    "local": LocalFanoutModule,
+}
+
+
+@dataclass
+class FanoutLauncher(Script):
+    """Launch a fan-out coordinator gradio gui."""
+    backend: str = field(default="openai", metadata={"help": "Backend name"})
+    prompt_name: str = field(
+        default="codebuddy-openai", metadata={"help": "The name of the worker prompt config yaml file."}
+    )
+    max_calls: int = field(default=5, metadata={"help": "Maximum number of LLM API calls per worker."})
+    python_env: str = field(
+        default=os.path.dirname(os.path.dirname(__file__)) + "/codebuddy-venv",
+        metadata={"help": "Path to the Python environment."}
+    )
+    project_path: str = field(default="~/demo", metadata={"help": "Path to the project directory."})
+    max_workers: int = field(default=4, metadata={"help": "Maximum number of workers running at once."})
+
+    def run(self):
+        prompt_basepath = os.path.dirname(os.path.dirname(__file__))
+        prompt_path = os.path.join(prompt_basepath, "prompts", self.prompt_name + ".yaml")
+        module = FANOUT_MODULES[self.backend](
+            worker_backend=self.backend,
+            worker_config_path=prompt_path,
+            max_calls=self.max_calls,
+            python_env=self.python_env,
+            project_path=self.project_path,
+            max_workers=self.max_workers,
+        )
+        gui = module.get_gradio_interface()
+        gui.launch(share=False)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    FanoutLauncher.parse_args().run()
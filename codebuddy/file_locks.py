@@ -0,0 +1,32 @@
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+
+@dataclass
+class FileLocks:
+    """Assigns each edited file to the first module that edits it.
+
+    Modules working on the same project concurrently share one instance. Once a module edits a
+    file it owns it until `release` is called, and other modules' edits to it are refused, so
+    concurrent workers cannot overwrite each other's changes.
+    """
+
+    owners: Dict[str, str] = field(default_factory=dict)  #: Owner of each edited file by real path
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    def acquire(self, file_path: str, owner: str) -> Optional[str]:
+        """Claims a file for an owner. Returns the current owner if it belongs to someone else."""
+        path = os.path.realpath(file_path)
+        with self._lock:
+            current = self.owners.setdefault(path, owner)
+        return current if current != owner else None
+
+    def release(self, owner: str):
+        """Releases every file claimed by an owner."""
+        with self._lock:
+            for path in [k for k, v in self.owners.items() if v == owner]:
+                del self.owners[path]
@@ -0,0 +1,154 @@
+import copy
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+from codebuddy.backend import Backend, USAGE_FIELDS
+from codebuddy.utils import Message
+
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class HedgedBackend(Backend):
+    """Composite backend that hedges slow requests and falls over on errors.
+
+    The first backend in `backends` is called first. If it has not responded within the hedge
+    deadline, the next backend is called concurrently and whichever finishes first wins. If a
+    backend raises, the next backend is tried. Each wrapped backend keeps its own token counts,
+    including requests that lost the race, since those are still billed. The hedge deadline is a
+    percentile of the latencies of all completed requests, including the ones that lost.
+    """
+    backends: List[Backend] = field(
+        default_factory=lambda: [],
+        metadata={"help": "Backends to call, in order of preference"},
+    )
+    hedge_percentile: float = field(
+        metadata={"help": "Latency percentile (0-1) after which a hedged request is sent"},
+        default=0.9,
+    )
+    hedge_delay: float = field(
+        metadata={"help": "Hedge deadline in seconds used until enough latencies are observed"},
+        default=20.0,
+    )
+    min_hedge_delay: float = field(
+        metadata={"help": "Lower bound on the hedge deadline in seconds"}, default=1.0
+    )
+    min_samples: int = field(
+        metadata={"help": "Number of observed latencies required to use the percentile deadline"},
+        default=10,
+    )
+    latency_window: int = field(
+        metadata={"help": "Number of recent latencies used to compute the percentile deadline"},
+        default=100,
+    )
+    max_concurrent: int = field(
+        metadata={"help": "Maximum number of requests in flight for a single call"}, default=2
+    )
+    latencies: List[float] = field(
+        default_factory=lambda: [],
+        metadata={"help": "Recent latencies of completed requests in seconds"},
+    )
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def tokens(self):
+        totals = {k: 0 for k in ("llm_calls",) + USAGE_FIELDS}
+        for backend in self.backends:
+            for k, v in backend.tokens.items():
+                if k in totals:
+                    totals[k] += v
+        totals["backends"] = [backend.tokens for backend in self.backends]
+        return totals
+
+    @property
+    def deadline(self) -> float:
+        """Returns the number of seconds to wait before sending a hedged request."""
+        if len(self.latencies) < self.min_samples:
+            return self.hedge_delay
+        latencies = sorted(self.latencies)
+        idx = min(int(self.hedge_percentile * len(latencies)), len(latencies) - 1)
+        return max(latencies[idx], self.min_hedge_delay)
+
+    def request_base(self):
+        return self.backends[0].request_base()
+
+    def _timed_call(
+        self, backend: Backend, messages: List[Message]
+    ) -> Tuple[str, float, Tuple[int, ...]]:
+        """Calls a backend and returns the response, latency and token usage of the call.
+
+        The call is made on a copy of the backend with empty usage lists, so requests of earlier
+        calls that are still running do not count towards this one. Its usage is added to the
+        backend afterwards, and its latency is recorded even if another request already won.
+        """
+        attempt = copy.copy(backend)
+        for k in USAGE_FIELDS:
+            setattr(attempt, k, [])
+        try:
+            start = time.monotonic()
+            response = attempt.call_api(messages)
+            latency = time.monotonic() - start
+            with self._lock:
+                self.latencies = (self.latencies + [latency])[-self.latency_window:]
+        finally:
+            with self._lock:
+                for k in USAGE_FIELDS:
+                    getattr(backend, k).extend(getattr(attempt, k))
+        return response, latency, tuple(sum(getattr(attempt, k)) for k in USAGE_FIELDS)
+
+    def call_api(self, messages: List[Message], retries: int = 0) -> str:
+        if not self.backends:
+            raise ValueError("HedgedBackend requires at least one backend.")
+        executor = ThreadPoolExecutor(max_workers=len(self.backends))
+        pending = {}
+        errors = []
+        next_idx = 0
+        launched_at = 0.
+
+        def launch():
+            nonlocal next_idx, launched_at
+            future = executor.submit(self._timed_call, self.backends[next_idx], messages)
+            pending[future] = next_idx
+            next_idx += 1
+            launched_at = time.monotonic()
+
+        try:
+            launch()
+            while pending:
+                can_hedge = next_idx < len(self.backends) and len(pending) < self.max_concurrent
+                timeout = (
+                    max(0., self.deadline - (time.monotonic() - launched_at)) if can_hedge else None
+                )
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    logger.info(
+                        f"No response within {self.deadline:.1f}s. "
+                        f"Sending hedged request to backend {next_idx}."
+                    )
+                    launch()
+                    continue
+                for future in done:
+                    idx = pending.pop(future)
+                    try:
+                        response, latency, usage = future.result()
+                    except Exception as ex:
+                        logger.warning(f"Backend {idx} failed: {ex}")
+                        errors.append(ex)
+                        if not pending and next_idx < len(self.backends):
+                            launch()
+                        continue
+                    for other in pending:
+                        other.cancel()
+                    self.record_usage(usage)
+                    logger.debug(f"Backend {idx} responded in {latency:.2f}s")
+                    return response
+            raise errors[-1]
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
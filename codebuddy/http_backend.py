@@ -0,0 +1,301 @@
+import http.client
+import json
+import os
+import queue
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterator, List
+from urllib.parse import urlsplit
+
+from codebuddy.backend import Backend, estimate_prompt_tokens
+from codebuddy.tools import openai_message, openai_tool, openai_tool_calls
+from codebuddy.utils import Message
+
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_BASE_URL = "http://localhost:8000/v1"
+
+# Statuses that are retried, since the server may be overloaded or restarting
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Errors raised when a kept-alive connection was closed by the server while idle
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    BrokenPipeError,
+    ConnectionResetError,
+)
+
+
+class ConnectionPool:
+    """Keep-alive HTTP connections to one server, shared by threads.
+
+    Connections are returned to the pool after each response has been read completely, so
+    consecutive requests skip the TCP (and TLS) handshake. A connection that fails is discarded.
+    """
+
+    def __init__(self, base_url: str, size: int = 8, timeout: float = 600.):
+        url = urlsplit(base_url)
+        self.scheme = url.scheme
+        self.host = url.hostname
+        self.port = url.port
+        self.path = url.path.rstrip("/")
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+
+    def _connect(self) -> http.client.HTTPConnection:
+        cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    @contextmanager
+    def connection(self) -> Iterator[http.client.HTTPConnection]:
+        """Yields an idle connection (or a new one) and returns it to the pool afterwards."""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        except BaseException:
+            conn.close()
+            raise
+        if self._idle.qsize() < self.size:
+            self._idle.put(conn)
+        else:
+            conn.close()
+
+    def request(self, conn: http.client.HTTPConnection, path: str, body: dict, headers: dict):
+        """Sends a POST request and returns the response.
+
+        A request on a reused connection that the server has closed is sent again on a new one.
+        """
+        data = json.dumps(body).encode()
+        try:
+            conn.request("POST", self.path + path, body=data, headers=headers)
+            return conn.getresponse()
+        except STALE_CONNECTION_ERRORS:
+            conn.close()
+            conn.request("POST", self.path + path, body=data, headers=headers)
+            return conn.getresponse()
+
+    def close(self):
+        """Closes all idle connections."""
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+
+
+@dataclass
+class HttpBackend(Backend):
+    """Backend for any server implementing the OpenAI chat completions API over HTTP.
+
+    Requests reuse keep-alive connections from a pool, and responses are streamed by default.
+    """
+    base_url: str = field(
+        metadata={
+            "help": (
+                "Base URL of the API, including the version prefix. Defaults to the "
+                f"LOCAL_LLM_BASE_URL environment variable, or {DEFAULT_BASE_URL}."
+            )
+        },
+        default="",
+    )
+    api_key_env: str = field(
+        metadata={"help": "Environment variable holding the API key, sent as a bearer token"},
+        default="LOCAL_LLM_API_KEY",
+    )
+    model: str = field(metadata={"help": "ID of the model to use."}, default="local-model")
+    max_tokens: int = field(
+        metadata={
+            "help": "The maximum number of tokens that can be generated in the chat completion."
+        },
+        default=4096,
+    )
+    top_p: float = field(metadata={"help": "Nucleus sampling probability mass."}, default=1)
+    temperature: float = field(metadata={"help": "Sampling temperature."}, default=0.1)
+    stop: List[str] = field(
+        default_factory=lambda: [],
+        metadata={"help": "Sequences where the API will stop generating further tokens."},
+    )
+    stream: bool = field(
+        metadata={"help": "If True, responses are streamed as server-sent events"}, default=True
+    )
+    request_timeout: float = field(
+        metadata={"help": "Seconds to wait for the server before a request fails"}, default=600.
+    )
+    max_connections: int = field(
+        metadata={"help": "Maximum number of idle keep-alive connections kept open"}, default=8
+    )
+
+    @property
+    def pool(self) -> ConnectionPool:
+        """The connection pool, created on first use."""
+        if getattr(self, "_pool", None) is None:
+            base_url = self.base_url or os.getenv("LOCAL_LLM_BASE_URL", DEFAULT_BASE_URL)
+            self._pool = ConnectionPool(base_url, self.max_connections, self.request_timeout)
+        return self._pool
+
+    def request_base(self):
+        return {
+            k: v for k, v in self.__dict__.items()
+            if k in ["model", "max_tokens", "top_p", "temperature", "stop"]
+        }
+
+    def format_messages(self, messages: List[Message]) -> List[dict]:
+        """Returns request messages, merging leading system messages into one."""
+        n_system = next(
+            (idx for idx, msg in enumerate(messages) if msg.role != "system"), len(messages)
+        )
+        formatted = [openai_message(x) for x in messages[n_system:]]
+        if n_system:
+            system = "".join(msg.content for msg in messages[:n_system])
+            formatted.insert(0, {"role": "system", "content": system})
+        return formatted
+
+    def _headers(self) -> dict:
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        api_key = os.getenv(self.api_key_env)
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+        return headers
+
+    def _record_usage(self, usage: dict):
+        usage = usage or {}
+        details = usage.get("prompt_tokens_details") or {}
+        self.input_tokens.append(usage.get("prompt_tokens") or 0)
+        self.output_tokens.append(usage.get("completion_tokens") or 0)
+        self.cache_read_tokens.append(details.get("cached_tokens") or 0)
+        self.cache_write_tokens.append(0)
+
+    @staticmethod
+    def _add_tool_call_pieces(streamed_calls: dict, delta: dict):
+        """Adds the tool call pieces of a streamed delta to the calls keyed by their index."""
+        for piece in delta.get("tool_calls") or []:
+            call = streamed_calls.setdefault(
+                piece.get("index", 0), {"id": "", "function": {"name": "", "arguments": ""}}
+            )
+            call["id"] = piece.get("id") or call["id"]
+            function = piece.get("function") or {}
+            call["function"]["name"] += function.get("name") or ""
+            call["function"]["arguments"] += function.get("arguments") or ""
+
+    def stream_api(
+        self,
+        messages: List[Message],
+        retries: int = 0,
+        tools: List[dict] = None,
+        tool_calls: List[dict] = None,
+    ) -> Iterator[str]:
+        """Yields the response content as it is generated and then updates the token counts.
+
+        Requests that fail before any content is received are retried up to 3 times. If `tools`
+        are given, the tool calls that the model makes are appended to `tool_calls` once the
+        response is complete. Closing the generator early cancels the response.
+        """
+        request = self.request_base()
+        request["messages"] = self.format_messages(messages)
+        if tools:
+            request["tools"] = [openai_tool(x) for x in tools]
+        request["stream"] = self.stream
+        if self.stream:
+            request["stream_options"] = {"include_usage": True}
+        logger.debug(request)
+
+        retry = False
+        with self.pool.connection() as conn:
+            try:
+                response = self.pool.request(conn, "/chat/completions", request, self._headers())
+            except (OSError, http.client.HTTPException) as ex:
+                if retries >= 3:
+                    raise
+                logger.info(f"Request failed ({ex}). Sleeping for {2 ** retries}s and trying again.")
+                conn.close()
+                response, retry = None, True
+            if response is not None and response.status != 200:
+                error = response.read().decode(errors="replace")
+                if response.status not in RETRY_STATUSES or retries >= 3:
+                    raise RuntimeError(f"HTTP {response.status} from {self.pool.host}: {error}")
+                logger.info(f"HTTP {response.status}. Sleeping for {2 ** retries}s and trying again.")
+                retry = True
+            elif response is not None:
+                if not self.stream:
+                    body = json.loads(response.read())
+                    logger.debug(body)
+                    self._record_usage(body.get("usage"))
+                    message = body["choices"][0]["message"]
+                    if tool_calls is not None:
+                        tool_calls += openai_tool_calls(message.get("tool_calls"))
+                    yield message["content"] or ""
+                else:
+                    usage = None
+                    n_pieces = 0
+                    # Tool calls arrive in pieces, keyed by their index in the response
+                    streamed_calls = {}
+                    try:
+                        for line in response:
+                            line = line.strip()
+                            if not line.startswith(b"data:"):
+                                continue
+                            data = line[len(b"data:"):].strip()
+                            if data == b"[DONE]":
+                                break
+                            chunk = json.loads(data)
+                            usage = chunk.get("usage") or usage
+                            for choice in chunk.get("choices") or []:
+                                delta = choice.get("delta") or {}
+                                self._add_tool_call_pieces(streamed_calls, delta)
+                                if delta.get("content"):
+                                    n_pieces += 1
+                                    yield delta["content"]
+                    except GeneratorExit:
+                        # Cancelled by the caller. The connection is closed, which stops the
+                        # server. Unless the server already reported usage, output tokens are
+                        # estimated as one per streamed chunk and input tokens from the prompt.
+                        usage = dict(usage or {})
+                        usage["completion_tokens"] = usage.get("completion_tokens") or n_pieces
+                        usage["prompt_tokens"] = usage.get("prompt_tokens") or (
+                            estimate_prompt_tokens(request["messages"])
+                        )
+                        self._record_usage(usage)
+                        raise
+                    # The rest of the response is read so the connection can be reused
+                    response.read()
+                    self._record_usage(usage)
+                    if tool_calls is not None:
+                        tool_calls += openai_tool_calls(
+                            [streamed_calls[x] for x in sorted(streamed_calls)]
+                        )
+        if retry:
+            time.sleep(2 ** retries)
+            yield from self.stream_api(
+                messages, retries=retries + 1, tools=tools, tool_calls=tool_calls
+            )
+
+    def call_api(self, messages: List[Message], retries: int = 0) -> str:
+        return "".join(self.stream_api(messages, retries=retries))
+
+    def call_api_with_tools(
+        self, messages: List[Message], tools: List[dict], retries: int = 0
+    ) -> Message:
+        tool_calls = []
+        content = "".join(
+            self.stream_api(messages, retries=retries, tools=tools, tool_calls=tool_calls)
+        )
+        return Message("assistant", content, tool_calls=tool_calls or None)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    logging.basicConfig(level=logging.INFO)
+
+    backend = HttpBackend()
+    for text in backend.stream_api([Message("user", "Hello")]):
+        print(text, end="", flush=True)
+    print()
+    logger.info(backend.tokens)
@@ -0,0 +1,123 @@
+import os
+import signal
+import subprocess
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Job:
+    """A command running in the background."""
+
+    job_id: int  #: Job number
+    command: str  #: The command being run
+    process: subprocess.Popen  #: The process running the command
+    log_path: str  #: File receiving the combined stdout and stderr of the command
+    started: float = field(default_factory=time.time)  #: Start time
+    offset: int = 0  #: Number of output bytes already returned
+
+    @property
+    def status(self) -> str:
+        returncode = self.process.poll()
+        if returncode is None:
+            return f"running for {time.time() - self.started:.0f}s"
+        return f"exited with code {returncode}"
+
+
+@dataclass
+class JobManager:
+    """Runs long commands as background jobs with non-blocking handles.
+
+    Each job runs in its own process group with the project environment activated, and its
+    output is written to a log file so that it can be read incrementally.
+    """
+
+    project_path: str = "~"  #: Default working directory for jobs
+    python_env: str = ""  #: Python environment activated before each job
+    log_dir: str = "/tmp/codebuddy-jobs"  #: Directory for job output logs
+    kill_timeout: float = 5.  #: Seconds to wait after SIGTERM before sending SIGKILL
+    jobs: Dict[int, Job] = field(default_factory=dict)  #: Jobs by id
+
+    def __post_init__(self):
+        self.project_path = os.path.expanduser(self.project_path).rstrip("/")
+        self.python_env = os.path.expanduser(self.python_env)
+        os.makedirs(self.log_dir, exist_ok=True)
+
+    def _get(self, job_id: int) -> Job:
+        if job_id not in self.jobs:
+            raise KeyError(f"Job {job_id} does not exist.")
+        return self.jobs[job_id]
+
+    def start(self, command: str, cwd: Optional[str] = None) -> int:
+        """Starts a command in the background and returns its job id."""
+        job_id = max(self.jobs, default=0) + 1
+        log_path = os.path.join(self.log_dir, f"job-{os.getpid()}-{job_id}.log")
+        script = command
+        if self.python_env:
+            script = f"source {self.python_env}/bin/activate 2>/dev/null\n{command}"
+        env = dict(os.environ, PROJECT_PATH=self.project_path, PYTHONPATH=self.project_path)
+        with open(log_path, "wb") as log:
+            process = subprocess.Popen(
+                ["bash", "-c", script],
+                cwd=cwd or self.project_path,
+                env=env,
+                stdin=subprocess.DEVNULL,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                start_new_session=True,
+            )
+        self.jobs[job_id] = Job(job_id, command, process, log_path)
+        logger.info(f"Started job {job_id}: {command}")
+        return job_id
+
+    def output(self, job_id: int, incremental: bool = True) -> str:
+        """Returns the output of a job, or only the output produced since the last call."""
+        job = self._get(job_id)
+        with open(job.log_path, "rb") as f:
+            f.seek(job.offset if incremental else 0)
+            data = f.read()
+            if incremental:
+                job.offset = f.tell()
+        return data.decode(errors="replace")
+
+    def status(self, job_id: int) -> str:
+        """Returns the status of a job."""
+        return self._get(job_id).status
+
+    def wait(self, job_id: int, timeout: Optional[float] = None) -> str:
+        """Waits for a job to finish, for at most `timeout` seconds, and returns its status."""
+        try:
+            self._get(job_id).process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            pass
+        return self.status(job_id)
+
+    def kill(self, job_id: int) -> str:
+        """Terminates a job and its child processes and returns its status."""
+        job = self._get(job_id)
+        if job.process.poll() is None:
+            try:
+                os.killpg(job.process.pid, signal.SIGTERM)
+                job.process.wait(timeout=self.kill_timeout)
+            except subprocess.TimeoutExpired:
+                os.killpg(job.process.pid, signal.SIGKILL)
+                job.process.wait()
+            except ProcessLookupError:
+                pass
+        return job.status
+
+    def summary(self) -> str:
+        """Returns a line per job with its id, status and command."""
+        return "\n".join(
+            f"{job.job_id}: {job.status}: {job.command}" for job in self.jobs.values()
+        ) or "No jobs."
+
+    def close(self):
+        """Kills all running jobs."""
+        for job_id in self.jobs:
+            self.kill(job_id)
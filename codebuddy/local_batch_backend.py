@@ -0,0 +1,175 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+from codebuddy.backend import Backend, BatchResult
+from codebuddy.openai_backend import BATCH_ENDPOINT, parse_openai_batch_line
+from codebuddy.tools import openai_message
+from codebuddy.utils import Message, pid_alive
+
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class LocalBatchBackend(Backend):
+    """A file-based stand-in for provider batch APIs, for testing batch pipelines offline.
+
+    Each batch is a directory under `batch_dir` with the requests in the OpenAI batch input
+    format, a status file and, once processed, an output file in the OpenAI batch output format.
+    Batches are processed on a background thread by `backend`, or by echoing the last user
+    message if there is no backend. The status file records the process answering the batch,
+    and a batch left running by a process that has exited is picked up when its status is polled.
+    """
+    batch_dir: str = field(
+        metadata={"help": "Directory that batch files are written to"},
+        default="~/.codebuddy/batches",
+    )
+    backend: Backend = field(
+        metadata={"help": "Backend that answers batch requests. If None, requests are echoed."},
+        default=None,
+    )
+    model: str = field(metadata={"help": "Model name written to the batch files"}, default="local")
+    process_delay: float = field(
+        metadata={"help": "Seconds a batch waits before it is processed, to simulate queueing"},
+        default=0.,
+    )
+
+    def __post_init__(self):
+        self.batch_dir = os.path.expanduser(self.batch_dir)
+        self._workers = {}
+        self._lock = threading.Lock()
+
+    def request_base(self):
+        return {"model": self.model}
+
+    def _answer(self, messages: List[Message]) -> Tuple[str, Tuple[int, ...]]:
+        """Returns the response to a request and its token usage."""
+        if self.backend is None:
+            users = [x for x in messages if x.role == "user"]
+            content = users[-1].content if users else ""
+            input_tokens = sum(len(x.content) for x in messages) // 4
+            return content, (input_tokens, len(content.split()), 0, 0)
+        offsets = self.backend.usage_offsets()
+        content = self.backend.call_api(messages)
+        return content, self.backend.usage_since(offsets)
+
+    def call_api(self, messages: List[Message], retries: int = 0) -> str:
+        content, usage = self._answer(messages)
+        self.record_usage(usage)
+        return content
+
+    def _path(self, batch_id: str, name: str) -> str:
+        return os.path.join(self.batch_dir, batch_id, name)
+
+    def _write(self, path: str, data: str):
+        """Writes a file atomically, so pollers never read it half written."""
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _set_status(self, batch_id: str, status: str):
+        status = {"status": status, "pid": os.getpid(), "updated": time.time()}
+        self._write(self._path(batch_id, "status.json"), json.dumps(status))
+
+    def _process(self, batch_id: str):
+        """Processes a batch, marking it failed if its files cannot be processed."""
+        try:
+            self._answer_batch(batch_id)
+        except Exception:
+            logger.exception(f"Batch {batch_id} failed")
+            self._set_status(batch_id, "failed")
+
+    def _answer_batch(self, batch_id: str):
+        """Answers the requests of a batch and writes the output file."""
+        time.sleep(self.process_delay)
+        lines = []
+        with open(self._path(batch_id, "input.jsonl"), "r") as f:
+            records = [json.loads(x) for x in f if x.strip()]
+        for record in records:
+            messages = [Message(x["role"], x["content"]) for x in record["body"]["messages"]]
+            try:
+                content, usage = self._answer(messages)
+            except Exception as ex:
+                logger.info(f"Batch {batch_id} request {record['custom_id']} failed: {ex}")
+                error = {"message": str(ex)}
+                lines.append({"custom_id": record["custom_id"], "response": None, "error": error})
+                continue
+            body = {
+                "model": self.model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": usage[0],
+                    "completion_tokens": usage[1],
+                    "prompt_tokens_details": {"cached_tokens": usage[2]},
+                },
+            }
+            lines.append({
+                "custom_id": record["custom_id"],
+                "response": {"status_code": 200, "body": body},
+                "error": None,
+            })
+        output = "".join(json.dumps(x) + "\n" for x in lines)
+        self._write(self._path(batch_id, "output.jsonl"), output)
+        self._set_status(batch_id, "completed")
+
+    def _start_worker(self, batch_id: str):
+        with self._lock:
+            if batch_id in self._workers and self._workers[batch_id].is_alive():
+                return
+            worker = threading.Thread(target=self._process, args=(batch_id,), daemon=True)
+            self._workers[batch_id] = worker
+            worker.start()
+
+    def submit_batch(self, requests: Dict[str, List[Message]]) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+        os.makedirs(os.path.join(self.batch_dir, batch_id))
+        lines = [
+            {
+                "custom_id": request_id,
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": {**self.request_base(), "messages": [openai_message(x) for x in messages]},
+            }
+            for request_id, messages in requests.items()
+        ]
+        data = "".join(json.dumps(x) + "\n" for x in lines)
+        self._write(self._path(batch_id, "input.jsonl"), data)
+        self._set_status(batch_id, "in_progress")
+        self._start_worker(batch_id)
+        return batch_id
+
+    def batch_status(self, batch_id: str) -> str:
+        with open(self._path(batch_id, "status.json"), "r") as f:
+            status = json.load(f)
+        if status["status"] in ("completed", "failed"):
+            return status["status"]
+        owner = status.get("pid")
+        if owner != os.getpid():
+            if owner is not None and pid_alive(owner):
+                # Another process is answering the batch
+                return "running"
+            logger.info(f"Taking over batch {batch_id} from exited process {owner}")
+            self._set_status(batch_id, "in_progress")
+        self._start_worker(batch_id)
+        return "running"
+
+    def batch_results(self, batch_id: str) -> Dict[str, BatchResult]:
+        results = {}
+        with open(self._path(batch_id, "output.jsonl"), "r") as f:
+            for line in f:
+                if line.strip():
+                    result = parse_openai_batch_line(json.loads(line))
+                    results[result.request_id] = result
+        return results
@@ -0,0 +1,149 @@
+"""Single-pass scanner for the markdown responses of agent modules."""
+import re
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+# Keywords whose argument is a file path
+EDIT_KEYWORDS = ("OVERWRITE", "APPEND", "DELETE", "REPLACE")
+
+
+class Chunk:
+    """A code block or a line of text in a response.
+
+    Chunks hold offsets into the response, and the content is only sliced from it when it is
+    read. Text chunks that start with a keyword also hold the keyword and its argument (e.g., a
+    file path or a query).
+    """
+
+    __slots__ = ("source", "type", "start", "end", "keyword", "argument")
+
+    def __init__(
+        self,
+        source: str,
+        type: str,
+        start: int,
+        end: int,
+        keyword: Optional[str] = None,
+        argument: Optional[str] = None,
+    ):
+        self.source = source  #: The response
+        self.type = type  #: "text", or the language of a code block ("code" if none)
+        self.start = start  #: Offset of the content in the response
+        self.end = end  #: Offset of the end of the content in the response
+        self.keyword = keyword  #: Keyword at the start of a text chunk
+        self.argument = argument  #: Rest of the keyword line without surrounding quotes
+
+    @property
+    def content(self) -> str:
+        return self.source[self.start:self.end]
+
+    @property
+    def is_edit(self) -> bool:
+        """True if the chunk is a file editing directive."""
+        return self.keyword in EDIT_KEYWORDS
+
+    def __repr__(self) -> str:
+        keyword = f", keyword={self.keyword!r}" if self.keyword else ""
+        return f"Chunk(type={self.type!r}, start={self.start}, end={self.end}{keyword})"
+
+
+@lru_cache(maxsize=32)
+def _text_patterns(keywords: tuple) -> Tuple[re.Pattern, re.Pattern]:
+    """Returns patterns matching a fence opening a code block or one of the keywords.
+
+    The first matches at the start of the text. The second matches after a newline, which lets
+    the regex engine skip to candidate lines quickly.
+    """
+    fence = r"[ \t]*(?P<fence>`{3,})(?P<info>[^`\n]*)\n"
+    if keywords:
+        # Longer keywords first, so a keyword that extends another one is matched in full
+        alternatives = "|".join(re.escape(x) for x in sorted(keywords, key=len, reverse=True))
+        fence = f"{fence}|(?P<keyword>{alternatives})"
+    return re.compile(f"(?:{fence})"), re.compile(f"\\n(?:{fence})")
+
+
+_LANGUAGE = re.compile(r"\w+")
+
+
+def _closing_fence(text: str, fence: str, pos: int) -> Optional[tuple]:
+    """Finds the fence that closes a code block whose content starts at `pos`.
+
+    A closing fence is a run of at least as many backticks as the opening fence, followed only by
+    whitespace up to the end of the line. Returns the end of the content and the end of the fence,
+    or None if the block is not closed.
+    """
+    while True:
+        idx = text.find(fence, pos)
+        if idx < 0:
+            return None
+        run_end = idx + len(fence)
+        while run_end < len(text) and text[run_end] == "`":
+            run_end += 1
+        line_end = text.find("\n", run_end)
+        if line_end < 0:
+            line_end = len(text)
+        if not text[run_end:line_end].strip():
+            line_start = text.rfind("\n", 0, idx) + 1
+            # A fence on its own line is not part of the content
+            content_end = line_start if not text[line_start:idx].strip() else idx
+            return max(content_end, pos), run_end
+        pos = run_end
+
+
+def scan_markdown(text: str, keywords: Optional[Sequence[str]] = None) -> List[Chunk]:
+    """
+    Splits a markdown response into code blocks and text in one pass.
+
+    Code blocks start with a fence of three or more backticks at the beginning of a line and
+    end at a fence of at least as many backticks, so blocks fenced with four backticks may
+    contain blocks fenced with three. The fence line is not part of the content. Blocks that are
+    empty or not closed are skipped.
+
+    Args:
+        text (str): The markdown text to split.
+        keywords (Sequence[str]): If None, the text between code blocks is returned as text
+            chunks. Otherwise only the lines of text that start with one of the keywords are
+            returned, as one chunk each.
+
+    Returns:
+        List[Chunk]: The chunks, in the order they appear in the text.
+    """
+    first_line, next_line = _text_patterns(tuple(keywords or ()))
+    chunks = []
+    text_start = 0
+    # Shortest fence that was not closed. Longer fences later in the text cannot be closed either.
+    unclosed = None
+    match = first_line.match(text) or next_line.search(text)
+    while match is not None:
+        if match.group("fence") is None:
+            # A keyword line
+            line_end = text.find("\n", match.end())
+            if line_end < 0:
+                line_end = len(text)
+            keyword = match.group("keyword")
+            argument = text[match.end():line_end].strip().strip("`'\"").strip()
+            chunks.append(Chunk(text, "text", match.start("keyword"), line_end, keyword, argument))
+            match = next_line.search(text, line_end)
+            continue
+
+        fence = match.group("fence")
+        closing = None
+        if unclosed is None or len(fence) < unclosed:
+            closing = _closing_fence(text, fence, match.end())
+        if closing is None:
+            # Not closed, so the following lines are scanned as text
+            unclosed = len(fence) if unclosed is None else min(unclosed, len(fence))
+            match = next_line.search(text, match.end() - 1)
+            continue
+        content_end, fence_end = closing
+        if keywords is None and text_start < match.start("fence"):
+            chunks.append(Chunk(text, "text", text_start, match.start("fence")))
+        info = match.group("info").split()
+        language = info[0] if info and _LANGUAGE.fullmatch(info[0]) else "code"
+        if content_end > match.end():
+            chunks.append(Chunk(text, language, match.end(), content_end))
+        text_start = fence_end
+        match = next_line.search(text, fence_end)
+    if keywords is None and text_start < len(text):
+        chunks.append(Chunk(text, "text", text_start, len(text)))
+    return chunks
@@ -1,10 +1,14 @@
+import json
 import os
-from dataclasses import dataclass, field, asdict
-from typing import List, Tuple
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Tuple
 
+import openai
 from openai import OpenAI
 
-from codebuddy.backend import Backend
+from codebuddy.backend import Backend, BatchResult, estimate_prompt_tokens
+from codebuddy.tools import openai_message, openai_tool, openai_tool_calls
 from codebuddy.utils import Message
 
 
@@ -12,6 +16,32 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+BATCH_ENDPOINT = "/v1/chat/completions"
+# Errors that a streamed request is retried after
+RETRY_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+
+def parse_openai_batch_line(record: dict) -> BatchResult:
+    """Returns the result of one line of an OpenAI batch output or error file."""
+    response = record.get("response") or {}
+    body = response.get("body") or {}
+    if record.get("error") or response.get("status_code") != 200:
+        error = record.get("error") or body.get("error") or f"HTTP {response.get('status_code')}"
+        return BatchResult(record["custom_id"], error=str(error))
+    usage = body.get("usage") or {}
+    details = usage.get("prompt_tokens_details") or {}
+    return BatchResult(
+        record["custom_id"],
+        content=body["choices"][0]["message"]["content"],
+        usage=(
+            usage.get("prompt_tokens") or 0,
+            usage.get("completion_tokens") or 0,
+            details.get("cached_tokens") or 0,
+            0,
+        ),
+    )
+
+
 @dataclass
 class OpenaiBackend(Backend):
     """Backend for OpenAI chat completions API."""
@@ -57,20 +87,129 @@ class OpenaiBackend(Backend):
             if k in ["model", "max_tokens", "top_p", "temperature", "stop"]
         }
 
-    def call_api(self, messages: List[Message], retries: int = 0) -> str:
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        request = self.request_base()
-        request["messages"] = [asdict(x) for x in messages]
+    def format_messages(self, messages: List[Message]) -> List[dict]:
+        """Returns request messages, merging leading system messages into one.
+
+        OpenAI caches prompt prefixes automatically, so a system prompt split into a stable
+        prefix and a dynamic suffix is sent as a single message with the prefix first.
+        """
+        n_system = next(
+            (idx for idx, msg in enumerate(messages) if msg.role != "system"), len(messages)
+        )
+        formatted = [openai_message(x) for x in messages[n_system:]]
+        if n_system:
+            system = "".join(msg.content for msg in messages[:n_system])
+            formatted.insert(0, {"role": "system", "content": system})
+        return formatted
 
+    def _record_usage(self, usage):
+        self.input_tokens.append(usage.prompt_tokens)
+        self.output_tokens.append(usage.completion_tokens)
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.cache_read_tokens.append(getattr(details, "cached_tokens", None) or 0)
+        self.cache_write_tokens.append(0)
+
+    def _create(self, request: dict):
+        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
         logger.debug(request)
         response = client.chat.completions.create(**request)
         logger.debug(response)
+        self._record_usage(response.usage)
+        return response
+
+    def stream_api(self, messages: List[Message], retries: int = 0) -> Iterator[str]:
+        """Yields the response content as it is generated and then updates the token counts.
+
+        Requests that fail before the stream starts are retried up to 3 times. Closing the
+        generator early cancels the response.
+        """
+        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        request = self.request_base()
+        request["messages"] = self.format_messages(messages)
+        request["stream"] = True
+        request["stream_options"] = {"include_usage": True}
+        logger.debug(request)
 
-        self.input_tokens.append(response.usage.prompt_tokens)
-        self.output_tokens.append(response.usage.completion_tokens)
+        try:
+            stream = client.chat.completions.create(**request)
+        except RETRY_ERRORS as ex:
+            if retries >= 3:
+                raise
+            logger.info(f"Request failed ({ex}). Sleeping for {2 ** retries}s and trying again.")
+            time.sleep(2 ** retries)
+            yield from self.stream_api(messages, retries=retries + 1)
+            return
+        usage = None
+        n_pieces = 0
+        try:
+            for chunk in stream:
+                usage = chunk.usage or usage
+                for choice in chunk.choices:
+                    if choice.delta.content:
+                        n_pieces += 1
+                        yield choice.delta.content
+        except GeneratorExit:
+            # Closing the stream stops generation. Usage is only reported at the end, so output
+            # tokens are estimated as one per chunk and input tokens from the prompt.
+            stream.close()
+            self.record_usage((estimate_prompt_tokens(request["messages"]), n_pieces, 0, 0))
+            raise
+        self._record_usage(usage)
 
+    def call_api(self, messages: List[Message], retries: int = 0) -> str:
+        request = self.request_base()
+        request["messages"] = self.format_messages(messages)
+        response = self._create(request)
         return response.choices[0].message.content
 
+    def call_api_with_tools(
+        self, messages: List[Message], tools: List[dict], retries: int = 0
+    ) -> Message:
+        request = self.request_base()
+        request["messages"] = self.format_messages(messages)
+        request["tools"] = [openai_tool(x) for x in tools]
+        message = self._create(request).choices[0].message
+        tool_calls = openai_tool_calls([x.model_dump() for x in message.tool_calls or []])
+        return Message("assistant", message.content or "", tool_calls=tool_calls or None)
+
+    def batch_line(self, request_id: str, messages: List[Message]) -> dict:
+        """Returns a request in the OpenAI batch input format."""
+        request = self.request_base()
+        request["messages"] = self.format_messages(messages)
+        return {"custom_id": request_id, "method": "POST", "url": BATCH_ENDPOINT, "body": request}
+
+    def submit_batch(self, requests: Dict[str, List[Message]]) -> str:
+        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        data = "".join(json.dumps(self.batch_line(k, v)) + "\n" for k, v in requests.items())
+        batch_file = client.files.create(file=("batch.jsonl", data.encode()), purpose="batch")
+        batch = client.batches.create(
+            input_file_id=batch_file.id, endpoint=BATCH_ENDPOINT, completion_window="24h"
+        )
+        return batch.id
+
+    def batch_status(self, batch_id: str) -> str:
+        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        status = client.batches.retrieve(batch_id).status
+        # Expired batches keep the results of the requests that completed in time
+        if status in ("completed", "expired"):
+            return "completed"
+        if status in ("failed", "cancelling", "cancelled"):
+            return "failed"
+        return "running"
+
+    def batch_results(self, batch_id: str) -> Dict[str, BatchResult]:
+        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        batch = client.batches.retrieve(batch_id)
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in client.files.content(file_id).text.splitlines():
+                if line.strip():
+                    result = parse_openai_batch_line(json.loads(line))
+                    results[result.request_id] = result
+        return results
+
 
 if __name__ == "__main__":
     from dotenv import load_dotenv
@@ -0,0 +1,220 @@
+"""A persistent Python interpreter that executes code blocks over a framed pipe protocol.
+
+This file is also the worker entry point and only imports from the standard library, so it can
+be run by any Python environment.
+"""
+import ast
+import json
+import os
+import select
+import signal
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from typing import Optional
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _write_frame(f, message: dict):
+    """Writes a length-prefixed JSON message."""
+    data = json.dumps(message).encode()
+    f.write(struct.pack(">I", len(data)) + data)
+    f.flush()
+
+
+def _read_frame(f) -> Optional[dict]:
+    """Reads a length-prefixed JSON message. Returns None at end of file."""
+    header = f.read(4)
+    if len(header) < 4:
+        return None
+    (length,) = struct.unpack(">I", header)
+    return json.loads(f.read(length).decode())
+
+
+def _execute(code: str, namespace: dict) -> dict:
+    """Executes a code block, capturing stdout and stderr at the file descriptor level.
+
+    If the last statement is an expression, its repr is returned as the result, as in ipython.
+    """
+    response = {"stdout": "", "stderr": "", "result": None, "error": None}
+    out_file, err_file = tempfile.TemporaryFile(), tempfile.TemporaryFile()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(out_file.fileno(), 1)
+    os.dup2(err_file.fileno(), 2)
+    try:
+        tree = ast.parse(code, "<ipython>", "exec")
+        last = None
+        if tree.body and isinstance(tree.body[-1], ast.Expr):
+            last = ast.Expression(tree.body.pop().value)
+        exec(compile(tree, "<ipython>", "exec"), namespace)
+        if last is not None:
+            value = eval(compile(last, "<ipython>", "eval"), namespace)
+            if value is not None:
+                namespace["_"] = value
+                response["result"] = repr(value)
+    except BaseException as ex:
+        response["error"] = {
+            "type": type(ex).__name__,
+            "message": str(ex),
+            "traceback": traceback.format_exc(),
+        }
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for key, f in (("stdout", out_file), ("stderr", err_file)):
+            f.seek(0)
+            response[key] = f.read().decode(errors="replace")
+            f.close()
+    return response
+
+
+def serve():
+    """Runs the worker loop, reading code blocks from stdin and writing results to stdout."""
+    # Resolve imports like an interactive session instead of from this file's directory
+    sys.path[0] = ""
+    requests = os.fdopen(os.dup(0), "rb")
+    responses = os.fdopen(os.dup(1), "wb")
+    # User code must not read from or write to the protocol pipes
+    os.dup2(os.open(os.devnull, os.O_RDONLY), 0)
+    namespace = {"__name__": "__main__"}
+    _write_frame(responses, {"ready": True})
+    while True:
+        try:
+            request = _read_frame(requests)
+            if request is None:
+                break
+            _write_frame(responses, _execute(request["code"], namespace))
+        except KeyboardInterrupt:
+            # An interrupt that arrives between requests is ignored
+            continue
+
+
+@dataclass
+class PythonWorker:
+    """A Python subprocess that executes code blocks sent over pipes.
+
+    Output is captured exactly, exceptions are reported with their type and traceback, and
+    blocks that run longer than the timeout are interrupted. If an interrupt does not stop the
+    block, the worker is restarted and its state is lost.
+    """
+
+    python_env: str = ""  #: Python environment used to run the worker
+    project_path: str = "~"  #: Working directory of the worker
+    timeout: float = 600.  #: Default number of seconds before a block is interrupted
+    interrupt_grace: float = 2.  #: Seconds to wait after an interrupt before restarting
+    content: str = ""  #: Output of the last block
+
+    def __post_init__(self):
+        self.project_path = os.path.expanduser(self.project_path).rstrip("/")
+        self.python_env = os.path.expanduser(self.python_env)
+        self._cancel_event = threading.Event()
+        self._process = None
+        self.start()
+
+    @property
+    def executable(self) -> str:
+        python = os.path.join(self.python_env, "bin", "python")
+        return python if self.python_env and os.path.exists(python) else sys.executable
+
+    def start(self):
+        """Starts (or restarts) the worker process."""
+        self.close()
+        env = dict(os.environ, PROJECT_PATH=self.project_path, PYTHONPATH=self.project_path)
+        self._process = subprocess.Popen(
+            [self.executable, "-u", os.path.abspath(__file__)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            cwd=self.project_path,
+            env=env,
+        )
+        if _read_frame(self._process.stdout) is None:
+            raise RuntimeError(f"Python worker failed to start with {self.executable}.")
+
+    def close(self):
+        """Stops the worker process."""
+        if self._process is not None and self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+
+    def cancel(self):
+        """Interrupts the block that is currently running, if any."""
+        self._cancel_event.set()
+
+    def _wait_readable(self, timeout: Optional[float]) -> Optional[str]:
+        """Waits for a response. Returns the reason if it timed out or was cancelled."""
+        deadline = time.monotonic() + timeout if timeout else None
+        while True:
+            if self._cancel_event.is_set():
+                return "Execution cancelled"
+            remaining = deadline - time.monotonic() if deadline is not None else 0.05
+            if remaining <= 0:
+                return f"Execution timed out after {timeout:g}s"
+            readable, _, _ = select.select([self._process.stdout], [], [], min(remaining, 0.05))
+            if readable:
+                return None
+
+    def execute(self, code: str, timeout: Optional[float] = None) -> dict:
+        """Executes a code block and returns its stdout, stderr, result and error.
+
+        If the block is interrupted, the response also includes an "interrupted" key with the
+        reason, and a "restarted" key if the worker had to be restarted.
+        """
+        timeout = timeout if timeout is not None else self.timeout
+        self._cancel_event.clear()
+        if self._process.poll() is not None:
+            self.start()
+        _write_frame(self._process.stdin, {"code": code})
+        reason = self._wait_readable(timeout)
+        if reason is None:
+            response = _read_frame(self._process.stdout)
+            if response is None:
+                self.start()
+                message = "The Python worker exited and was restarted. Its state was lost."
+                response = {
+                    "stdout": "", "stderr": "", "result": None,
+                    "error": {"type": "WorkerExited", "message": message, "traceback": message},
+                }
+            return response
+
+        logger.warning(f"{reason}. Interrupting the Python worker.")
+        self._process.send_signal(signal.SIGINT)
+        self._cancel_event.clear()
+        if self._wait_readable(self.interrupt_grace) is None:
+            response = _read_frame(self._process.stdout)
+            response["interrupted"] = reason
+            return response
+        self.start()
+        return {
+            "stdout": "", "stderr": "", "result": None, "error": None,
+            "interrupted": reason, "restarted": True,
+        }
+
+    def __call__(self, command: str, timeout: Optional[float] = None) -> str:
+        """Executes a code block and returns its output formatted like an interactive session."""
+        response = self.execute(command, timeout=timeout)
+        parts = [response["stdout"].rstrip("\n"), response["stderr"].rstrip("\n")]
+        if response["result"] is not None:
+            parts.append(response["result"])
+        if response["error"] is not None:
+            parts.append(response["error"]["traceback"].rstrip("\n"))
+        if "interrupted" in response:
+            state = "The worker was restarted and its state was lost" if response.get(
+                "restarted"
+            ) else "KeyboardInterrupt sent"
+            parts.append(f"[{response['interrupted']}. {state}.]")
+        self.content = "\n".join(x for x in parts if x)
+        return self.content
+
+
+if __name__ == "__main__":
+    serve()
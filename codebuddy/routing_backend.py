@@ -0,0 +1,142 @@
+import time
+from dataclasses import dataclass, field
+from typing import Callable, List, Tuple, TypeVar
+
+from codebuddy.backend import Backend
+from codebuddy.bedrock_backend import BedrockBackend
+from codebuddy.utils import Message
+
+
+import logging
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+@dataclass
+class RoutingBackend(Backend):
+    """Backend that routes each step to a cheap or a strong model.
+
+    The routing decision uses `step_info`, which agent modules such as `TmuxModule` update
+    before each LLM call with the keys `depth`, `previous_tools` and `edit_failed`. Every
+    decision is appended to `routing_log` along with its cost and the cost it would have had
+    on the strong model.
+    """
+    cheap: Backend = field(
+        default_factory=BedrockBackend,
+        metadata={"help": "Fast, inexpensive backend used for routine steps"},
+    )
+    strong: Backend = field(
+        default_factory=lambda: BedrockBackend(
+            model_id="anthropic.claude-3-sonnet-20240229-v1:0"
+        ),
+        metadata={"help": "Stronger backend used for planning, large prompts and escalations"},
+    )
+    cheap_min_depth: int = field(
+        metadata={"help": "Steps with a lower recursion depth are sent to the strong backend"},
+        default=1,
+    )
+    cheap_tools: List[str] = field(
+        default_factory=lambda: ["terminal", "ipython", "RECALL"],
+        metadata={
+            "help": (
+                "Tool types that may be followed by a cheap step. A previous step using any "
+                "other tool (e.g., a file edit) routes to the strong backend"
+            )
+        },
+    )
+    max_cheap_prompt_chars: int = field(
+        metadata={"help": "Prompts longer than this many characters use the strong backend"},
+        default=60000,
+    )
+    escalate_on_edit_failure: bool = field(
+        metadata={"help": "If True, route to the strong backend after a failed file edit"},
+        default=True,
+    )
+    cheap_cost: Tuple[float, float] = field(
+        default=(0.25, 1.25),
+        metadata={"help": "Cheap backend (input, output) cost in dollars per million tokens"},
+    )
+    strong_cost: Tuple[float, float] = field(
+        default=(3., 15.),
+        metadata={"help": "Strong backend (input, output) cost in dollars per million tokens"},
+    )
+    step_info: dict = field(
+        default_factory=lambda: {},
+        metadata={"help": "Signals describing the current step, set by the calling module"},
+    )
+    routing_log: List[dict] = field(
+        default_factory=lambda: [],
+        metadata={"help": "A record of every routing decision"},
+    )
+
+    @property
+    def savings(self) -> float:
+        """Returns the estimated dollar savings versus sending every step to the strong backend."""
+        return sum(x["savings"] for x in self.routing_log)
+
+    def request_base(self):
+        return self.strong.request_base()
+
+    def route(self, messages: List[Message]) -> Tuple[str, str]:
+        """Returns the route ("cheap" or "strong") for a request and the reason for it."""
+        depth = self.step_info.get("depth", 0)
+        previous_tools = self.step_info.get("previous_tools", [])
+        if self.escalate_on_edit_failure and self.step_info.get("edit_failed"):
+            return "strong", "previous edit failed"
+        if depth < self.cheap_min_depth:
+            return "strong", f"depth {depth} < {self.cheap_min_depth}"
+        prompt_chars = sum(len(msg.content) for msg in messages)
+        if prompt_chars > self.max_cheap_prompt_chars:
+            return "strong", f"prompt size {prompt_chars} > {self.max_cheap_prompt_chars}"
+        other_tools = [x for x in previous_tools if x not in self.cheap_tools]
+        if other_tools:
+            return "strong", f"previous step used {', '.join(sorted(set(other_tools)))}"
+        return "cheap", f"depth {depth}, previous tools {previous_tools or 'none'}"
+
+    @staticmethod
+    def _cost(cost: Tuple[float, float], input_tokens: int, output_tokens: int) -> float:
+        return (cost[0] * input_tokens + cost[1] * output_tokens) / 1e6
+
+    def _call_routed(self, messages: List[Message], call: Callable[[Backend], T]) -> T:
+        """Routes a request, makes it with `call` on the chosen backend and logs the decision."""
+        route, reason = self.route(messages)
+        backend = self.cheap if route == "cheap" else self.strong
+        offsets = backend.usage_offsets()
+        start = time.monotonic()
+        response = call(backend)
+        latency = time.monotonic() - start
+        usage = backend.usage_since(offsets)
+        self.record_usage(usage)
+        input_tokens, output_tokens = usage[:2]
+
+        cost = self._cost(
+            self.cheap_cost if route == "cheap" else self.strong_cost, input_tokens, output_tokens
+        )
+        strong_cost = self._cost(self.strong_cost, input_tokens, output_tokens)
+        self.routing_log.append({
+            "route": route,
+            "reason": reason,
+            "depth": self.step_info.get("depth", 0),
+            "previous_tools": list(self.step_info.get("previous_tools", [])),
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "latency": latency,
+            "cost": cost,
+            "savings": strong_cost - cost,
+        })
+        logger.info(
+            f"Routed to {route} ({reason}) in {latency:.2f}s, cost ${cost:.4f}, "
+            f"total savings ${self.savings:.4f}"
+        )
+        return response
+
+    def call_api(self, messages: List[Message], retries: int = 0) -> str:
+        return self._call_routed(messages, lambda backend: backend.call_api(messages))
+
+    def call_api_with_tools(
+        self, messages: List[Message], tools: List[dict], retries: int = 0
+    ) -> Message:
+        return self._call_routed(
+            messages, lambda backend: backend.call_api_with_tools(messages, tools)
+        )
@@ -0,0 +1,225 @@
+import json
+import os
+import shlex
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List
+
+from codebuddy.backend import USAGE_FIELDS
+from codebuddy.conversation_store import DialogHistory
+from codebuddy.utils import Dialog, Message
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Variables that belong to the tmux server or shell process rather than to the session
+ENV_EXCLUDE = ["TMUX", "TMUX_PANE", "SHLVL", "PWD", "OLDPWD", "_"]
+
+
+def read_snapshot(path: str) -> dict:
+    """Replays a snapshot file and returns the latest state it records.
+
+    Args:
+        path (str): Path to a JSONL snapshot written by `SessionSnapshot`.
+
+    Returns:
+        dict: The messages, dialog history, token usage, compacted outputs, python blocks and
+            terminal sessions (cwd and exported environment by session id).
+    """
+    state = {
+        "messages": [],
+        "dialog_history": [],
+        "usage": {k: [] for k in USAGE_FIELDS},
+        "outputs": [],
+        "python_history": [],
+        "sessions": {},
+    }
+    with open(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a partial last line
+                logger.warning(f"Skipping a corrupt record in {path}")
+                continue
+            record_type = record.pop("type")
+            if record_type == "message":
+                state["messages"].append(Message(**record))
+            elif record_type == "messages":
+                state["messages"] = [Message(**x) for x in record["messages"]]
+            elif record_type == "clear":
+                state["dialog_history"].append(Dialog(state["messages"]))
+                state["messages"] = []
+            elif record_type == "dialog":
+                state["dialog_history"].append(Dialog([Message(**x) for x in record["messages"]]))
+            elif record_type == "usage":
+                for k, v in record["usage"].items():
+                    state["usage"][k] += v
+            elif record_type == "output":
+                state["outputs"].append(record["content"])
+            elif record_type == "python":
+                state["python_history"].append(record["code"])
+            elif record_type == "session":
+                state["sessions"][record["session_id"]] = record
+    return state
+
+
+@dataclass
+class SessionSnapshot:
+    """Writes a `TmuxModule` session to an append-only JSONL file so that it can be resumed.
+
+    Each call to `write` appends only what changed since the previous call: new messages, token
+    usage, compacted outputs and ipython blocks. Terminal state (cwd and exported environment) is
+    captured when requested, since it requires running a command in the session. Python
+    interpreter state cannot be serialized, so the ipython blocks are recorded and can be
+    replayed on resume if asked, since replaying repeats their side effects.
+    """
+
+    path: str = ""  #: Snapshot file
+    counts: Dict[str, int] = field(default_factory=dict)  #: Number of items already written
+
+    def __post_init__(self):
+        self.path = os.path.expanduser(self.path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._messages = None
+        self._sessions = {}
+        self._session_contents = {}
+
+    def _append(self, records: List[dict]):
+        if not records:
+            return
+        with open(self.path, "a") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _sync(self, module):
+        """Marks everything in a module as written."""
+        self._messages = module.messages
+        self.counts = {
+            "messages": len(module.messages),
+            "dialogs": len(module.dialog_history),
+            "outputs": len(module.compactor.outputs),
+            "python": len(module.python_history),
+            **{k: len(getattr(module, k)) for k in USAGE_FIELDS},
+        }
+
+    def capture_session(self, session) -> dict:
+        """Returns the cwd and exported environment of a tmux terminal session."""
+        env_path = self.path + f".{session.session_id}.env"
+        session(f"(unset {' '.join(ENV_EXCLUDE)}; export -p) > {shlex.quote(env_path)}")
+        try:
+            with open(env_path, "r") as f:
+                env = f.read()
+            os.remove(env_path)
+        except OSError:
+            env = ""
+        return {"type": "session", "session_id": session.session_id, "cwd": session.cwd, "env": env}
+
+    def write(self, module, capture_sessions: bool = False):
+        """Appends the changes in a module since the last write.
+
+        The first write of a session that was not restored starts a new file. An existing
+        snapshot at the path is moved to `path`.bak.
+        """
+        if self._messages is None and not self.counts:
+            # A session that was not restored starts a new snapshot, keeping the old one
+            if os.path.exists(self.path) and os.path.getsize(self.path):
+                os.replace(self.path, self.path + ".bak")
+                logger.warning(f"Moved the existing snapshot {self.path} to {self.path}.bak")
+            open(self.path, "w").close()
+            self._messages = module.messages
+            self.counts = {"messages": 0}
+        records = []
+        for dialog in module.dialog_history[self.counts.get("dialogs", 0):]:
+            if dialog.turns is self._messages and self.counts.get("messages", 0) == len(dialog.turns):
+                records.append({"type": "clear"})
+            else:
+                records.append({"type": "dialog", "messages": [asdict(x) for x in dialog.turns]})
+            self._messages, self.counts["messages"] = None, 0
+        self.counts["dialogs"] = len(module.dialog_history)
+
+        if module.messages is not self._messages:
+            # The message list was replaced, e.g. by the gradio interface. If it starts with the
+            # messages already written, only the new ones are appended.
+            count = self.counts.get("messages", 0)
+            written = self._messages[:count] if self._messages is not None else []
+            if len(written) != count or module.messages[:count] != written:
+                records.append({"type": "messages", "messages": [asdict(x) for x in module.messages]})
+                self.counts["messages"] = len(module.messages)
+            self._messages = module.messages
+        for message in module.messages[self.counts["messages"]:]:
+            records.append({"type": "message", **asdict(message)})
+        self.counts["messages"] = len(module.messages)
+
+        usage = {k: getattr(module, k)[self.counts.get(k, 0):] for k in USAGE_FIELDS}
+        if any(usage.values()):
+            records.append({"type": "usage", "usage": usage})
+        for k in USAGE_FIELDS:
+            self.counts[k] = len(getattr(module, k))
+        for output in module.compactor.outputs[self.counts.get("outputs", 0):]:
+            records.append({"type": "output", "content": output})
+        self.counts["outputs"] = len(module.compactor.outputs)
+        for code in module.python_history[self.counts.get("python", 0):]:
+            records.append({"type": "python", "code": code})
+        self.counts["python"] = len(module.python_history)
+
+        # Capturing runs a command, so it is skipped if nothing ran since the last capture
+        session = module.terminal_session if capture_sessions else None
+        if session is not None and session.content != self._session_contents.get(session.session_id):
+            record = self.capture_session(session)
+            self._session_contents[session.session_id] = session.content
+            if record != self._sessions.get(record["session_id"]):
+                records.append(record)
+                self._sessions[record["session_id"]] = record
+        self._append(records)
+
+    def restore(self, module, replay_python: bool = False):
+        """Restores a module from the snapshot file without calling the LLM.
+
+        If `replay_python` is True, the recorded ipython blocks are run again, repeating any
+        file writes, network calls or other side effects they had.
+        """
+        state = read_snapshot(self.path)
+        module.messages = state["messages"]
+        if isinstance(module.dialog_history, DialogHistory):
+            # The store keeps recording, and past dialogs are only copied into a new conversation
+            if not len(module.dialog_history):
+                for dialog in state["dialog_history"]:
+                    module.dialog_history.append(dialog)
+            module._record_messages()
+        else:
+            module.dialog_history = state["dialog_history"]
+        for k in USAGE_FIELDS:
+            setattr(module, k, state["usage"][k])
+        module.compactor.outputs = state["outputs"]
+
+        session = state["sessions"].get(module.terminal_session.session_id)
+        if session is not None:
+            env_path = self.path + ".restore.env"
+            with open(env_path, "w") as f:
+                f.write(session["env"])
+            for terminal in module.terminal_pool:
+                terminal(
+                    f"source {shlex.quote(env_path)} 2>/dev/null; cd {shlex.quote(session['cwd'])}"
+                )
+            os.remove(env_path)
+            self._sessions[session["session_id"]] = session
+            self._session_contents[session["session_id"]] = module.terminal_session.content
+
+        module.python_history = []
+        if replay_python:
+            for code in state["python_history"]:
+                module._run_python(code)
+        else:
+            module.python_history = state["python_history"]
+        module.command_cache.invalidate()
+        self._sync(module)
+        logger.info(
+            f"Restored {len(module.messages)} messages, {len(module.dialog_history)} dialogs and "
+            f"{len(state['python_history'])} ipython blocks from {self.path}"
+        )
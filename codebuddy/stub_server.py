@@ -0,0 +1,238 @@
+import itertools
+import json
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Union
+
+from codebuddy.script import Script
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keeps connections alive between requests
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def _send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            models = [{"id": self.server.model, "object": "model"}]
+            self._send_json(200, {"object": "list", "data": models})
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        with self.server.lock:
+            self.server.requests.append(request)
+        content = self.server.next_response(request)
+        tool_calls = []
+        if isinstance(content, dict):
+            tool_calls = [
+                {
+                    "id": f"call_{uuid.uuid4().hex[:8]}",
+                    "type": "function",
+                    "function": {
+                        "name": x["name"], "arguments": json.dumps(x.get("arguments", {}))
+                    },
+                }
+                for x in content.get("tool_calls") or []
+            ]
+            content = content.get("content") or ""
+        finish_reason = "tool_calls" if tool_calls else "stop"
+        prompt_tokens = sum(len(str(x.get("content", ""))) for x in request.get("messages", [])) // 4
+        words = content.split(" ")
+        pieces = [x + " " for x in words[:-1]] + words[-1:]
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(pieces),
+            "total_tokens": prompt_tokens + len(pieces),
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        time.sleep(self.server.latency)
+
+        if not request.get("stream"):
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", self.server.model),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content, **(
+                        {"tool_calls": tool_calls} if tool_calls else {}
+                    )},
+                    "finish_reason": finish_reason,
+                }],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send_event(data: str):
+            payload = f"data: {data}\n\n".encode()
+            self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+            self.wfile.flush()
+
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": request.get("model", self.server.model),
+        }
+        try:
+            for idx, piece in enumerate(pieces):
+                delta = {"content": piece} if idx else {"role": "assistant", "content": piece}
+                choice = {"index": 0, "delta": delta, "finish_reason": None}
+                send_event(json.dumps({**chunk, "choices": [choice]}))
+                if self.server.token_delay:
+                    time.sleep(self.server.token_delay)
+            for idx, call in enumerate(tool_calls):
+                # Arguments are split over two chunks, like the pieces streamed by real servers
+                name, arguments = call["function"]["name"], call["function"]["arguments"]
+                parts = [
+                    {**call, "function": {"name": name, "arguments": arguments[:5]}},
+                    {"function": {"arguments": arguments[5:]}},
+                ]
+                for part in parts:
+                    delta = {"tool_calls": [{"index": idx, **part}]}
+                    choice = {"index": 0, "delta": delta, "finish_reason": None}
+                    send_event(json.dumps({**chunk, "choices": [choice]}))
+            choice = {"index": 0, "delta": {}, "finish_reason": finish_reason}
+            send_event(json.dumps({**chunk, "choices": [choice]}))
+            if (request.get("stream_options") or {}).get("include_usage"):
+                send_event(json.dumps({**chunk, "choices": [], "usage": usage}))
+            send_event("[DONE]")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled the response
+            logger.debug("Client disconnected during a streamed response")
+            self.close_connection = True
+            return
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class StubServer(ThreadingHTTPServer):
+    """A local server implementing the OpenAI chat completions API with scripted responses.
+
+    Responses are returned in order and cycled. A response is a string, or a dict with the keys
+    `content` and `tool_calls` (a list of dicts with a `name` and `arguments`) for a response
+    that calls tools. Without responses, the last user message is echoed. Supports streaming and
+    keep-alive connections, so agent loops and backends can be tested and load-tested offline.
+    The server records every request and counts connections.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        responses: List[Union[str, dict]] = None,
+        model: str = "stub-model",
+        latency: float = 0.,
+        token_delay: float = 0.,
+    ):
+        super().__init__((host, port), _Handler)
+        self.model = model
+        self.latency = latency
+        self.token_delay = token_delay
+        self._responses = itertools.cycle(responses) if responses else None
+        self.requests = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def next_response(self, request: dict) -> Union[str, dict]:
+        """Returns the content of the next response."""
+        if self._responses is not None:
+            with self.lock:
+                return next(self._responses)
+        users = [x for x in request.get("messages", []) if x.get("role") == "user"]
+        return str(users[-1]["content"]) if users else ""
+
+    def start(self) -> "StubServer":
+        """Serves requests on a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops serving and closes the socket."""
+        self.shutdown()
+        self.server_close()
+
+
+@dataclass
+class StubServerLauncher(Script):
+    """Serve scripted responses on an OpenAI compatible chat completions endpoint."""
+    host: str = field(default="127.0.0.1", metadata={"help": "Host to listen on."})
+    port: int = field(default=8000, metadata={"help": "Port to listen on."})
+    responses_path: str = field(
+        default="",
+        metadata={
+            "help": (
+                "JSONL file of responses (strings, or objects with content and tool_calls), "
+                "returned in order. Echoes by default."
+            )
+        }
+    )
+    latency: float = field(default=0., metadata={"help": "Seconds before each response starts."})
+    token_delay: float = field(
+        default=0., metadata={"help": "Seconds between streamed response chunks."}
+    )
+
+    def run(self):
+        responses = None
+        if self.responses_path:
+            with open(self.responses_path, "r") as f:
+                responses = [json.loads(x) for x in f if x.strip()]
+        server = StubServer(
+            host=self.host,
+            port=self.port,
+            responses=responses,
+            latency=self.latency,
+            token_delay=self.token_delay,
+        )
+        logger.info(f"Serving on {server.base_url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    StubServerLauncher.parse_args().run()
@@ -1,12 +1,17 @@
+import hashlib
 import os
 import re
 import shlex
 import subprocess
+import threading
 import time
+import uuid
 from dataclasses import dataclass
+from typing import Optional
 
 import logging
 
+from codebuddy.transcript import Transcript
 from codebuddy.utils import run_bash
 
 
@@ -34,29 +39,150 @@ class TmuxSession:
     python_env: str = "~/myenv"
     project_path: str = "~"
     content: str = ""
+    timeout: float = 600.
+    interrupt_keys: tuple = ("C-c", "q", "C-c", "C-\\")
+    interrupt_grace: float = 2.
+
+    interpreter: str = ""
+    interpreter_prompt: str = ">>>"
+    reuse: bool = False
+    startup_timeout: float = 60.
+    transcript_dir: str = ""
 
     def __post_init__(self):
+        self._cancel_event = threading.Event()
         self.project_path = os.path.expanduser(self.project_path).rstrip("/")
         self.python_env = os.path.expanduser(self.python_env)
+        # Hash of the settings that a reused session must have been started with
+        settings = (
+            self.project_path, self.python_env, self.session_width, self.session_height,
+            self.prompt, self.prefix_break_token, self.interpreter,
+        )
+        self.fingerprint = hashlib.sha256(repr(settings).encode()).hexdigest()[:16]
+        shell_prompt = self.prompt
+        if self.interpreter:
+            self.prompt = self.interpreter_prompt
+        if self.reuse and self._is_healthy():
+            logger.info(f"Reusing tmux session {self.session_id}")
+        else:
+            self._start(shell_prompt)
+        self.transcript = None
+        if self.transcript_dir:
+            # Session ids such as the default "terminal-session" are reused across projects
+            digest = hashlib.sha256(self.project_path.encode()).hexdigest()[:8]
+            project = f"{os.path.basename(self.project_path)}-{digest}"
+            self.transcript = Transcript(
+                path=os.path.join(
+                    os.path.expanduser(self.transcript_dir), project, self.session_id
+                )
+            )
+            self.transcript.attach(self.session_id)
+        self.content = self._process_output(self._capture())
+
+    def _is_healthy(self) -> bool:
+        """Returns True if the session exists, has a matching fingerprint and is responsive."""
+        fingerprint = run_bash(
+            f"tmux show-options -qv -t {self.session_id} @codebuddy_fingerprint 2>/dev/null"
+        )
+        return (fingerprint or "").strip() == self.fingerprint and self._wait_ready(timeout=2.)
+
+    def _start(self, shell_prompt: str):
+        """Creates the session and runs the startup commands."""
         run_bash(
             f"tmux kill-session -t {self.session_id} 2>/dev/null || true;"
             f"tmux new-session -s {self.session_id} -d;"
-            f"tmux resize-window -t {self.session_id} -x {self.session_width} -y {self.session_height}"
+            f"tmux resize-window -t {self.session_id} -x {self.session_width} -y {self.session_height};"
+            f"tmux set-option -t {self.session_id} @codebuddy_fingerprint {self.fingerprint}"
         )
         startup_commands = [
-            f'export PS1="%c%  {self.prompt} "',
+            f'export PS1="%c%  {shell_prompt} "',
             f"export PROJECT_PATH={self.project_path}",
             f"cd $PROJECT_PATH",
             f"export PYTHONPATH={self.project_path}",
             f"source {self.python_env}/bin/activate",
             f"echo '{self.prefix_break_token}'",
         ]
-        self("\n".join(startup_commands), sleep_duration=0.1)
+        if self.interpreter:
+            startup_commands += [self.interpreter, f"print('{self.prefix_break_token}')"]
+        self._send_keys("\n".join(startup_commands))
+        if not self._wait_ready(timeout=self.startup_timeout):
+            logger.warning(f"tmux session {self.session_id} was not ready after startup")
 
-    def __call__(self, command, sleep_duration=None):
-        sleep_duration = (
-            sleep_duration if sleep_duration is not None else self.sleep_duration
+    def _wait_ready(self, timeout: float) -> bool:
+        """Sends a unique sentinel and waits until it is printed and followed by the prompt.
+
+        Returns False on timeout.
+        """
+        token = uuid.uuid4().hex[:8]
+        # The sentinel is split in the typed command so only the printed output matches
+        if self.interpreter:
+            self._send_keys(f"print('CODEBUDDY_READY_' '{token}')")
+        else:
+            self._send_keys(f"echo CODEBUDDY_READY_\"\"{token}")
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            output = self._capture()
+            if f"CODEBUDDY_READY_{token}" in output.splitlines() and _check_command_complete(
+                output, prompt=self.prompt
+            ):
+                return True
+            time.sleep(0.02)
+        return False
+
+    @property
+    def cwd(self) -> str:
+        """Returns the current working directory of the session."""
+        cwd = run_bash(f"tmux display-message -p -t {self.session_id} '#{{pane_current_path}}'")
+        return cwd.strip() if cwd else ""
+
+    def cancel(self):
+        """Interrupts the command that is currently running, if any."""
+        self._cancel_event.set()
+
+    def close(self):
+        """Kills the tmux session."""
+        run_bash(f"tmux kill-session -t {self.session_id} 2>/dev/null")
+
+    def _capture(self) -> str:
+        """Returns the current contents of the pane."""
+        buffer_file = f"/tmp/{self.session_id}_output.txt"
+        subprocess.run(
+            f"tmux capture-pane -t {self.session_id} -p > {buffer_file}", shell=True
         )
+        with open(buffer_file, "r") as f:
+            return f.read().strip("\n")
+
+    def _wait(self, sleep_duration: float, timeout: Optional[float]) -> tuple:
+        """Polls the pane until the command completes, times out or is cancelled.
+
+        Returns the pane contents and the reason the command stopped early, if it did.
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        output = ""
+        while not _check_command_complete(output, prompt=self.prompt):
+            if self._cancel_event.is_set():
+                return output, "Command cancelled"
+            if deadline is not None and time.monotonic() > deadline:
+                return output, f"Command timed out after {timeout:g}s"
+            if sleep_duration:
+                time.sleep(sleep_duration)
+            output = self._capture()
+        return output, None
+
+    def _interrupt(self, sleep_duration: float) -> str:
+        """Sends escalating interrupt keys until the prompt returns and returns the pane."""
+        output = self._capture()
+        for key in self.interrupt_keys:
+            logger.info(f"Sending {key} to {self.session_id}")
+            subprocess.run(["tmux", "send-keys", "-t", self.session_id, key])
+            self._cancel_event.clear()
+            output, reason = self._wait(min(sleep_duration or 0.1, 0.1), self.interrupt_grace)
+            if reason is None:
+                break
+        return output
+
+    def _send_keys(self, command):
+        """Types each line of a command into the session."""
         # Escape single quotes in the command
         escaped_command = command.replace("'", r"'\''")
         for cmd in escaped_command.splitlines():
@@ -67,23 +193,34 @@ class TmuxSession:
             # Run the command
             logger.info(command_list)
             subprocess.run(command_list, text=True)
-        # Monitor the pane output
-        output = ""
-        buffer_file = f"/tmp/{self.session_id}_output.txt"
-        while not _check_command_complete(output, prompt=self.prompt):
-            if sleep_duration:
-                time.sleep(sleep_duration)
-            subprocess.run(
-                f"tmux capture-pane -t {self.session_id} -p > {buffer_file}", shell=True
-            )
-            with open(buffer_file, "r") as f:
-                output = f.read().strip("\n")
+
+    def _process_output(self, output):
+        """Returns the pane output after the break token, without the trailing prompt."""
         output = re.split(f"{self.prefix_break_token}", output)[-1].strip()
         if output.endswith(self.prompt):
             output = "\n".join(output.splitlines()[:-1])
         else:
             output = re.sub(r"^In \[\d+]:\s*$", "", output, flags=re.MULTILINE).strip()
+        return output
+
+    def __call__(self, command, sleep_duration=None, timeout=None):
+        sleep_duration = (
+            sleep_duration if sleep_duration is not None else self.sleep_duration
+        )
+        timeout = timeout if timeout is not None else self.timeout
+        self._cancel_event.clear()
+        if self.transcript is not None:
+            self.transcript.begin(command)
+        self._send_keys(command)
+        # Monitor the pane output
+        output, reason = self._wait(sleep_duration, timeout)
+        if reason is not None:
+            logger.warning(f"{reason} in {self.session_id}")
+            output = self._interrupt(sleep_duration)
+        output = self._process_output(output)
         self.content = output
+        if reason is not None:
+            return output + f"\n[{reason}. Interrupt sent, output may be partial.]"
         return output
 
 
@@ -94,8 +231,6 @@ if __name__ == "__main__":
     response = terminal_session("pwd")
     logger.info(response)
 
-    python_session = TmuxSession(session_id="python-session")
-    for cmd in ("ipython", "print('TMUX_BREAK')"):
-        response = python_session(cmd)
+    python_session = TmuxSession(session_id="python-session", interpreter="ipython")
     response = python_session("print('success')")
     logger.info(response)
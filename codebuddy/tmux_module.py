@@ -1,22 +1,40 @@
+import atexit
+import json
 import os
+import queue
 import re
+import shlex
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, asdict, field
-from typing import Union
+from typing import List, Tuple, Union
 
 import yaml
 import logging
 
 from codebuddy.openai_backend import OpenaiBackend
 from codebuddy.bedrock_backend import BedrockBackend
+from codebuddy.http_backend import HttpBackend
+from codebuddy.routing_backend import RoutingBackend
 from codebuddy.tmux import TmuxSession
 from codebuddy.script import Script
 from codebuddy.chat_module import ChatModule
+from codebuddy.checkpoint import CheckpointStore
+from codebuddy.code_index import CodeIndex
+from codebuddy.command_cache import CommandCache
+from codebuddy.file_locks import FileLocks
+from codebuddy.compaction import OutputCompactor
+from codebuddy.jobs import JobManager
+from codebuddy.markdown import Chunk, scan_markdown
+from codebuddy.python_worker import PythonWorker
+from codebuddy.snapshot import SessionSnapshot
+from codebuddy.tools import EDIT_TOOLS, TOOL_ARGUMENTS, TOOL_INSTRUCTION, TOOL_KEYWORDS, TOOLS
+from codebuddy.workspace import Workspace, WorkspaceManager, break_link
 from codebuddy.utils import (
     PromptTemplate,
+    CompiledPromptTemplate,
     run_bash,
     Message,
-    split_markdown,
-    process_chunks,
     TRIPLE_BACKTICKS,
 )
 
@@ -24,22 +42,59 @@ from codebuddy.utils import (
 logger = logging.getLogger(__name__)
 
 
+# File editing keywords and the number of code blocks that follow each
+EDIT_FUNCTIONS = {"OVERWRITE": 1, "APPEND": 1, "DELETE": 1, "REPLACE": 2}
+
+
 @dataclass
 class TmuxModule(ChatModule):
     """A module that leverages a tmux session to execute code locally."""
     prompt_template: Union[str, PromptTemplate] = ""  #: The prompt template
+    dynamic_prompt_keys: List[str] = field(
+        default_factory=lambda: ["project"]
+    )  #: Prompt template keys that change between steps
     max_calls: int = 5  #: Maximum number of LLM API calls
     python_env: str = os.path.dirname(os.path.dirname(__file__)) + "/codebuddy-venv"  #: Path to the Python environment
     project_path: str = "~/demo"  #: Path to the project directory
+    isolate: bool = False  #: If True, works in an isolated workspace created from the project
+    workspace_manager: WorkspaceManager = None  #: Creates the isolated workspace
+    workspace: Workspace = None  #: The isolated workspace, removed when the module is closed
     sleep_duration: int = 1  #: Maximum number of LLM API calls.
     prefix_break_token: str = "TMUX_BREAK"  #: Maximum number of LLM API calls.
     prompt: str = "$"  #: The command prompt string.
     session_height: int = 8192  #: Number of lines for the tmux history
     session_width: int = 128  #: Width of the tmux history
+    command_timeout: float = 600.  #: Seconds before a terminal or ipython block is interrupted
     terminal_session_id: str = "terminal-session"  #: tmux terminal session name
     python_session_id: str = "python-session"  #: tmux python session name
+    compact_output: bool = True  #: If True, compacts terminal and ipython output
+    compactor: OutputCompactor = None  #: Compacts outputs and stores the full originals
+    cache_commands: bool = True  #: If True, answers read-only terminal blocks from a cache
+    command_cache: CommandCache = None  #: Cache of read-only terminal command outputs
+    code_index: CodeIndex = None  #: Search index of the project, built on first use
+    retrieval_k: int = 0  #: Number of relevant snippets added to each user message (0 disables)
+    job_manager: JobManager = None  #: Runs background jobs
+    job_wait_timeout: float = 60.  #: Default number of seconds JOB_WAIT blocks for
+    history_results: int = 20  #: Maximum number of HISTORY_SEARCH matches per session
+    terminal_pool_size: int = 1  #: Number of terminal sessions used to run blocks in parallel
     terminal_session: TmuxSession = None
-    python_session: TmuxSession = None
+    terminal_pool: List[TmuxSession] = field(default_factory=list)  #: Terminal session pool
+    python_executor: str = "tmux"  #: Runs ipython blocks in a tmux "python" session or a "pipe" worker
+    python_session: Union[TmuxSession, PythonWorker] = None
+    reuse_sessions: bool = False  #: Reuse existing tmux sessions started with the same settings
+    transcript_dir: str = "~/.codebuddy/transcripts"  #: Terminal transcripts are logged here ("" disables)
+    python_history: List[str] = field(default_factory=list)  #: ipython blocks run in this session
+    snapshot_path: str = ""  #: If set, the session is snapshotted to this JSONL file after each step
+    snapshot: SessionSnapshot = None  #: Writes and restores session snapshots
+    file_locks: FileLocks = None  #: File ownership shared with other modules editing the project
+    checkpoint_edits: bool = True  #: If True, checkpoints the project before each step that may edit it
+    checkpoints: CheckpointStore = None  #: Checkpoints of the project
+    tool_mode: bool = False  #: If True, runs tools called through the backend's tool calling API
+    early_stop: bool = False  #: If True, each response is cut after its first terminal or ipython block
+    step_info: dict = field(default_factory=dict)  #: Signals describing the current step
+    instruction_parts: List[str] = field(
+        default_factory=list
+    )  #: The system prompt split into a cacheable prefix and a dynamic suffix
 
     def __post_init__(self):
         assert self.project_path
@@ -51,10 +106,41 @@ class TmuxModule(ChatModule):
                 setattr(self, field_name, value)
 
         if isinstance(self.prompt_template, str):
-            self.prompt_template = PromptTemplate(self.prompt_template)
+            self.prompt_template = CompiledPromptTemplate(
+                self.prompt_template, dynamic_keys=self.dynamic_prompt_keys
+            )
 
+        self._initialize_store()
         self.project_path = os.path.expanduser(self.project_path).rstrip("/")
+        if self.isolate and self.workspace is None:
+            if self.workspace_manager is None:
+                self.workspace_manager = WorkspaceManager()
+            self.workspace = self.workspace_manager.create(
+                self.project_path, f"{self.terminal_session_id}-{os.getpid()}"
+            )
+        if self.workspace is not None:
+            self.project_path = self.workspace.path
         self.python_env = os.path.expanduser(self.python_env)
+        self._cancel_event = threading.Event()
+        # The current user message and the code retrieved for it
+        self._retrieved = None
+        if self.compactor is None:
+            self.compactor = OutputCompactor()
+        if self.command_cache is None:
+            self.command_cache = CommandCache(variables={"PROJECT_PATH": self.project_path})
+        if self.snapshot is None and self.snapshot_path:
+            self.snapshot = SessionSnapshot(path=self.snapshot_path)
+        if self.checkpoints is None and self.checkpoint_edits:
+            # Checkpoints of a workspace are removed with it
+            root = ""
+            if self.workspace is not None:
+                root = os.path.join(self.workspace.internal_path, "checkpoints")
+            self.checkpoints = CheckpointStore(project_path=self.project_path, root=root)
+        if self.code_index is None:
+            self.code_index = CodeIndex(project_path=self.project_path)
+        if self.job_manager is None:
+            self.job_manager = JobManager(project_path=self.project_path, python_env=self.python_env)
+            atexit.register(self.job_manager.close)
 
         self._initialize_tmux_sessions()
 
@@ -68,16 +154,57 @@ class TmuxModule(ChatModule):
             "prompt": self.prompt,
             "python_env": self.python_env,
             "project_path": self.project_path,
+            "timeout": self.command_timeout,
         }
-        self.terminal_session = TmuxSession(
-            session_id=self.terminal_session_id, **session_args
-        )
-        self.python_session = TmuxSession(
-            session_id=self.python_session_id, **session_args
-        )
-        self.python_session.prompt = ">>>"
-        for cmd in ("python", f"print('{self.prefix_break_token}')"):
-            self.python_session(cmd)
+        session_ids = [self.terminal_session_id] + [
+            f"{self.terminal_session_id}-{idx}" for idx in range(1, self.terminal_pool_size)
+        ]
+        # Sessions start concurrently since most of their startup time is spent waiting on shells
+        with ThreadPoolExecutor(max_workers=len(session_ids) + 1) as executor:
+            terminals = [
+                executor.submit(
+                    TmuxSession,
+                    session_id=x,
+                    reuse=self.reuse_sessions,
+                    transcript_dir=self.transcript_dir,
+                    **session_args,
+                )
+                for x in session_ids
+            ]
+            if self.python_executor == "pipe":
+                python = executor.submit(
+                    PythonWorker,
+                    python_env=self.python_env,
+                    project_path=self.project_path,
+                    timeout=self.command_timeout,
+                )
+            else:
+                python = executor.submit(
+                    TmuxSession,
+                    session_id=self.python_session_id,
+                    interpreter="python",
+                    reuse=self.reuse_sessions,
+                    **session_args,
+                )
+            self.terminal_pool = [x.result() for x in terminals]
+            self.python_session = python.result()
+        self.terminal_session = self.terminal_pool[0]
+
+    def cancel(self):
+        """Interrupts the running command and stops the current response after it."""
+        self._cancel_event.set()
+        for session in self.terminal_pool:
+            session.cancel()
+        self.python_session.cancel()
+
+    def close(self):
+        """Stops the tmux sessions, the python session and any background jobs."""
+        for session in self.terminal_pool:
+            session.close()
+        self.python_session.close()
+        self.job_manager.close()
+        if self.workspace is not None:
+            self.workspace.close()
 
     @property
     def project_tree(self):
@@ -91,12 +218,298 @@ class TmuxModule(ChatModule):
 
     def _update_prompt(self):
         """Update the prompt with current project tree."""
-        self.instruction = self.prompt_template.format(project=self.project_tree)
+        if isinstance(self.prompt_template, CompiledPromptTemplate):
+            self.instruction_parts = list(self.prompt_template.split(project=self.project_tree))
+        else:
+            self.instruction_parts = [self.prompt_template.format(project=self.project_tree)]
+        self.instruction = "".join(self.instruction_parts)
+
+    def _system_messages(self) -> List[Message]:
+        """Returns the system prompt as a stable prefix message and a dynamic suffix message."""
+        messages = [Message("system", x) for x in self.instruction_parts if x]
+        if self.tool_mode:
+            messages.append(Message("system", TOOL_INSTRUCTION))
+        return messages
 
     @property
     def functions(self):
-        """File editing functions."""
-        return ["OVERWRITE", "DELETE", "APPEND", "REPLACE"]
+        """Keyword functions: file editing, output recall, code search, background jobs and
+        terminal history."""
+        return [
+            "OVERWRITE", "DELETE", "APPEND", "REPLACE", "RECALL", "SEARCH",
+            "JOBS", "JOB_OUTPUT", "JOB_WAIT", "JOB_KILL", "HISTORY", "HISTORY_SEARCH",
+        ]
+
+    def _run_terminal(self, command: str, session: TmuxSession = None) -> str:
+        """Runs a terminal block and returns its output, using the cache for read-only blocks."""
+        session = session or self.terminal_session
+        signature = None
+        if self.cache_commands and self.command_cache.is_read_only(command):
+            cwd = session.cwd
+            signature = self.command_cache.signature(command, cwd)
+        if signature is None:
+            self.command_cache.invalidate()
+        else:
+            output = self.command_cache.get(command, cwd, signature)
+            if output is not None:
+                return output
+
+        old_terminal = session.content
+        terminal = session(command)
+        output = terminal[len(old_terminal) :].strip("\n")
+        if signature is not None:
+            self.command_cache.put(command, cwd, output, signature)
+        return output
+
+    def _parallel_group(self, chunks: List[Chunk], start: int) -> int:
+        """Returns the number of consecutive blocks from `start` that may run concurrently.
+
+        Blocks marked "parallel" are always included. Plain terminal blocks are only included
+        if they are read-only.
+        """
+        end = start
+        while end < len(chunks):
+            chunk_type, content = chunks[end].type, chunks[end].content
+            if chunk_type != "parallel" and not (
+                chunk_type == "terminal" and self.command_cache.is_read_only(content)
+            ):
+                break
+            end += 1
+        return end - start
+
+    def _run_parallel(self, commands: List[str]) -> List[str]:
+        """Runs terminal blocks concurrently over the session pool and returns their outputs."""
+        cwd = self.terminal_session.cwd
+        sessions = queue.Queue()
+        for session in self.terminal_pool:
+            sessions.put(session)
+
+        def run(command):
+            session = sessions.get()
+            try:
+                if cwd and session.cwd != cwd:
+                    session(f"cd {shlex.quote(cwd)}")
+                return self._run_terminal(command, session)
+            finally:
+                sessions.put(session)
+
+        with ThreadPoolExecutor(max_workers=len(self.terminal_pool)) as executor:
+            return list(executor.map(run, commands))
+
+    def _run_python(self, code: str) -> str:
+        """Runs an ipython block and returns its output."""
+        self.python_history.append(code)
+        if isinstance(self.python_session, PythonWorker):
+            return self.python_session(code)
+        old_python = self.python_session.content
+        python = self.python_session(code + "\n")
+        return python[len(old_python) :].strip("\n")
+
+    def resume(self, replay_python: bool = False):
+        """Restores the conversation, token counts, outputs and terminal state from the snapshot.
+
+        If `replay_python` is True, the recorded ipython blocks are run again to rebuild the
+        interpreter state. This repeats their side effects, so it is off by default.
+        """
+        if self.snapshot is None or not os.path.exists(self.snapshot.path):
+            raise FileNotFoundError(f"Snapshot {self.snapshot_path} does not exist.")
+        self.snapshot.restore(self, replay_python=replay_python)
+
+    def _retrieve_code(self, message: str) -> str:
+        """Returns the project snippets most relevant to a user message, to be appended to it."""
+        results = self.code_index.search(message, k=self.retrieval_k)
+        if not results:
+            return ""
+        return "\n\n# Possibly relevant code\n\n" + self.code_index.format_results(results)
+
+    def _request_messages(self) -> List[Message]:
+        """Returns the system prompt and the dialog to send to the LLM.
+
+        Code retrieved for the current user message is appended to it only in the request, so it
+        is not stored in the dialog or sent again with later messages.
+        """
+        messages = self.messages
+        if self._retrieved is not None:
+            message, code = self._retrieved
+            for idx in range(len(messages) - 1, -1, -1):
+                if messages[idx].role == "user" and messages[idx].content == message:
+                    request_message = Message("user", message + code)
+                    messages = messages[:idx] + [request_message] + messages[idx + 1:]
+                    break
+        return self._system_messages() + messages
+
+    def _search_function(self, content: str) -> str:
+        """Runs SEARCH functions and returns their results."""
+        outputs = []
+        for line in content.splitlines():
+            query = line[len("SEARCH"):].strip().strip("`")
+            if not line.startswith("SEARCH") or not query:
+                continue
+            results = self.code_index.search(query, k=max(self.retrieval_k, 5))
+            outputs.append(f"Results for `{query}`:\n\n" + self.code_index.format_results(results))
+        return "\n\n".join(outputs)
+
+    def _history_function(self, content: str) -> str:
+        """Runs HISTORY and HISTORY_SEARCH functions on the terminal transcripts.
+
+        Commands run in pool session N are numbered N:ID, and those in the main session ID. Line
+        ranges are inclusive.
+        """
+        transcripts = {
+            str(idx): x.transcript for idx, x in enumerate(self.terminal_pool) if x.transcript is not None
+        }
+        if not transcripts:
+            return "Terminal transcripts are disabled."
+        outputs = [
+            self._history_line(line, transcripts)
+            for line in content.splitlines()
+            if line.startswith("HISTORY")
+        ]
+        return "\n\n".join(outputs)
+
+    def _history_line(self, line: str, transcripts: dict) -> str:
+        """Runs one HISTORY or HISTORY_SEARCH function."""
+        args = line.strip().replace("`", "").split(maxsplit=1)
+        if args[0] == "HISTORY_SEARCH":
+            if len(args) < 2:
+                return "HISTORY_SEARCH requires a pattern."
+            pattern = args[1].strip()
+            lines = []
+            for name, transcript in transcripts.items():
+                prefix = "" if name == "0" else f"{name}:"
+                lines += [
+                    f"[{prefix}{x.entry_id}, line {x.line_number}] {x.line}"
+                    for x in transcript.search(pattern, max_results=self.history_results)
+                ]
+            if not lines:
+                return f"No past output matches `{pattern}`."
+            return f"Matches for `{pattern}`:\n{TRIPLE_BACKTICKS}\n" + "\n".join(lines) + f"\n{TRIPLE_BACKTICKS}"
+        if len(args) < 2:
+            summaries = [
+                ("" if name == "0" else f"Session {name}:\n") + x.summary()
+                for name, x in transcripts.items()
+            ]
+            return f"{TRIPLE_BACKTICKS}\n" + "\n\n".join(summaries) + f"\n{TRIPLE_BACKTICKS}"
+        try:
+            entry_ref, *line_range = args[1].split()
+            name, _, entry_id = entry_ref.rpartition(":")
+            start, _, end = (line_range[0] if line_range else "0-").partition("-")
+            output = transcripts[name or "0"].output(
+                int(entry_id), int(start or 0), int(end) + 1 if end else None
+            )
+        except (ValueError, KeyError) as ex:
+            return f"Invalid history function `{line}`: {ex}"
+        return f"{TRIPLE_BACKTICKS}\n" + self._compact(output) + f"\n{TRIPLE_BACKTICKS}"
+
+    def _job_function(self, content: str) -> str:
+        """Runs a JOBS, JOB_OUTPUT, JOB_WAIT or JOB_KILL function and returns its result."""
+        args = content.replace("`", "").split()
+        if args[0] == "JOBS":
+            return self.job_manager.summary()
+        try:
+            job_id = int(args[1])
+            if args[0] == "JOB_WAIT":
+                timeout = float(args[2]) if len(args) > 2 else self.job_wait_timeout
+                status = self.job_manager.wait(job_id, timeout)
+            elif args[0] == "JOB_KILL":
+                status = self.job_manager.kill(job_id)
+            else:
+                status = self.job_manager.status(job_id)
+            output = self._compact(self.job_manager.output(job_id).strip("\n"))
+        except (IndexError, ValueError, KeyError) as ex:
+            return f"Invalid job function `{content}`: {ex}"
+        return f"Job {job_id} {status}. New output:\n{TRIPLE_BACKTICKS}\n{output}\n{TRIPLE_BACKTICKS}"
+
+    def _recall_function(self, content: str) -> str:
+        """Runs a RECALL function and returns the full output."""
+        output_id = content[len("RECALL"):].strip().strip("`")
+        if output_id.isdigit() and int(output_id) < len(self.compactor.outputs):
+            output = self.compactor.recall(int(output_id))
+            return f"{TRIPLE_BACKTICKS}\n" + output + f"\n{TRIPLE_BACKTICKS}"
+        return f"Output {output_id} not found."
+
+    def _keyword_function(self, line: str) -> str:
+        """Runs a keyword function other than a file edit and returns its result."""
+        line = line.strip().strip("`").strip()
+        if line.startswith("JOB"):
+            return self._job_function(line)
+        if line.startswith("RECALL"):
+            return self._recall_function(line)
+        if line.startswith("HISTORY"):
+            return self._history_function(line)
+        if line.startswith("SEARCH"):
+            return self._search_function(line)
+        return f"Unknown function `{line}`. Use the file editing tools to edit files."
+
+    def _compact(self, output: str) -> str:
+        """Compacts a terminal or ipython output if compaction is enabled."""
+        return self.compactor(output) if self.compact_output else output
+
+    def _edit_file(self, keyword: str, file_path: str, blocks: List[str]) -> Tuple[str, bool]:
+        """Applies an OVERWRITE, APPEND, DELETE or REPLACE edit to a file.
+
+        Returns a message describing the result and whether the edit was applied.
+        """
+        if not os.path.exists(file_path):
+            return f"File {file_path} does not exist.", False
+        if len(blocks) < EDIT_FUNCTIONS[keyword]:
+            return f"{keyword} {file_path} is missing a code block.", False
+        if self.file_locks is not None:
+            owner = self.file_locks.acquire(file_path, self.terminal_session_id)
+            if owner is not None:
+                return f"File {file_path} is being edited by {owner}. Do not edit it.", False
+        if self.workspace is not None and self.workspace.linked:
+            break_link(file_path)
+
+        if keyword == "OVERWRITE":
+            with open(file_path, "w") as file:
+                file.write(blocks[0])
+            return f"Contents of {file_path} successfully overwritten.", True
+        if keyword == "APPEND":
+            with open(file_path, "a") as file:
+                file.write("\n" + blocks[0])
+            return f"Contents successfully append to {file_path}.", True
+
+        with open(file_path, "r") as file:
+            file_contents = file.read()
+        if keyword == "DELETE":
+            if blocks[0] not in file_contents:
+                return f"Content to delete not found in {file_path}.", False
+            file_contents = file_contents.replace(blocks[0], "")
+            result = f"Contents successfully deleted from {file_path}."
+        else:
+            if blocks[0] not in file_contents:
+                return f"Content to replace not found in {file_path}.", False
+            file_contents = file_contents.replace(blocks[0], blocks[1])
+            result = f"Contents successfully replaced in {file_path}."
+        with open(file_path, "w") as file:
+            file.write(file_contents)
+        return result, True
+
+    def _may_edit(self, chunks: List[Chunk]) -> bool:
+        """Returns True if running the chunks of a response may change project files."""
+        for chunk in chunks:
+            if chunk.type in ("ipython", "background") or chunk.keyword in EDIT_FUNCTIONS:
+                return True
+            if chunk.type in ("terminal", "parallel") and not self.command_cache.is_read_only(
+                chunk.content
+            ):
+                return True
+        return False
+
+    def _checkpoint(self, message: str, depth: int):
+        """Checkpoints the project before a step that may edit it. If a file cannot be stored, the
+        step runs without a checkpoint."""
+        label = (message.strip().splitlines() or [""])[0][:80] if depth == 0 else f"Step {depth}"
+        try:
+            self.step_info["checkpoint"] = self.checkpoints.create(label)
+        except OSError as ex:
+            logger.warning(f"Could not checkpoint the project: {ex}")
+
+    def rollback(self, checkpoint_id: int) -> List[str]:
+        """Restores the project to a checkpoint and returns the paths that changed."""
+        self.command_cache.invalidate()
+        return self.checkpoints.restore(checkpoint_id)
 
     def _get_file_path(self, text):
         """Returns a cleaned file path from a function call."""
@@ -110,6 +523,190 @@ class TmuxModule(ChatModule):
         )
         return file_path
 
+    def _action_end(self, text: str) -> int:
+        """Returns the end of the first complete terminal or ipython block in a partial response,
+        or None if there is none.
+
+        Only complete lines are scanned, so a fence that is still being written is not mistaken
+        for a closing fence. Code blocks that belong to a file edit are skipped.
+        """
+        text = text[: text.rfind("\n") + 1]
+        chunks = scan_markdown(text, self.functions)
+        chunk_idx = 0
+        while chunk_idx < len(chunks):
+            chunk = chunks[chunk_idx]
+            if chunk.keyword in EDIT_FUNCTIONS:
+                chunk_idx += EDIT_FUNCTIONS[chunk.keyword]
+            elif chunk.type in ("terminal", "ipython"):
+                # The end of the closing fence line
+                return text.find("\n", chunk.end)
+            chunk_idx += 1
+        return None
+
+    def _generate_until_action(self, messages: List[Message]) -> str:
+        """Streams a response and cancels it once it contains a complete terminal or ipython
+        block, since the model needs the block's output before it can usefully continue."""
+        self.step_info["early_stop"] = False
+        response_content = ""
+        check = False
+        stream = self.stream_api(messages)
+        try:
+            for piece in stream:
+                response_content += piece
+                # A block can only be complete once a line with backticks has ended
+                check = check or "`" in piece
+                if not (check and "\n" in piece):
+                    continue
+                check = "`" in piece[piece.rfind("\n"):]
+                end = self._action_end(response_content)
+                if end is not None:
+                    logger.info("Stopping the response after its first terminal or ipython block")
+                    self.step_info["early_stop"] = True
+                    return response_content[:end]
+        finally:
+            stream.close()
+        return response_content
+
+    @staticmethod
+    def _argument(call: dict, name: str) -> str:
+        """Returns a string argument of a tool call, or None if it is missing."""
+        arguments = call["arguments"]
+        value = arguments.get(name) if isinstance(arguments, dict) else None
+        return value if isinstance(value, str) else None
+
+    def _tool_path(self, path: str) -> str:
+        """Returns the absolute path of a file named in a tool call."""
+        path = path.strip().replace("$PROJECT_PATH", self.project_path)
+        return os.path.normpath(os.path.join(self.project_path, path))
+
+    def _tool_keyword(self, call: dict) -> str:
+        """Returns the tool or keyword that a tool call stands for in `step_info`."""
+        line = self._argument(call, "line")
+        if call["name"] == "run_function" and line and line.split():
+            return line.split()[0].strip("`")
+        return TOOL_KEYWORDS.get(call["name"], call["name"])
+
+    def _is_read_only_call(self, call: dict) -> bool:
+        """Returns True if a tool call is a read-only terminal command."""
+        command = self._argument(call, "command")
+        return call["name"] == "terminal" and bool(command) and self.command_cache.is_read_only(
+            command
+        )
+
+    def _tool_calls_may_edit(self, calls: List[dict]) -> bool:
+        """Returns True if running the tool calls of a response may change project files."""
+        return any(
+            x["name"] in EDIT_TOOLS or x["name"] == "ipython"
+            or (x["name"] == "terminal" and not self._is_read_only_call(x))
+            for x in calls
+        )
+
+    def _run_tool(self, call: dict) -> Tuple[str, bool]:
+        """Runs a tool call and returns its result and whether it succeeded."""
+        name = call["name"]
+        if name not in TOOL_ARGUMENTS:
+            return f"Unknown tool `{name}`.", False
+        arguments = [self._argument(call, x) for x in TOOL_ARGUMENTS[name]]
+        if None in arguments:
+            expected = ", ".join(TOOL_ARGUMENTS[name])
+            return f"Invalid arguments for {name}. Expected string arguments: {expected}.", False
+
+        if name == "terminal":
+            output = self._compact(self._run_terminal(arguments[0]))
+        elif name == "ipython":
+            self.command_cache.invalidate()
+            output = self._compact(self._run_python(arguments[0]))
+        elif name == "run_function":
+            output = self._keyword_function(arguments[0])
+        else:
+            self.command_cache.invalidate()
+            return self._edit_file(TOOL_KEYWORDS[name], self._tool_path(arguments[0]), arguments[1:])
+        return output or "(no output)", True
+
+    def _tool_group(self, calls: List[dict], start: int) -> int:
+        """Returns the number of consecutive tool calls from `start` that may run concurrently.
+
+        Read-only terminal commands are grouped if there is more than one terminal session, and
+        edits are grouped as long as they change different files.
+        """
+        end = start + 1
+        if self._is_read_only_call(calls[start]) and len(self.terminal_pool) > 1:
+            while end < len(calls) and self._is_read_only_call(calls[end]):
+                end += 1
+        elif calls[start]["name"] in EDIT_TOOLS and self._argument(calls[start], "path"):
+            paths = {self._tool_path(self._argument(calls[start], "path"))}
+            while end < len(calls) and calls[end]["name"] in EDIT_TOOLS:
+                path = self._argument(calls[end], "path")
+                if path is None or self._tool_path(path) in paths:
+                    break
+                paths.add(self._tool_path(path))
+                end += 1
+        return end - start
+
+    def _run_tool_calls(self, calls: List[dict]):
+        """Runs tool calls, concurrently where they are independent.
+
+        Yields a list of (call, (result, success)) pairs for each group of calls, in order.
+        """
+        start = 0
+        while start < len(calls) and not self._cancel_event.is_set():
+            n_group = self._tool_group(calls, start)
+            group = calls[start : start + n_group]
+            if n_group > 1 and group[0]["name"] == "terminal":
+                logger.info(f"Running {n_group} terminal commands in parallel")
+                outputs = self._run_parallel([self._argument(x, "command") for x in group])
+                results = [(self._compact(x) or "(no output)", True) for x in outputs]
+            elif n_group > 1:
+                logger.info(f"Editing {n_group} files in parallel")
+                with ThreadPoolExecutor(max_workers=n_group) as executor:
+                    results = list(executor.map(self._run_tool, group))
+            else:
+                results = [self._run_tool(group[0])]
+            yield list(zip(group, results))
+            start += n_group
+
+    def _forward_tools(self, message: str, depth: int):
+        """Generates a response in tool mode.
+
+        The tool calls of the response are run and their results are added as tool messages,
+        which the next LLM call responds to.
+        """
+        if message:
+            self.messages.append(Message("user", message))
+        response = self.call_api_with_tools(self._request_messages(), TOOLS)
+        self.messages.append(response)
+        calls = response.tool_calls or []
+        if self.checkpoints is not None and self._tool_calls_may_edit(calls):
+            self._checkpoint(message, depth)
+
+        n_done = 0
+        edit_failed = False
+        for group in self._run_tool_calls(calls):
+            for call, (result, success) in group:
+                logger.info(f"{call['name']} tool call")
+                self.messages.append(Message("tool", result, tool_call_id=call["id"]))
+                edit_failed = edit_failed or (call["name"] in EDIT_TOOLS and not success)
+            n_done += len(group)
+            yield [asdict(msg) for msg in self.messages]
+            if edit_failed:
+                break
+        # Every tool call is answered, even if it was not run
+        for call in calls[n_done:]:
+            result = (
+                "Cancelled by the user." if self._cancel_event.is_set()
+                else "Not run because a previous edit failed."
+            )
+            self.messages.append(Message("tool", result, tool_call_id=call["id"]))
+
+        self.step_info.update(
+            previous_tools=[self._tool_keyword(x) for x in calls], edit_failed=edit_failed
+        )
+        yield [asdict(msg) for msg in self.messages]
+        if self._cancel_event.is_set():
+            logger.info("Cancelled by the user. Exiting.")
+        elif calls:
+            yield from self.forward("", depth + 1)
+
     def forward(self, message: str = "", depth: int = 0) -> str:
         """Generate a response to a user message."""
         self._update_prompt()
@@ -119,134 +716,192 @@ class TmuxModule(ChatModule):
             return
 
         logger.debug("Calling LLM")
+        if depth == 0:
+            self.step_info = {}
+            self._cancel_event.clear()
+            self._retrieved = None
+            if self.retrieval_k and message:
+                self._retrieved = (message, self._retrieve_code(message))
+        self.step_info["depth"] = depth
+        if self.tool_mode:
+            yield from self._forward_tools(message, depth)
+            return
         self.messages.append(Message("user", message))
-        response_content = self.call_api([Message("system", self.instruction)] + self.messages)
+        if self.early_stop:
+            response_content = self._generate_until_action(self._request_messages())
+        else:
+            response_content = self.call_api(self._request_messages())
         self.messages.append(Message("assistant", response_content))
 
         messages = [asdict(msg) for msg in self.messages]
         parser_content = ""
         chunk_idx = 0
-        chunks = process_chunks(split_markdown(response_content), self.functions)
+        tools = []
+        edit_failed = False
+        chunks = scan_markdown(response_content, self.functions)
+        if self.checkpoints is not None and self._may_edit(chunks):
+            self._checkpoint(message, depth)
         while chunk_idx < len(chunks):
-            chunk_type, content = chunks[chunk_idx]["type"], chunks[chunk_idx]["content"],
+            if self._cancel_event.is_set():
+                break
+            chunk_type, content = chunks[chunk_idx].type, chunks[chunk_idx].content
+            if chunk_type in ("terminal", "ipython", "background"):
+                tools.append(chunk_type)
+            elif chunk_type == "parallel":
+                tools.append("terminal")
+            elif chunks[chunk_idx].keyword:
+                tools.append(chunks[chunk_idx].keyword)
 
-            if chunk_type == "terminal":
-                old_terminal = self.terminal_session.content
-                terminal = self.terminal_session(content)
-                parser_content += f"\n{TRIPLE_BACKTICKS}\n" + terminal[len(old_terminal) :].strip("\n") + f"\n{TRIPLE_BACKTICKS}\n"
+            if chunk_type in ("terminal", "parallel"):
+                n_parallel = (
+                    self._parallel_group(chunks, chunk_idx) if len(self.terminal_pool) > 1 else 1
+                )
+                if n_parallel > 1:
+                    logger.info(f"Running {n_parallel} terminal blocks in parallel")
+                    commands = [x.content for x in chunks[chunk_idx : chunk_idx + n_parallel]]
+                    terminals = self._run_parallel(commands)
+                    tools += ["terminal"] * (n_parallel - 1)
+                    chunk_idx += n_parallel - 1
+                else:
+                    terminals = [self._run_terminal(content)]
+                for terminal in terminals:
+                    parser_content += f"\n{TRIPLE_BACKTICKS}\n" + self._compact(terminal) + f"\n{TRIPLE_BACKTICKS}\n"
                 yield messages + [{"role": "user", "content": parser_content.strip()}]
 
             elif chunk_type == "ipython":
-                old_python = self.python_session.content
-                python = self.python_session(content + "\n")
-                parser_content += f"\n{TRIPLE_BACKTICKS}\n" + python[len(old_python) :].strip("\n") + f"\n{TRIPLE_BACKTICKS}\n"
+                self.command_cache.invalidate()
+                python = self._run_python(content)
+                parser_content += f"\n{TRIPLE_BACKTICKS}\n" + self._compact(python) + f"\n{TRIPLE_BACKTICKS}\n"
                 yield messages + [{"role": "user", "content": parser_content.strip()}]
 
-            elif chunk_type == "text" and content.startswith("OVERWRITE"):
-                logger.info("OVERWRITE workflow")
-                file_path = self._get_file_path(content)
-                if not os.path.exists(file_path):
-                    parser_content += f"\nFile {file_path} does not exist.\n"
-                    yield messages + [{"role": "user", "content": parser_content.strip()}]
-                    break
-                with open(file_path, "w") as file:
-                    file.write(chunks[chunk_idx + 1]["content"])
-                parser_content += f"\nContents of {file_path} successfully overwritten.\n"
+            elif chunk_type == "background":
+                self.command_cache.invalidate()
+                job_id = self.job_manager.start(content, cwd=self.terminal_session.cwd or None)
+                parser_content += f"\nStarted background job {job_id}.\n"
                 yield messages + [{"role": "user", "content": parser_content.strip()}]
-                chunk_idx += 1
-
-            elif chunk_type == "text" and content.startswith("APPEND"):
-                logger.info("APPEND workflow")
-                file_path = self._get_file_path(content)
-                if not os.path.exists(file_path):
-                    parser_content += f"\nFile {file_path} does not exist.\n"
-                    yield messages + [{"role": "user", "content": parser_content.strip()}]
-                    break
-                with open(file_path, "a") as file:
-                    file.write("\n" + chunks[chunk_idx + 1]["content"])
-                parser_content += f"\nContents successfully append to {file_path}.\n"
+
+            elif chunk_type == "text" and content.startswith("JOB"):
+                logger.info("JOB workflow")
+                parser_content += "\n" + self._job_function(content) + "\n"
                 yield messages + [{"role": "user", "content": parser_content.strip()}]
-                chunk_idx += 1
-
-            elif chunk_type == "text" and content.startswith("DELETE"):
-                logger.info("DELETE workflow")
-                file_path = self._get_file_path(content)
-                if not os.path.exists(file_path):
-                    parser_content += f"\nFile {file_path} does not exist.\n"
-                    yield messages + [{"role": "user", "content": parser_content.strip()}]
-                    break
-                with open(file_path, "r") as file:
-                    file_contents = file.read()
-                delete_content = chunks[chunk_idx + 1]["content"]
-                if delete_content not in file_contents:
-                    parser_content += f"\nContent to delete not found in {file_path}.\n"
-                    yield messages + [{"role": "user", "content": parser_content.strip()}]
-                    break
-                file_contents = file_contents.replace(delete_content, "")
-                with open(file_path, "w") as file:
-                    file.write(file_contents)
-                parser_content += f"\nContents successfully deleted from {file_path}.\n"
+
+            elif chunk_type == "text" and content.startswith("RECALL"):
+                logger.info("RECALL workflow")
+                parser_content += "\n" + self._recall_function(content) + "\n"
                 yield messages + [{"role": "user", "content": parser_content.strip()}]
-                chunk_idx += 1
-
-            elif chunk_type == "text" and content.startswith("REPLACE"):
-                logger.info("REPLACE workflow")
-                file_path = self._get_file_path(content)
-                if not os.path.exists(file_path):
-                    parser_content += f"\nFile {file_path} does not exist.\n"
-                    yield messages + [{"role": "user", "content": parser_content.strip()}]
-                    break
-                with open(file_path, "r") as file:
-                    file_contents = file.read()
-                old_content = chunks[chunk_idx + 1]["content"]
-                new_content = chunks[chunk_idx + 2]["content"]
-                if old_content not in file_contents:
-                    parser_content += f"\nContent to replace not found in {file_path}.\n"
-                    yield messages + [{"role": "user", "content": parser_content.strip()}]
-                    break
-                file_contents = file_contents.replace(old_content, new_content)
-                with open(file_path, "w") as file:
-                    file.write(file_contents)
-                parser_content += f"\nContents successfully replaced in {file_path}.\n"
+
+            elif chunk_type == "text" and content.startswith("HISTORY"):
+                logger.info("HISTORY workflow")
+                parser_content += "\n" + self._history_function(content) + "\n"
                 yield messages + [{"role": "user", "content": parser_content.strip()}]
-                chunk_idx += 2
+
+            elif chunk_type == "text" and content.startswith("SEARCH"):
+                logger.info("SEARCH workflow")
+                parser_content += "\n" + self._search_function(content) + "\n"
+                yield messages + [{"role": "user", "content": parser_content.strip()}]
+
+            elif chunks[chunk_idx].keyword in EDIT_FUNCTIONS:
+                keyword = chunks[chunk_idx].keyword
+                logger.info(f"{keyword} workflow")
+                self.command_cache.invalidate()
+                n_blocks = EDIT_FUNCTIONS[keyword]
+                blocks = [x.content for x in chunks[chunk_idx + 1 : chunk_idx + 1 + n_blocks]]
+                result, success = self._edit_file(keyword, self._get_file_path(content), blocks)
+                parser_content += f"\n{result}\n"
+                yield messages + [{"role": "user", "content": parser_content.strip()}]
+                if not success:
+                    edit_failed = True
+                    break
+                chunk_idx += n_blocks
 
             chunk_idx += 1
 
         parser_content = parser_content.strip()
-        if parser_content:
+        self.step_info.update(previous_tools=tools, edit_failed=edit_failed)
+        if self._cancel_event.is_set():
+            logger.info("Cancelled by the user. Exiting.")
+            parser_content = (parser_content + "\n\nCancelled by the user.").strip()
+            yield messages + [{"role": "user", "content": parser_content}]
+        elif parser_content:
             yield messages + [{"role": "user", "content": parser_content}]
             for chunk in self.forward(parser_content, depth + 1):
                 yield chunk
         else:
             yield messages
 
+    def __call__(self, msg: str, messages: List[Message] = None, clear: bool = False) -> str:
+        for chunk in super().__call__(msg, messages=messages, clear=clear):
+            if self.snapshot is not None:
+                self.snapshot.write(self)
+            yield chunk
+        if self.snapshot is not None:
+            self.snapshot.write(self, capture_sessions=True)
+
+    @staticmethod
+    def _chat_history(messages: List[dict]) -> List[tuple]:
+        """Pairs user and assistant messages for the gradio chatbot.
+
+        Tool calls are shown in the assistant message, and consecutive tool results are shown
+        together as a user message.
+        """
+        history = []
+        for msg in messages:
+            content = msg["content"]
+            if msg.get("tool_calls"):
+                calls = [
+                    f"`{x['name']}`\n{TRIPLE_BACKTICKS}json\n"
+                    + json.dumps(x["arguments"], indent=2) + f"\n{TRIPLE_BACKTICKS}"
+                    for x in msg["tool_calls"]
+                ]
+                content = "\n\n".join(([content] if content else []) + calls)
+            if msg["role"] == "assistant" and history and history[-1][1] is None:
+                history[-1] = (history[-1][0], content)
+            elif msg["role"] == "assistant":
+                history.append(("", content))
+            elif msg["role"] == "tool" and history and history[-1][1] is None:
+                history[-1] = (history[-1][0] + "\n\n" + content, None)
+            else:
+                history.append((content, None))
+        return history
+
+    def _turn_messages(self, history: List[list]) -> Tuple[List[Message], bool]:
+        """Returns the messages to continue a chat interface conversation from, and whether the
+        module's messages should be cleared first.
+
+        In tool mode, tool calls and their results cannot be rebuilt from the chat pairs, so the
+        module keeps its own messages unless the chat was cleared.
+        """
+        if self.tool_mode:
+            return None, not history
+        messages = []
+        for human, assistant in history:
+            messages.append(Message("user", human))
+            messages.append(Message("assistant", assistant))
+        return messages, False
+
     def get_gradio_interface(self, **kwargs):
         """Returns a gradio chat interface."""
         import gradio as gr
 
         def predict(history):
-            messages = []
             history[-1][1] = ""
-            for human, assistant in history[:-1]:
-                messages.append(Message("user", human))
-                messages.append(Message("assistant", assistant))
-            for chunk in self(history[-1][0], messages=messages):
-                new_hist = []
-                for idx in range(0, len(chunk), 2):
-                    if idx + 1 < len(chunk):
-                        new_hist.append((chunk[idx]["content"], chunk[idx + 1]["content"]))
-                    else:
-                        new_hist.append((chunk[idx]["content"], None))
-                yield new_hist
+            messages, clear = self._turn_messages(history[:-1])
+            for chunk in self(history[-1][0], messages=messages, clear=clear):
+                yield self._chat_history(chunk)
 
         def user(user_message, history):
             return "", history + [[user_message, None]]
 
         with gr.Blocks(analytics_enabled=False, **kwargs) as gui:
-            chat = gr.Chatbot(label=self.name, height=500)
+            # A resumed session starts with its restored conversation
+            chat = gr.Chatbot(
+                value=self._chat_history([asdict(x) for x in self.messages]),
+                label=self.name,
+                height=500,
+            )
             with gr.Row():
                 clear = gr.Button("Clear", variant="secondary", size="sm", min_width=60)
+                stop = gr.Button("Stop", variant="stop", size="sm", min_width=60)
             with gr.Row():
                 msg = gr.Textbox(
                     container=False,
@@ -261,6 +916,7 @@ class TmuxModule(ChatModule):
             msg.submit(user, [msg, chat], [msg, chat], queue=False).then(predict, chat, chat)
             submit.click(user, [msg, chat], [msg, chat], queue=False).then(predict, chat, chat)
             clear.click(lambda: None, None, chat, queue=False)
+            stop.click(self.cancel, None, None, queue=False)
 
         return gui
 
@@ -274,9 +930,21 @@ class BedrockTmuxModule(TmuxModule, BedrockBackend):
     """A tmux module using BedrockBackend."""
 
 
+@dataclass
+class RoutingTmuxModule(TmuxModule, RoutingBackend):
+    """A tmux module using RoutingBackend to choose between a cheap and a strong model."""
+
+
+@dataclass
+class LocalTmuxModule(TmuxModule, HttpBackend):
+    """A tmux module using HttpBackend to call an OpenAI compatible server."""
+
+
 TMUX_MODULES = {
     "openai": OpenaiTmuxModule,
-    "bedrock": BedrockTmuxModule
+    "bedrock": BedrockTmuxModule,
+    "routing": RoutingTmuxModule,
+    "local": LocalTmuxModule,
 }
 
 
@@ -293,6 +961,58 @@ class TmuxAgentLauncher(Script):
         metadata={"help": "Path to the Python environment."}
     )
     project_path: str = field(default="~/demo", metadata={"help": "Path to the project directory."})
+    terminal_pool_size: int = field(
+        default=1,
+        metadata={"help": "Number of terminal sessions. Values above 1 run independent blocks in parallel."}
+    )
+    python_executor: str = field(
+        default="tmux",
+        metadata={"help": 'Run ipython blocks in a "tmux" python session or a "pipe" worker.'}
+    )
+    retrieval_k: int = field(
+        default=0,
+        metadata={"help": "Number of relevant code snippets added to each user message."}
+    )
+    reuse_sessions: bool = field(
+        default=False,
+        metadata={"help": "If True, reuses healthy tmux sessions left by a previous run."}
+    )
+    transcript_dir: str = field(
+        default="~/.codebuddy/transcripts",
+        metadata={"help": "Directory for terminal transcripts. An empty string disables them."}
+    )
+    snapshot_path: str = field(
+        default="",
+        metadata={"help": "Path to a JSONL file that the session is snapshotted to after each step."}
+    )
+    store_path: str = field(default="", metadata={"help": "Path to a SQLite conversation store."})
+    resume: bool = field(
+        default=False,
+        metadata={"help": "If True, restores the session from the snapshot before launching."}
+    )
+    replay_python: bool = field(
+        default=False,
+        metadata={"help": "If True, reruns recorded ipython blocks, and their side effects, on resume."}
+    )
+    early_stop: bool = field(
+        default=False,
+        metadata={"help": "If True, each response stops after its first terminal or ipython block."}
+    )
+    tool_mode: bool = field(
+        default=False,
+        metadata={"help": "If True, the model calls tools through the backend's tool calling API."}
+    )
+    isolate: bool = field(
+        default=False,
+        metadata={"help": "If True, works in an isolated copy of the project, removed on exit."}
+    )
+    workspace_dir: str = field(
+        default="~/.codebuddy/workspaces", metadata={"help": "Directory for isolated workspaces."}
+    )
+    workspace_strategy: str = field(
+        default="auto",
+        metadata={"help": "How workspaces are created: auto, overlay, reflink, hardlink or copy."}
+    )
     share: bool = field(default=False, metadata={"help": "If True, launches public gradio."})
 
     def __post_init__(self):
@@ -310,8 +1030,25 @@ class TmuxAgentLauncher(Script):
             config_path=prompt_path,
             max_calls=self.max_calls,
             python_env=self.python_env,
-            project_path=self.project_path
+            project_path=self.project_path,
+            python_executor=self.python_executor,
+            terminal_pool_size=self.terminal_pool_size,
+            reuse_sessions=self.reuse_sessions,
+            transcript_dir=self.transcript_dir,
+            retrieval_k=self.retrieval_k,
+            snapshot_path=self.snapshot_path,
+            store_path=self.store_path,
+            tool_mode=self.tool_mode,
+            early_stop=self.early_stop,
+            isolate=self.isolate,
+            workspace_manager=(
+                WorkspaceManager(root=self.workspace_dir, strategy=self.workspace_strategy)
+                if self.isolate else None
+            ),
         )
+        atexit.register(module.close)
+        if self.resume and os.path.exists(os.path.expanduser(self.snapshot_path)):
+            module.resume(replay_python=self.replay_python)
         gui = module.get_gradio_interface()
         gui.launch(share=False)
 
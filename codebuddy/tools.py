@@ -0,0 +1,144 @@
+"""Tool definitions for agent modules that use the native tool calling APIs of the backends.
+
+Tools are declared once in a provider neutral format (a name, a description and a JSON schema for
+the arguments). Tool calls are stored on assistant messages as dicts with the keys `id`, `name`
+and `arguments`, where `arguments` is a dict, or the raw string if the model sent invalid JSON.
+"""
+import json
+from typing import List
+
+from codebuddy.utils import Message
+
+
+def _tool(name: str, description: str, **properties: str) -> dict:
+    return {
+        "name": name,
+        "description": description,
+        "parameters": {
+            "type": "object",
+            "properties": {k: {"type": "string", "description": v} for k, v in properties.items()},
+            "required": list(properties),
+        },
+    }
+
+
+PATH_HELP = "Path of an existing file, relative to the project directory or under $PROJECT_PATH"
+
+TOOLS = [
+    _tool(
+        "terminal",
+        "Runs a bash command in the persistent terminal session and returns its output.",
+        command="The bash command",
+    ),
+    _tool(
+        "ipython",
+        "Runs code in the persistent ipython session and returns its output.",
+        code="The python code",
+    ),
+    _tool(
+        "overwrite_file",
+        "Replaces the contents of a file.",
+        path=PATH_HELP,
+        content="The new contents of the file",
+    ),
+    _tool(
+        "append_to_file",
+        "Appends content to the end of a file.",
+        path=PATH_HELP,
+        content="The content to append",
+    ),
+    _tool(
+        "delete_from_file",
+        "Deletes every occurrence of a snippet from a file.",
+        path=PATH_HELP,
+        text="The exact snippet to delete",
+    ),
+    _tool(
+        "replace_in_file",
+        "Replaces every occurrence of a snippet in a file.",
+        path=PATH_HELP,
+        old="The exact snippet to replace",
+        new="The replacement",
+    ),
+    _tool(
+        "run_function",
+        "Runs one of the keyword functions described in the instructions, such as RECALL, "
+        "SEARCH, HISTORY, HISTORY_SEARCH, JOBS, JOB_OUTPUT, JOB_WAIT or JOB_KILL.",
+        line="The function line, e.g., `RECALL 3` or `SEARCH parse arguments`",
+    ),
+]
+
+# Required arguments of each tool
+TOOL_ARGUMENTS = {x["name"]: x["parameters"]["required"] for x in TOOLS}
+
+# Name of the tool or keyword that each tool replaces, as recorded in `step_info`
+TOOL_KEYWORDS = {
+    "terminal": "terminal",
+    "ipython": "ipython",
+    "overwrite_file": "OVERWRITE",
+    "append_to_file": "APPEND",
+    "delete_from_file": "DELETE",
+    "replace_in_file": "REPLACE",
+    "run_function": "FUNCTION",
+}
+
+# Arguments of each file editing tool, in the order of the code blocks of its keyword
+EDIT_TOOLS = {
+    "overwrite_file": ("content",),
+    "append_to_file": ("content",),
+    "delete_from_file": ("text",),
+    "replace_in_file": ("old", "new"),
+}
+
+TOOL_INSTRUCTION = """
+
+# Tool calls
+
+In this session, run commands and edit files by calling the provided tools instead of writing keywords and code blocks. Code blocks in your responses are not run. Use the `run_function` tool for the other keyword functions described above. Independent tool calls in one response may run concurrently, so request calls that do not depend on each other (e.g., reading several files) together."""
+
+
+def parse_arguments(arguments: str):
+    """Returns tool call arguments as a dict, or the raw string if they are not a JSON object."""
+    try:
+        parsed = json.loads(arguments or "{}")
+    except json.JSONDecodeError:
+        return arguments
+    return parsed if isinstance(parsed, dict) else arguments
+
+
+def openai_tool(tool: dict) -> dict:
+    """Returns a tool in the format of the OpenAI chat completions API."""
+    return {"type": "function", "function": tool}
+
+
+def _dump_arguments(arguments) -> str:
+    return arguments if isinstance(arguments, str) else json.dumps(arguments)
+
+
+def openai_message(msg: Message) -> dict:
+    """Returns a message in the format of the OpenAI chat completions API."""
+    formatted = {"role": msg.role, "content": msg.content}
+    if msg.tool_calls:
+        formatted["tool_calls"] = [
+            {
+                "id": x["id"],
+                "type": "function",
+                "function": {"name": x["name"], "arguments": _dump_arguments(x["arguments"])},
+            }
+            for x in msg.tool_calls
+        ]
+    if msg.tool_call_id is not None:
+        formatted["tool_call_id"] = msg.tool_call_id
+    return formatted
+
+
+def openai_tool_calls(tool_calls: List[dict]) -> List[dict]:
+    """Returns the tool calls of an OpenAI response message in the neutral format."""
+    return [
+        {
+            "id": x["id"],
+            "name": x["function"]["name"],
+            "arguments": parse_arguments(x["function"].get("arguments")),
+        }
+        for x in tool_calls or []
+    ]
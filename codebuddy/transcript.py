@@ -0,0 +1,221 @@
+import bisect
+import json
+import mmap
+import os
+import re
+import shlex
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+from codebuddy.utils import run_bash
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Removes escape sequences, carriage returns and other control characters from the pane output
+# before it is written, so transcripts can be searched as plain text
+PIPE_FILTER = (
+    r"sed -u -e 's/\x1b\[[0-9;?]*[ -/]*[@-~]//g' -e 's/\x1b][^\x07]*\x07//g'"
+    r" -e 's/\x1b[()][0-9A-Za-z]//g' -e 's/\x1b[=>]//g' -e 's/[\x01-\x08\x0b-\x1f]//g'"
+)
+
+
+@dataclass
+class TranscriptMatch:
+    """A transcript line that matches a search."""
+
+    entry_id: int  #: Id of the command whose output contains the line
+    command: str  #: The command
+    line_number: int  #: Line number within the command's output, starting at 0
+    line: str  #: The matching line
+
+
+@dataclass
+class Transcript:
+    """A complete, rotating on-disk log of a tmux pane.
+
+    The pane output is streamed by `tmux pipe-pane` into numbered segment files. Before each
+    command, the segment and offset where its output starts are appended to an index, so the
+    output of any past command can be sliced or searched through a memory map without running
+    it again. When a segment reaches `segment_bytes`, a new one is started between commands, and
+    only the latest `max_segments` are kept.
+
+    The pipe flushes asynchronously, so the end of the previous command's output can reach the
+    segment after the next command is sent. Its offset is taken once the segment stops growing.
+    """
+
+    path: str  #: Directory for the segments and the index
+    segment_bytes: int = 4_000_000  #: Size at which a new segment is started
+    max_segments: int = 8  #: Older segments and their index entries are deleted
+    settle_interval: float = 0.02  #: Seconds the segment must not grow before an offset is taken
+    settle_timeout: float = 0.5  #: Maximum seconds to wait for the segment to stop growing
+
+    def __post_init__(self):
+        self.path = os.path.expanduser(self.path)
+        os.makedirs(self.path, exist_ok=True)
+        self.session_id = None
+        # Command index, oldest first
+        self.entries: List[dict] = []
+        if os.path.exists(self._index_path):
+            with open(self._index_path, "r") as f:
+                for line in f:
+                    try:
+                        self.entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+        segments = self.segments()
+        self.segment = segments[-1] if segments else 1
+        self.entries = [x for x in self.entries if x["segment"] in segments]
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.path, "index.jsonl")
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.path, f"{segment:06d}.log")
+
+    def segments(self) -> List[int]:
+        """Returns the numbers of the segments on disk, oldest first."""
+        names = os.listdir(self.path)
+        return sorted(int(x[:-4]) for x in names if x.endswith(".log") and x[:-4].isdigit())
+
+    def _size(self, segment: int) -> int:
+        try:
+            return os.path.getsize(self._segment_path(segment))
+        except OSError:
+            return 0
+
+    def attach(self, session_id: str):
+        """Streams the output of a tmux pane to the current segment."""
+        self.session_id = session_id
+        self._pipe()
+
+    def _pipe(self):
+        if self.session_id is None:
+            return
+        command = f"{PIPE_FILTER} >> {shlex.quote(self._segment_path(self.segment))}"
+        # A new pipe replaces the previous one
+        run_bash(f"tmux pipe-pane -t {self.session_id} {shlex.quote(command)}")
+
+    def _settle(self) -> int:
+        """Waits until the current segment stops growing and returns its size."""
+        deadline = time.monotonic() + self.settle_timeout
+        size = self._size(self.segment)
+        while time.monotonic() < deadline:
+            time.sleep(self.settle_interval)
+            previous, size = size, self._size(self.segment)
+            if size == previous:
+                break
+        return size
+
+    def begin(self, command: str) -> int:
+        """Records the start of a command and returns its entry id."""
+        if self._settle() >= self.segment_bytes:
+            self.segment += 1
+            self._pipe()
+            self._prune()
+        entry = {
+            "id": self.entries[-1]["id"] + 1 if self.entries else 0,
+            "command": command,
+            "segment": self.segment,
+            "offset": self._size(self.segment),
+            "time": time.time(),
+        }
+        self.entries.append(entry)
+        with open(self._index_path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        return entry["id"]
+
+    def _prune(self):
+        """Deletes the oldest segments beyond `max_segments` and their index entries."""
+        segments = self.segments()
+        expired = segments[: max(len(segments) - self.max_segments + 1, 0)]
+        if not expired:
+            return
+        for segment in expired:
+            os.remove(self._segment_path(segment))
+        self.entries = [x for x in self.entries if x["segment"] not in expired]
+        with open(self._index_path + ".tmp", "w") as f:
+            f.writelines(json.dumps(x) + "\n" for x in self.entries)
+        os.replace(self._index_path + ".tmp", self._index_path)
+
+    def _position(self, entry_id: int) -> int:
+        """Returns the position of an entry in `entries`."""
+        idx = bisect.bisect_left([x["id"] for x in self.entries], entry_id)
+        if idx == len(self.entries) or self.entries[idx]["id"] != entry_id:
+            raise KeyError(f"Transcript entry {entry_id} does not exist.")
+        return idx
+
+    def _end(self, idx: int) -> Optional[int]:
+        """Returns the offset where an entry's output ends, or None if it runs to the segment end."""
+        if idx + 1 < len(self.entries) and self.entries[idx + 1]["segment"] == self.entries[idx]["segment"]:
+            return self.entries[idx + 1]["offset"]
+        return None
+
+    def _read(self, segment: int, start: int, end: Optional[int]) -> bytes:
+        path = self._segment_path(segment)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return b""
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return mm[start:end]
+
+    def output(self, entry_id: int, start_line: int = 0, end_line: Optional[int] = None) -> str:
+        """Returns the output of a command, or a range of its lines.
+
+        The first line is the prompt and the command as it was typed.
+        """
+        idx = self._position(entry_id)
+        entry = self.entries[idx]
+        data = self._read(entry["segment"], entry["offset"], self._end(idx))
+        lines = data.decode(errors="replace").splitlines()
+        return "\n".join(lines[start_line:end_line])
+
+    def search(self, pattern: str, max_results: int = 20) -> List[TranscriptMatch]:
+        """Returns the latest lines matching a regular expression (or literal text if invalid)."""
+        try:
+            regex = re.compile(pattern.encode(), re.MULTILINE)
+        except re.error:
+            regex = re.compile(re.escape(pattern.encode()), re.MULTILINE)
+        matches = []
+        for segment in reversed(self.segments()):
+            entries = [x for x in self.entries if x["segment"] == segment]
+            if not entries:
+                continue
+            offsets = [x["offset"] for x in entries]
+            path = self._segment_path(segment)
+            if os.path.getsize(path) == 0:
+                continue
+            segment_matches = []
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                last_line = -1
+                for match in regex.finditer(mm):
+                    line_start = mm.rfind(b"\n", 0, match.start()) + 1
+                    if line_start == last_line or line_start < offsets[0]:
+                        continue
+                    last_line = line_start
+                    line_end = mm.find(b"\n", match.start())
+                    entry = entries[bisect.bisect_right(offsets, line_start) - 1]
+                    segment_matches.append(TranscriptMatch(
+                        entry_id=entry["id"],
+                        command=entry["command"],
+                        line_number=mm[entry["offset"]:line_start].count(b"\n"),
+                        line=mm[line_start:line_end if line_end >= 0 else None].decode(errors="replace"),
+                    ))
+            matches += reversed(segment_matches)
+            if len(matches) >= max_results:
+                break
+        return matches[:max_results]
+
+    def summary(self, n: int = 20) -> str:
+        """Lists the latest commands with their ids and number of output lines."""
+        lines = []
+        for idx in range(max(len(self.entries) - n, 0), len(self.entries)):
+            entry = self.entries[idx]
+            n_lines = self._read(entry["segment"], entry["offset"], self._end(idx)).count(b"\n")
+            started = time.strftime("%H:%M:%S", time.localtime(entry["time"]))
+            command = entry["command"].strip().splitlines()[0] if entry["command"].strip() else ""
+            lines.append(f"{entry['id']}\t{started}\t{n_lines} lines\t{command}")
+        return "\n".join(lines) if lines else "No commands recorded."
@@ -1,31 +1,35 @@
+import hashlib
+import os
 import re
-from dataclasses import dataclass
-import subprocess
-from typing import List, Dict, Union
+import shutil
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Dict, Tuple, Union
+
+from codebuddy.bash import bash
+from codebuddy.markdown import scan_markdown
 
 
 TRIPLE_BACKTICKS = "` ` `".replace(" ", "")
 
 
-def run_bash(command_str: str) -> str:
+PIP_PATTERN = re.compile(r"\bpip3?\b(?! --no-input)")
+
+
+def run_bash(command_str: str, timeout: float = None) -> str:
     """
-    Executes a bash command and returns its output.
+    Executes a bash command on a persistent bash worker and returns its output.
 
     Args:
         command_str (str): The bash command to execute.
+        timeout (float): Seconds before the command is killed. None waits indefinitely.
 
     Returns:
-        str: The output of the bash command if successful, otherwise None.
+        str: The output (stdout and stderr) of the bash command if successful, otherwise None.
     """
-    command_str = re.sub(r"pip(?! --no-input)", r"pip --no-input", command_str)
+    command_str = PIP_PATTERN.sub(r"\g<0> --no-input", command_str)
     try:
-        result = subprocess.run(
-            command_str,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-        )
+        result = bash(command_str, timeout=timeout, merge_stderr=True)
         if result.returncode != 0:
             return None
         return result.stdout
@@ -33,12 +37,59 @@ def run_bash(command_str: str) -> str:
         return None
 
 
+def pid_alive(pid: int) -> bool:
+    """
+    Checks whether a process exists, e.g. the owner of a workspace or batch.
+
+    Args:
+        pid (int): The process id.
+
+    Returns:
+        bool: True if the process exists, including processes of other users.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+FICLONE = 0x40049409  # Linux ioctl that shares a file's blocks with another file
+
+
+def clone_file(src: str, dst: str) -> str:
+    """
+    Copies a file, sharing its blocks with the source when the filesystem supports reflinks.
+
+    Args:
+        src (str): The file to copy.
+        dst (str): The destination path. It is replaced if it exists.
+
+    Returns:
+        str: "reflink" if the blocks are shared, otherwise "copy".
+    """
+    try:
+        import fcntl
+
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        shutil.copystat(src, dst)
+        return "reflink"
+    except (ImportError, OSError):
+        shutil.copy2(src, dst)
+        return "copy"
+
+
 @dataclass
 class Message:
     """A message in a dialog."""
 
     role: str  #: The role of the message sender
     content: str  #: The content of the message
+    tool_calls: List[dict] = None  #: Tool calls requested by an assistant message
+    tool_call_id: str = None  #: ID of the tool call that a "tool" message answers
 
     def __repr__(self):
         return f"{self.role}: {self.content}"
@@ -70,6 +121,60 @@ class PromptTemplate:
         return template
 
 
+@dataclass
+class CompiledPromptTemplate(PromptTemplate):
+    """A prompt template that is split into static and dynamic segments once.
+
+    Renders are memoized by their arguments. Keys listed in `dynamic_keys` are expected to change
+    between calls: everything before the first of them is a stable prefix that providers can
+    cache, so templates should place dynamic sections at the end.
+    """
+
+    dynamic_keys: List[str] = field(default_factory=list)  #: Keys whose values change often
+    cache_size: int = 16  #: Maximum number of memoized renders
+
+    def __post_init__(self):
+        # Even indices hold static text and odd indices hold key names
+        self._segments = re.split(r"\{\{(\w+)\}\}", self.template)
+        self._split_idx = next(
+            (
+                idx for idx in range(1, len(self._segments), 2)
+                if self._segments[idx] in self.dynamic_keys
+            ),
+            len(self._segments),
+        )
+        self._renders = OrderedDict()
+
+    def _render(self, segments: List[str], kwargs: dict) -> str:
+        return "".join(
+            kwargs.get(x, "{{" + x + "}}") if idx % 2 else x
+            for idx, x in enumerate(segments)
+        )
+
+    def split(self, **kwargs) -> Tuple[str, str]:
+        """Returns the rendered stable prefix and dynamic suffix of the prompt."""
+        key = tuple(sorted(kwargs.items()))
+        if key in self._renders:
+            self._renders.move_to_end(key)
+            return self._renders[key]
+        rendered = (
+            self._render(self._segments[: self._split_idx], kwargs),
+            self._render([""] + self._segments[self._split_idx :], kwargs),
+        )
+        self._renders[key] = rendered
+        if len(self._renders) > self.cache_size:
+            self._renders.popitem(last=False)
+        return rendered
+
+    def format(self, **kwargs) -> str:
+        """Replace template keys with provided values."""
+        return "".join(self.split(**kwargs))
+
+    def prefix_fingerprint(self, **kwargs) -> str:
+        """Returns a hash of the rendered stable prefix."""
+        return hashlib.sha256(self.split(**kwargs)[0].encode()).hexdigest()[:16]
+
+
 def split_markdown(text: str) -> List[Dict[str, Union[str, str]]]:
     """
     Splits a markdown text into chunks of text and code blocks.
@@ -83,37 +188,10 @@ def split_markdown(text: str) -> List[Dict[str, Union[str, str]]]:
                 - "type" (str): The type of the chunk, either "text" or the language of the code block.
                 - "content" (str): The content of the chunk.
     """
-    # Regular expression to match markdown code blocks
-    code_block_pattern = re.compile(
-        rf"{TRIPLE_BACKTICKS}(\w+)?\n(.*?){TRIPLE_BACKTICKS}", re.DOTALL
-    )
-
-    chunks = []
-    last_index = 0
-
-    # Find all code blocks
-    for match in code_block_pattern.finditer(text):
-        # Add the text before the code block
-        if last_index < match.start():
-            chunks.append(
-                {
-                    "type": "text",
-                    "content": text[last_index : match.start()],  # .strip()
-                }
-            )
-
-        # Add the code block
-        language = match.group(1) if match.group(1) else "code"
-        code_content = match.group(2)
-        chunks.append({"type": language, "content": code_content})
-
-        last_index = match.end()
-
-    # Add the remaining text after the last code block
-    if last_index < len(text):
-        chunks.append({"type": "text", "content": text[last_index:].strip()})
-    chunks = [x for x in chunks if x["content"]]
-    return chunks
+    chunks = [{"type": x.type, "content": x.content} for x in scan_markdown(text)]
+    if chunks and chunks[-1]["type"] == "text":
+        chunks[-1]["content"] = chunks[-1]["content"].strip()
+    return [x for x in chunks if x["content"]]
 
 
 def filter_content(content: str, keywords: List[str]) -> str:
@@ -0,0 +1,261 @@
+import json
+import os
+import re
+import shutil
+import stat
+import subprocess
+import time
+from dataclasses import dataclass, field
+from typing import List
+
+from codebuddy.utils import clone_file, pid_alive
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+WORKSPACE_STRATEGIES = ["auto", "overlay", "reflink", "hardlink", "copy"]
+
+
+def break_link(path: str):
+    """Gives a file its own copy of its data if it is hard linked, so writing to it in place does
+    not change the other links."""
+    if os.stat(path).st_nlink > 1:
+        tmp_path = f"{path}.{os.getpid()}.unlink"
+        clone_file(path, tmp_path)
+        os.replace(tmp_path, path)
+
+
+@dataclass
+class Workspace:
+    """An isolated working directory created from a source project."""
+
+    path: str  #: The working directory
+    source: str  #: The project it was created from
+    strategy: str  #: How it was created: overlay, reflink, hardlink or copy
+    internal_path: str = ""  #: Directory for its metadata, overlay layers and checkpoints
+    linked: bool = False  #: If True, some files are hard links to the source's files
+    manager: "WorkspaceManager" = field(default=None, repr=False)  #: Removes the workspace
+
+    def close(self):
+        """Removes the workspace."""
+        if self.manager is not None:
+            self.manager.remove(os.path.basename(self.path))
+
+
+@dataclass
+class WorkspaceManager:
+    """Creates isolated copies of projects, one per session, and removes them when done.
+
+    The "auto" strategy mounts an overlayfs with the project as its read-only lower layer, so
+    creating a workspace takes constant time and only changed files are written. Without overlay
+    support, files are reflinked (sharing their blocks until they are written) or copied.
+
+    Hard links are faster, but a file written in place through a hard link changes the source
+    too. The "hardlink" strategy links every file, and `link_read_only` links files without write
+    permission (such as git objects) instead of copying them. Module edits break the link before
+    writing, but terminal commands do not, and root or a `chmod` can write read-only files. Both
+    are only safe if files are replaced rather than written in place.
+
+    Each workspace is a directory under `root`, with its metadata, overlay layers and checkpoints
+    in a hidden sibling directory. Workspaces whose creating process has exited are garbage
+    collected when a manager starts.
+    """
+
+    root: str = "~/.codebuddy/workspaces"  #: Directory that workspaces are created in
+    strategy: str = "auto"  #: One of auto, overlay, reflink, hardlink or copy
+    link_read_only: bool = False  #: If True, read-only files are hard linked instead of copied
+    collect_garbage: bool = True  #: If True, removes workspaces of exited processes on startup
+
+    def __post_init__(self):
+        if self.strategy not in WORKSPACE_STRATEGIES:
+            raise ValueError(f"Unknown workspace strategy {self.strategy}.")
+        self.root = os.path.expanduser(self.root)
+        os.makedirs(self.root, exist_ok=True)
+        if self.collect_garbage:
+            self.gc()
+
+    def _internal_path(self, name: str) -> str:
+        return os.path.join(self.root, f".{name}")
+
+    def names(self) -> List[str]:
+        """Returns the names of the workspaces under `root`."""
+        return sorted(
+            x[1:] for x in os.listdir(self.root)
+            if x.startswith(".") and os.path.exists(os.path.join(self.root, x, "meta.json"))
+        )
+
+    def metadata(self, name: str) -> dict:
+        """Returns the source, strategy, creating pid and creation time of a workspace."""
+        with open(os.path.join(self._internal_path(name), "meta.json"), "r") as f:
+            return json.load(f)
+
+    def create(self, source: str, name: str) -> Workspace:
+        """Creates a workspace from a project directory, replacing any workspace of that name.
+
+        Args:
+            source (str): The project directory.
+            name (str): The workspace name, e.g. a session id.
+
+        Returns:
+            Workspace: The workspace. Its `path` is `root`/`name`.
+        """
+        source = os.path.realpath(os.path.expanduser(source))
+        if not os.path.isdir(source):
+            raise NotADirectoryError(f"Project path {source} does not exist.")
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", name).lstrip(".")
+        start = time.monotonic()
+        if name in self.names():
+            owner = self.metadata(name)["pid"]
+            if owner != os.getpid() and pid_alive(owner):
+                raise FileExistsError(f"Workspace {name} is in use by process {owner}.")
+        self.remove(name)
+        path = os.path.join(self.root, name)
+        internal_path = self._internal_path(name)
+        os.makedirs(internal_path)
+
+        strategy = None
+        if self.strategy in ("auto", "overlay"):
+            strategy = self._mount_overlay(source, path, internal_path)
+            if strategy is None and self.strategy == "overlay":
+                shutil.rmtree(internal_path, ignore_errors=True)
+                raise OSError("Could not mount an overlayfs workspace.")
+        if strategy is None:
+            strategy = self._populate(source, path)
+        metadata = {
+            "source": source, "strategy": strategy, "pid": os.getpid(), "created": time.time()
+        }
+        with open(os.path.join(internal_path, "meta.json"), "w") as f:
+            json.dump(metadata, f)
+        logger.info(
+            f"Created {strategy} workspace {path} in {time.monotonic() - start:.3f}s"
+        )
+        return Workspace(
+            path=path,
+            source=source,
+            strategy=strategy,
+            internal_path=internal_path,
+            linked=strategy == "hardlink" or (strategy != "overlay" and self.link_read_only),
+            manager=self,
+        )
+
+    def _mount_overlay(self, source: str, path: str, internal_path: str) -> str:
+        """Mounts an overlayfs at `path`. Returns "overlay", or None if it cannot be mounted."""
+        upper, work = os.path.join(internal_path, "upper"), os.path.join(internal_path, "work")
+        for directory in (upper, work, path):
+            os.makedirs(directory)
+        options = f"lowerdir={source},upperdir={upper},workdir={work}"
+        if os.geteuid() == 0:
+            command = ["mount", "-t", "overlay", "overlay", "-o", options, path]
+        elif shutil.which("fuse-overlayfs"):
+            command = ["fuse-overlayfs", "-o", options, path]
+        else:
+            command = None
+        if command is not None:
+            try:
+                result = subprocess.run(command, capture_output=True, text=True, timeout=10)
+                if result.returncode == 0:
+                    return "overlay"
+                logger.info(f"Could not mount an overlay: {result.stderr.strip()}")
+            except (OSError, subprocess.TimeoutExpired) as ex:
+                logger.info(f"Could not mount an overlay: {ex}")
+        for directory in (path, upper, work):
+            os.rmdir(directory)
+        return None
+
+    def _populate(self, source: str, path: str) -> str:
+        """Recreates the source tree at `path`. Returns the strategy used for its files."""
+        hardlink = self.strategy == "hardlink"
+        directories, copies = [], []
+        for root, dirs, names in os.walk(source):
+            rel_root = os.path.relpath(root, source)
+            target_root = os.path.normpath(os.path.join(path, rel_root))
+            os.makedirs(target_root, exist_ok=True)
+            directories.append((root, target_root))
+            for name in names + [x for x in dirs if os.path.islink(os.path.join(root, x))]:
+                src, dst = os.path.join(root, name), os.path.join(target_root, name)
+                st = os.lstat(src)
+                if stat.S_ISLNK(st.st_mode):
+                    os.symlink(os.readlink(src), dst)
+                elif not stat.S_ISREG(st.st_mode):
+                    continue
+                elif hardlink or (self.link_read_only and not st.st_mode & 0o222):
+                    try:
+                        os.link(src, dst)
+                    except OSError:
+                        copies.append((src, dst))
+                else:
+                    copies.append((src, dst))
+
+        strategy = "hardlink" if hardlink else "copy"
+        copy = shutil.copy2
+        if copies and self.strategy in ("auto", "reflink"):
+            # The first file shows whether the filesystem supports reflinks
+            if clone_file(*copies.pop()) == "reflink":
+                strategy, copy = "reflink", clone_file
+        for src, dst in copies:
+            copy(src, dst)
+        # Directory times are copied last, since adding entries to a directory changes its mtime
+        for src, dst in reversed(directories):
+            shutil.copystat(src, dst)
+        return strategy
+
+    def _unmount(self, path: str) -> bool:
+        """Unmounts an overlay workspace. Returns False if it is still mounted."""
+        for command in (["umount", path], ["fusermount", "-u", path], ["umount", "-l", path]):
+            try:
+                if subprocess.run(command, capture_output=True, timeout=10).returncode == 0:
+                    return True
+            except (OSError, subprocess.TimeoutExpired):
+                continue
+        logger.warning(f"Could not unmount workspace {path}")
+        return False
+
+    def remove(self, name: str):
+        """Unmounts and deletes a workspace, if it exists."""
+        path = os.path.join(self.root, name)
+        if os.path.ismount(path) and not self._unmount(path):
+            return
+        for directory in (path, self._internal_path(name)):
+            if os.path.lexists(directory):
+                shutil.rmtree(directory, ignore_errors=True)
+
+    def detach(self, name: str):
+        """Turns an overlay workspace into a plain copy, so it can be kept after its process
+        exits without leaving a mount behind. Other workspaces are already plain directories."""
+        path = os.path.join(self.root, name)
+        if not os.path.ismount(path):
+            return
+        tmp_path = os.path.join(self.root, f".{name}.detach")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        shutil.copytree(path, tmp_path, symlinks=True, copy_function=clone_file)
+        if not self._unmount(path):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+        os.rmdir(path)
+        os.replace(tmp_path, path)
+        internal_path = self._internal_path(name)
+        for layer in ("upper", "work"):
+            shutil.rmtree(os.path.join(internal_path, layer), ignore_errors=True)
+        metadata = self.metadata(name)
+        with open(os.path.join(internal_path, "meta.json"), "w") as f:
+            json.dump({**metadata, "strategy": "copy"}, f)
+        logger.info(f"Detached overlay workspace {path}")
+
+    def gc(self, max_age: float = None) -> List[str]:
+        """Removes workspaces whose creating process has exited, or that are older than `max_age`
+        seconds. Returns the names of the removed workspaces."""
+        removed = []
+        for name in self.names():
+            try:
+                metadata = self.metadata(name)
+            except (OSError, ValueError):
+                continue
+            expired = max_age is not None and time.time() - metadata["created"] > max_age
+            if expired or not pid_alive(metadata["pid"]):
+                self.remove(name)
+                removed.append(name)
+        if removed:
+            logger.info(f"Removed {len(removed)} stale workspaces from {self.root}")
+        return removed
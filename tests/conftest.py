@@ -0,0 +1,39 @@
+from dataclasses import dataclass
+
+from codebuddy.tmux_module import TmuxModule
+
+
+class FakeSession:
+    """Stands in for a tmux session, recording the commands it is sent."""
+
+    def __init__(self, cwd, session_id="fake-session"):
+        self.cwd = cwd
+        self.session_id = session_id
+        self.content = ""
+        self.commands = []
+        self.transcript = None
+
+    def __call__(self, command):
+        self.commands.append(command)
+        self.content += f"$ {command}\noutput of {command}\n"
+        return self.content
+
+    def cancel(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@dataclass
+class FakeTmuxModule(TmuxModule):
+    """A TmuxModule that runs blocks on fake sessions. Mix in a backend to call a model."""
+
+    @property
+    def project_tree(self):
+        return ""
+
+    def _initialize_tmux_sessions(self):
+        self.terminal_pool = [FakeSession(self.project_path) for _ in range(self.terminal_pool_size)]
+        self.terminal_session = self.terminal_pool[0]
+        self.python_session = FakeSession(self.project_path)
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from codebuddy.bash import BashPool, BashWorker, bash, bash_async
+from codebuddy.utils import run_bash
+
+
+def test_separates_stdout_and_stderr():
+    result = bash("echo out; echo err >&2; exit 3")
+    assert result.stdout == "out\n"
+    assert result.stderr == "err\n"
+    assert result.returncode == 3
+    assert not result.timed_out
+
+
+def test_output_without_trailing_newline():
+    assert bash("printf abc").stdout == "abc"
+    assert bash("printf 'abc\\n\\n'").stdout == "abc\n\n"
+
+
+def test_commands_do_not_change_the_worker():
+    worker = BashWorker()
+    try:
+        assert worker.run("cd /; export FOO=1; exit 5").returncode == 5
+        result = worker.run("pwd; echo ${FOO:-unset}")
+        assert result.stdout == f"{os.getcwd()}\nunset\n"
+    finally:
+        worker.close()
+
+
+def test_syntax_error_and_stdin():
+    result = bash("echo 'unterminated")
+    assert result.returncode != 0
+    assert "unexpected EOF" in result.stderr or "unexpected end" in result.stderr
+    # Commands that read stdin get EOF instead of hanging
+    assert bash("cat").returncode == 0
+    assert bash("echo ok").stdout == "ok\n"
+
+
+def test_cwd(tmp_path):
+    assert bash("pwd", cwd=str(tmp_path)).stdout == f"{tmp_path}\n"
+
+
+def test_timeout_restarts_worker():
+    worker = BashWorker()
+    try:
+        start = time.time()
+        result = worker.run("echo started; sleep 30", timeout=0.5)
+        assert time.time() - start < 5
+        assert result.timed_out and result.returncode is None
+        assert result.stdout == "started\n"
+        assert worker.run("echo again").stdout == "again\n"
+    finally:
+        worker.close()
+
+
+def test_environment_changes_are_seen(monkeypatch):
+    monkeypatch.setenv("CODEBUDDY_TEST_VALUE", "first")
+    assert bash("echo $CODEBUDDY_TEST_VALUE").stdout == "first\n"
+    monkeypatch.setenv("CODEBUDDY_TEST_VALUE", "second")
+    assert bash("echo $CODEBUDDY_TEST_VALUE").stdout == "second\n"
+
+
+def test_pool_runs_commands_concurrently():
+    pool = BashPool(size=4)
+    try:
+        start = time.time()
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(lambda x: pool.run(f"sleep 0.5; echo {x}"), range(4)))
+        assert time.time() - start < 1.5
+        assert [x.stdout for x in results] == [f"{x}\n" for x in range(4)]
+    finally:
+        pool.close()
+
+
+def test_interrupted_worker_is_restarted():
+    pool = BashPool(size=1)
+
+    def interrupt(signum, frame):
+        raise KeyboardInterrupt
+
+    previous = signal.signal(signal.SIGALRM, interrupt)
+    try:
+        signal.setitimer(signal.ITIMER_REAL, 0.2)
+        with pytest.raises(KeyboardInterrupt):
+            pool.run("sleep 0.5; echo interrupted")
+        time.sleep(0.5)
+        # The interrupted command's output is not returned with the next command's
+        assert pool.run("echo next").stdout == "next\n"
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+        pool.close()
+
+
+def test_bash_async():
+    async def main():
+        return await asyncio.gather(*(bash_async(f"echo {x}") for x in range(3)))
+
+    assert [x.stdout for x in asyncio.run(main())] == ["0\n", "1\n", "2\n"]
+
+
+def test_run_bash_merges_stderr():
+    assert run_bash("echo out; echo err >&2") == "out\nerr\n"
+    assert run_bash("sleep 5", timeout=0.2) is None
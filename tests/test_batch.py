@@ -0,0 +1,164 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from codebuddy.backend import Backend, BatchResult
+from codebuddy.batch_eval import BatchEval
+from codebuddy.bedrock_backend import parse_bedrock_batch_record
+from codebuddy.http_backend import HttpBackend
+from codebuddy.local_batch_backend import LocalBatchBackend
+from codebuddy.openai_backend import OpenaiBackend, parse_openai_batch_line
+from codebuddy.stub_server import StubServer
+from codebuddy.utils import Message
+
+
+REQUESTS = {
+    "a": [Message("system", "Be brief."), Message("user", "first")],
+    "b": [Message("user", "second")],
+}
+
+
+def test_local_batch_echoes_requests(tmp_path):
+    backend = LocalBatchBackend(batch_dir=str(tmp_path), process_delay=0.05)
+    results = backend.run_batch(REQUESTS, poll_interval=0.01)
+    assert {k: x.content for k, x in results.items()} == {"a": "first", "b": "second"}
+    assert results["a"].usage == (3, 1, 0, 0)
+    assert backend.tokens["llm_calls"] == 2 and backend.output_tokens == [1, 1]
+    batch_id = next(tmp_path.iterdir()).name
+    with open(tmp_path / batch_id / "input.jsonl") as f:
+        line = json.loads(f.readline())
+    assert line["custom_id"] == "a" and line["url"] == "/v1/chat/completions"
+    assert line["body"]["messages"][0] == {"role": "system", "content": "Be brief."}
+
+
+class FailingBackend(Backend):
+    def call_api(self, messages, retries=0):
+        if messages[-1].content == "second":
+            raise ValueError("overloaded")
+        self.record_usage((5, 2, 0, 0))
+        return "ok"
+
+
+def test_local_batch_is_only_taken_over_from_exited_processes(tmp_path):
+    backend = LocalBatchBackend(batch_dir=str(tmp_path))
+    # The submitting process never answers the batch
+    backend._start_worker = lambda batch_id: None
+    batch_id = backend.submit_batch(REQUESTS)
+    status_path = tmp_path / batch_id / "status.json"
+    assert json.loads(status_path.read_text())["pid"] == os.getpid()
+
+    # A live process owns the batch, so polling it from here does not answer it again
+    other = LocalBatchBackend(batch_dir=str(tmp_path))
+    status_path.write_text(json.dumps({"status": "in_progress", "pid": os.getppid()}))
+    assert other.batch_status(batch_id) == "running"
+    assert other._workers == {}
+
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+    status_path.write_text(json.dumps({"status": "in_progress", "pid": exited.pid}))
+    assert other.batch_status(batch_id) == "running"
+    assert json.loads(status_path.read_text())["pid"] == os.getpid()
+    other._workers[batch_id].join(timeout=5)
+    assert other.batch_status(batch_id) == "completed"
+    assert {k: x.content for k, x in other.batch_results(batch_id).items()} == {
+        "a": "first", "b": "second"
+    }
+
+
+def test_local_batch_maps_errors_and_usage(tmp_path):
+    backend = LocalBatchBackend(batch_dir=str(tmp_path), backend=FailingBackend())
+    results = backend.run_batch(REQUESTS, poll_interval=0.01)
+    assert results["a"] == BatchResult("a", content="ok", usage=(5, 2, 0, 0))
+    assert results["b"].content is None and results["b"].error == "{'message': 'overloaded'}"
+    # Failed requests are not counted as calls
+    assert backend.tokens["llm_calls"] == 1 and backend.input_tokens == [5]
+
+
+def test_local_batch_with_a_stub_server(tmp_path):
+    server = StubServer(responses=["Batched reply."]).start()
+    try:
+        backend = LocalBatchBackend(
+            batch_dir=str(tmp_path), backend=HttpBackend(base_url=server.base_url)
+        )
+        results = backend.run_batch(REQUESTS, poll_interval=0.01)
+        assert [x.content for x in results.values()] == ["Batched reply.", "Batched reply."]
+        assert len(server.requests) == 2
+    finally:
+        server.stop()
+
+
+def test_openai_batch_format():
+    line = OpenaiBackend(model="gpt-4o").batch_line("a", REQUESTS["a"])
+    assert line["body"]["model"] == "gpt-4o"
+    assert line["body"]["messages"] == [
+        {"role": "system", "content": "Be brief."}, {"role": "user", "content": "first"}
+    ]
+    result = parse_openai_batch_line({
+        "custom_id": "a",
+        "response": {"status_code": 200, "body": {
+            "choices": [{"message": {"content": "Hi"}}],
+            "usage": {
+                "prompt_tokens": 7,
+                "completion_tokens": 1,
+                "prompt_tokens_details": {"cached_tokens": 4},
+            },
+        }},
+        "error": None,
+    })
+    assert result == BatchResult("a", content="Hi", usage=(7, 1, 4, 0))
+    failed = parse_openai_batch_line(
+        {"custom_id": "b", "response": {"status_code": 429, "body": {}}}
+    )
+    assert failed.error == "HTTP 429"
+
+
+def test_bedrock_batch_records():
+    result = parse_bedrock_batch_record({
+        "recordId": "a",
+        "modelInput": {},
+        "modelOutput": {
+            "content": [{"type": "text", "text": "Hi"}],
+            "usage": {"input_tokens": 7, "output_tokens": 1},
+        },
+    })
+    assert result == BatchResult("a", content="Hi", usage=(7, 1, 0, 0))
+    assert parse_bedrock_batch_record({"recordId": "b", "error": "bad"}).error == "bad"
+
+
+def test_batch_eval(tmp_path):
+    dialogs = tmp_path / "dialogs.jsonl"
+    with open(dialogs, "w") as f:
+        for idx in range(3):
+            messages = [
+                {"role": "user", "content": f"question {idx}"},
+                {"role": "assistant", "content": f"question {idx}"},
+            ]
+            f.write(json.dumps({"id": idx, "messages": messages}) + "\n")
+        # Dialogs without a response to compare with are skipped
+        unanswered = [{"role": "user", "content": "hi"}]
+        f.write(json.dumps({"id": "unanswered", "messages": unanswered}) + "\n")
+    prompt = tmp_path / "short.yaml"
+    prompt.write_text("prompt_template: 'Be brief.\n\n{{project}}'\n")
+    output = tmp_path / "results.jsonl"
+    summary = BatchEval(
+        dialogs_path=str(dialogs),
+        prompt_paths=[str(prompt)],
+        batch_dir=str(tmp_path / "batches"),
+        output_path=str(output),
+        poll_interval=0.01,
+    ).run()
+    assert summary["short"]["requests"] == 3 and summary["short"]["errors"] == 0
+    # The echo backend repeats the question, which matches the recorded answer
+    assert summary["short"]["similarity"] == 1.
+    with open(output) as f:
+        records = [json.loads(x) for x in f]
+    assert [x["id"] for x in records] == ["short:0", "short:1", "short:2"]
+    assert records[0]["input_tokens"] > 0
+
+
+def test_batch_eval_requires_a_prompt(tmp_path):
+    with pytest.raises(ValueError):
+        BatchEval(batch_dir=str(tmp_path)).make_requests({"a": REQUESTS["b"]})
@@ -0,0 +1,103 @@
+import json
+import multiprocessing
+import os
+import time
+from dataclasses import dataclass
+
+from codebuddy import tmux_module
+from codebuddy.backend import Backend
+from codebuddy.batch_runner import RateLimiter, completed_ids, load_tasks, _run_task, _safe_name
+from codebuddy.utils import TRIPLE_BACKTICKS
+from conftest import FakeTmuxModule
+
+
+def _wait(limiter, times):
+    for _ in range(2):
+        limiter.wait()
+        times.put(time.time())
+
+
+def test_rate_limiter_spaces_calls_across_processes():
+    limiter = RateLimiter(requests_per_minute=600)
+    times = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=_wait, args=(limiter, times)) for _ in range(2)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    times = sorted(times.get() for _ in range(4))
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    assert all(x >= 0.09 for x in gaps)
+
+
+def test_rate_limiter_disabled():
+    limiter = RateLimiter(requests_per_minute=0)
+    start = time.time()
+    for _ in range(10):
+        limiter.wait()
+    assert time.time() - start < 0.05
+
+
+def test_load_tasks(tmp_path):
+    path = tmp_path / "tasks.jsonl"
+    path.write_text('{"id": "a", "prompt": "do x"}\n\n{"prompts": ["one", "two"]}\n')
+    tasks = load_tasks(str(path))
+    assert tasks == [{"id": "a", "prompts": ["do x"]}, {"id": "2", "prompts": ["one", "two"]}]
+
+
+def test_completed_ids_skips_failures_when_retrying(tmp_path):
+    path = tmp_path / "results.jsonl"
+    path.write_text(
+        json.dumps({"id": "a", "status": "ok"}) + "\n"
+        + json.dumps({"id": "b", "status": "error"}) + "\n"
+        + '{"id": "c", "sta'
+    )
+    assert completed_ids(str(path)) == {"a"}
+    assert completed_ids(str(path), retry_failed=False) == {"a", "b"}
+    assert completed_ids(str(tmp_path / "missing.jsonl")) == set()
+
+
+def test_safe_name():
+    assert _safe_name("repo/task.1:x") == "repo_task_1_x"
+
+
+@dataclass
+class EditingModule(FakeTmuxModule, Backend):
+    transcript_dir: str = ""
+
+    def call_api(self, messages, retries=0):
+        self.record_usage((1, 1, 0, 0))
+        if len(self.messages) > 1:
+            return "Done."
+        return f"OVERWRITE $PROJECT_PATH/a.py\n{TRIPLE_BACKTICKS}python\na = 2\n{TRIPLE_BACKTICKS}\n"
+
+
+def test_run_task_keeps_checkpoints_in_the_workspace(tmp_path, monkeypatch):
+    monkeypatch.setitem(tmux_module.TMUX_MODULES, "editing", EditingModule)
+    (tmp_path / "project").mkdir()
+    (tmp_path / "project" / "a.py").write_text("a = 1\n")
+    config = {
+        "config_path": "",
+        "backend": "editing",
+        "max_calls": 3,
+        "python_env": str(tmp_path),
+        "project_path": str(tmp_path / "project"),
+        "python_executor": "pipe",
+        "workspace_dir": str(tmp_path / "workspaces"),
+        "workspace_strategy": "auto",
+        "keep_workspaces": True,
+    }
+    result = _run_task(config, {"id": "t/1", "prompts": ["edit a.py"]})
+    assert result["status"] == "ok"
+    workspace = result["workspace"]
+    assert open(os.path.join(workspace, "a.py")).read() == "a = 2\n"
+    assert (tmp_path / "project" / "a.py").read_text() == "a = 1\n"
+    # Kept workspaces are plain directories holding their own checkpoints
+    assert not os.path.ismount(workspace)
+    internal_path = os.path.join(config["workspace_dir"], ".t_1")
+    assert os.listdir(os.path.join(internal_path, "checkpoints", "manifests")) == ["000001.json"]
+
+    config["keep_workspaces"] = False
+    result = _run_task(config, {"id": "t/2", "prompts": ["edit a.py"]})
+    assert result["status"] == "ok"
+    assert sorted(os.listdir(config["workspace_dir"])) == [".t_1", "t_1"]
@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+
+import pytest
+
+from codebuddy.checkpoint import CheckpointStore
+from codebuddy.utils import clone_file
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def make_store(tmp_path):
+    project = tmp_path / "project"
+    write(str(project / "a.py"), "a = 1\n")
+    write(str(project / "pkg" / "b.py"), "b = 1\n")
+    write(str(project / ".git" / "HEAD"), "ref\n")
+    return str(project), CheckpointStore(project_path=str(project), root=str(tmp_path / "store"))
+
+
+def test_clone_file(tmp_path):
+    write(str(tmp_path / "src"), "data")
+    assert clone_file(str(tmp_path / "src"), str(tmp_path / "dst")) in ("reflink", "copy")
+    assert open(str(tmp_path / "dst")).read() == "data"
+
+
+def test_checkpoints_deduplicate_blobs(tmp_path):
+    project, store = make_store(tmp_path)
+    first = store.create("first")
+    assert store.create("unchanged") == first
+    time.sleep(0.01)
+    write(os.path.join(project, "a.py"), "a = 2\n")
+    second = store.create("second")
+    assert second == first + 1
+    assert [x["label"] for x in store.list()] == ["first", "second"]
+    assert set(store.load(first)["files"]) == {"a.py", os.path.join("pkg", "b.py")}
+    blobs = [x for _, _, names in os.walk(os.path.join(store.root, "blobs")) for x in names]
+    assert len(blobs) == 3
+
+
+def test_diff_and_restore(tmp_path):
+    project, store = make_store(tmp_path)
+    first = store.create()
+    time.sleep(0.01)
+    write(os.path.join(project, "a.py"), "a = 2\n")
+    write(os.path.join(project, "c.py"), "c = 1\n")
+    os.remove(os.path.join(project, "pkg", "b.py"))
+    assert store.diff(first) == {
+        "added": ["c.py"], "removed": [os.path.join("pkg", "b.py")], "modified": ["a.py"]
+    }
+    assert "-a = 1\n+a = 2\n" in store.unified_diff(first)
+
+    changed = store.restore(first)
+    assert sorted(changed) == ["a.py", "c.py", os.path.join("pkg", "b.py")]
+    assert open(os.path.join(project, "a.py")).read() == "a = 1\n"
+    assert not os.path.exists(os.path.join(project, "c.py"))
+    assert store.diff(first) == {"added": [], "removed": [], "modified": []}
+    assert os.path.exists(os.path.join(project, ".git", "HEAD"))
+
+    # The state before the restore was checkpointed and can be restored
+    store.restore(first + 1, paths=["a.py"])
+    assert open(os.path.join(project, "a.py")).read() == "a = 2\n"
+
+
+def test_prune_removes_unreferenced_blobs(tmp_path):
+    project, store = make_store(tmp_path)
+    store.create()
+    for idx in range(3):
+        time.sleep(0.01)
+        write(os.path.join(project, "a.py"), f"a = {idx + 10}\n")
+        store.create()
+    store.prune(keep=1)
+    assert len(store.ids()) == 1
+    blobs = [x for _, _, names in os.walk(os.path.join(store.root, "blobs")) for x in names]
+    assert len(blobs) == 2
+
+
+def test_concurrent_checkpoints_share_a_root(tmp_path):
+    project, _ = make_store(tmp_path)
+    errors, created = [], []
+
+    def work(idx):
+        store = CheckpointStore(project_path=project, root=str(tmp_path / "store"))
+        try:
+            for jdx in range(20):
+                write(os.path.join(project, f"thread_{idx}.py"), f"x = {jdx}\n")
+                created.append(store.create(f"{idx}-{jdx}"))
+        except Exception as ex:
+            errors.append(ex)
+
+    threads = [threading.Thread(target=work, args=(x,)) for x in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    store = CheckpointStore(project_path=project, root=str(tmp_path / "store"))
+    # Every create wrote its own checkpoint or found the latest one unchanged
+    assert store.ids() == sorted(set(created))
+    assert store.ids() == list(range(1, len(store.ids()) + 1))
+    assert not [x for _, _, names in os.walk(store.root) for x in names if x.endswith(".tmp")]
+    latest = store.load(store.create())["files"]
+    assert {f"thread_{x}.py" for x in range(4)} <= set(latest)
+
+
+def test_checkpoint_is_not_written_if_a_file_cannot_be_stored(tmp_path, monkeypatch):
+    project, store = make_store(tmp_path)
+    first = store.create()
+    time.sleep(0.01)
+    write(os.path.join(project, "a.py"), "a = 2\n")
+    write(os.path.join(project, "c.py"), "c = 1\n")
+    store_file = store._store
+
+    def failing_store(path):
+        if path.endswith("c.py"):
+            raise PermissionError(f"Permission denied: {path}")
+        return store_file(path)
+
+    monkeypatch.setattr(store, "_store", failing_store)
+    with pytest.raises(PermissionError):
+        store.create()
+    assert store.ids() == [first]
+    # A restore needs a checkpoint of the current state, so it does not delete anything
+    with pytest.raises(PermissionError):
+        store.restore(first)
+    assert os.path.exists(os.path.join(project, "c.py"))
+    assert open(os.path.join(project, "a.py")).read() == "a = 2\n"
@@ -0,0 +1,98 @@
+import os
+import time
+from dataclasses import dataclass, field
+from typing import List
+
+from codebuddy.backend import Backend
+from codebuddy.code_index import CodeIndex, js_symbols, python_symbols, tokenize
+from conftest import FakeTmuxModule
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def test_tokenize_splits_identifiers():
+    tokens = tokenize("class OutputCompactor: max_line_chars")
+    assert "outputcompactor" in tokens
+    assert {"output", "compactor", "max", "line", "chars"} <= set(tokens)
+
+
+def test_python_symbols_include_methods():
+    source = "class A:\n    def run(self):\n        pass\n\nasync def main():\n    pass\n"
+    symbols = [(x.name, x.kind, x.line) for x in python_symbols(source, "a.py")]
+    assert symbols == [("A", "class", 1), ("A.run", "function", 2), ("main", "function", 5)]
+
+
+def test_js_symbols():
+    source = (
+        "export function render(x) {}\n"
+        "class Widget extends Base {}\n"
+        "const handleClick = async (event) => {}\n"
+        "export interface Props {}\n"
+        "const limit = 10\n"
+    )
+    names = [x.name for x in js_symbols(source, "a.ts")]
+    assert names == ["render", "Widget", "handleClick", "Props"]
+
+
+def test_search_ranks_relevant_file_first(tmp_path):
+    write(str(tmp_path / "billing" / "invoice.py"), "def compute_invoice_total(items):\n    return sum(items)\n")
+    write(str(tmp_path / "auth.py"), "def login(user, password):\n    return check_password(user, password)\n")
+    write(str(tmp_path / "node_modules" / "lib.js"), "function computeInvoiceTotal() {}\n")
+    index = CodeIndex(project_path=str(tmp_path))
+    results = index.search("where is the invoice total computed?", k=2)
+    assert results[0].path == os.path.join("billing", "invoice.py")
+    assert results[0].start_line == 1
+    assert all("node_modules" not in x.path for x in results)
+    assert index.find_symbol("login")[0].path == "auth.py"
+
+
+def test_search_refreshes_modified_and_deleted_files(tmp_path):
+    write(str(tmp_path / "a.py"), "def alpha():\n    pass\n")
+    write(str(tmp_path / "b.py"), "def beta():\n    pass\n")
+    index = CodeIndex(project_path=str(tmp_path))
+    assert index.search("alpha")[0].path == "a.py"
+    assert index.refresh() == 0
+
+    time.sleep(0.01)
+    write(str(tmp_path / "a.py"), "def gamma():\n    pass\n")
+    os.remove(str(tmp_path / "b.py"))
+    assert index.search("alpha") == []
+    assert index.search("gamma")[0].path == "a.py"
+    assert index.find_symbol("beta") == []
+    assert set(index.files) == {"a.py"}
+
+
+def test_long_files_are_chunked(tmp_path):
+    lines = [f"x{i} = {i}" for i in range(100)]
+    lines[70] = "needle = 'found'"
+    write(str(tmp_path / "long.py"), "\n".join(lines))
+    index = CodeIndex(project_path=str(tmp_path), chunk_lines=40, chunk_overlap=10)
+    result = index.search("needle", k=1)[0]
+    assert result.start_line <= 71 <= result.end_line
+    assert "needle = 'found'" in result.text
+
+
+@dataclass
+class RecordingModule(FakeTmuxModule, Backend):
+    requests: List[list] = field(default_factory=list)
+
+    def call_api(self, messages, retries=0):
+        self.requests.append(messages)
+        return "Done."
+
+
+def test_retrieved_code_is_only_sent_with_the_request(tmp_path):
+    write(str(tmp_path / "billing" / "invoice.py"), "def compute_invoice_total(items):\n    return sum(items)\n")
+    module = RecordingModule(
+        project_path=str(tmp_path), retrieval_k=1, checkpoint_edits=False, transcript_dir=""
+    )
+    list(module("Where is the invoice total computed?"))
+    assert "compute_invoice_total" in module.requests[0][-1].content
+    assert module.messages[0].content == "Where is the invoice total computed?"
+    list(module("Thanks"))
+    # Later requests do not repeat the code retrieved for earlier messages
+    assert all("compute_invoice_total" not in x.content for x in module.requests[1][:-1])
@@ -0,0 +1,73 @@
+import os
+import time
+
+from codebuddy.command_cache import CommandCache
+
+
+def test_command_cache_read_only_commands():
+    cache = CommandCache()
+    assert cache.is_read_only("ls -la\ncat file.py | grep foo")
+    assert cache.is_read_only("git status")
+    assert not cache.is_read_only("git commit -m 'x'")
+    assert not cache.is_read_only("cat file.py > other.py")
+    assert not cache.is_read_only("ls; rm file.py")
+    assert not cache.is_read_only("find . -delete")
+    assert not cache.is_read_only("cd src")
+
+
+def test_command_cache_hit_and_invalidation_on_change(tmp_path):
+    path = tmp_path / "file.py"
+    path.write_text("a")
+    cache = CommandCache()
+    cwd = str(tmp_path)
+    assert cache.get("cat file.py", cwd) is None
+    cache.put("cat file.py", cwd, "a")
+    assert cache.get("cat file.py", cwd) == "a"
+    assert cache.hit_rate == 0.5
+
+    path.write_text("bb")
+    os.utime(path, ns=(time.time_ns() + 10**9, time.time_ns() + 10**9))
+    assert cache.get("cat file.py", cwd) is None
+
+
+def test_command_cache_recursive_commands_see_nested_changes(tmp_path):
+    (tmp_path / "pkg").mkdir()
+    nested = tmp_path / "pkg" / "module.py"
+    nested.write_text("x = 1")
+    cache = CommandCache()
+    cwd = str(tmp_path)
+    cache.put("grep -rn x .", cwd, "pkg/module.py:1:x = 1")
+    assert cache.get("grep -rn x .", cwd) == "pkg/module.py:1:x = 1"
+    nested.write_text("x = 22")
+    assert cache.get("grep -rn x .", cwd) is None
+
+
+def test_command_cache_non_read_only_put_invalidates(tmp_path):
+    cache = CommandCache()
+    cwd = str(tmp_path)
+    cache.put("ls", cwd, "")
+    cache.put("touch file.py", cwd, "")
+    assert cache.entries == {}
+
+
+def test_command_cache_expands_variables_globs_and_home(tmp_path):
+    path = tmp_path / "f.py"
+    path.write_text("a")
+    cwd = str(tmp_path)
+    cache = CommandCache(variables={"PROJECT_PATH": cwd})
+    for command in ("grep a *.py", "cat $PROJECT_PATH/f.py", "cat ${PROJECT_PATH}/f.py"):
+        cache.put(command, cwd, "f.py:a")
+        assert cache.get(command, cwd) == "f.py:a"
+    path.write_text("bb")
+    os.utime(path, ns=(time.time_ns() + 10**9, time.time_ns() + 10**9))
+    for command in ("grep a *.py", "cat $PROJECT_PATH/f.py", "cat ${PROJECT_PATH}/f.py"):
+        assert cache.get(command, cwd) is None
+    # New glob matches change the signature
+    cache.put("grep a *.py", cwd, "f.py:a")
+    (tmp_path / "g.py").write_text("a")
+    assert cache.get("grep a *.py", cwd) is None
+    # Unknown variables and brace expansions are not cached
+    assert cache.signature("cat $UNKNOWN_CODEBUDDY_VAR/f.py", cwd) is None
+    assert cache.signature("cat {f,g}.py", cwd) is None
+    home = os.path.expanduser("~")
+    assert cache.signature("ls ~", cwd)[0][0] == home
@@ -0,0 +1,41 @@
+from codebuddy.compaction import OutputCompactor, strip_ansi
+
+
+def test_strip_ansi_escape_codes():
+    assert strip_ansi("\x1b[31mred\x1b[0m text") == "red text"
+
+
+def test_strip_ansi_carriage_return_progress():
+    assert strip_ansi("10%\r50%\r100%\ndone") == "100%\ndone"
+
+
+def test_compactor_short_output_unchanged():
+    compactor = OutputCompactor()
+    assert compactor("file1.py\nfile2.py") == "file1.py\nfile2.py"
+    assert compactor.outputs == []
+
+
+def test_compactor_collapses_repeats():
+    compactor = OutputCompactor()
+    output = "start\n" + "warning: x\n" * 5 + "end"
+    compacted = compactor(output)
+    assert compacted.startswith("start\nwarning: x\n[previous line repeated 4 times]\nend\n")
+    assert compactor.recall(0) == output
+
+
+def test_compactor_keeps_head_tail_and_errors():
+    lines = [f"line {i}" for i in range(1000)]
+    lines[500] = "ERROR: something broke"
+    compactor = OutputCompactor(max_tokens=100, head_lines=2, tail_lines=2)
+    compacted = compactor("\n".join(lines)).splitlines()
+    assert compacted[:2] == ["line 0", "line 1"]
+    assert "ERROR: something broke" in compacted
+    assert compacted[-3:-1] == ["line 998", "line 999"]
+    assert compacted[-1].startswith("[Output compacted from 1000 to 7 lines.")
+
+
+def test_compactor_shortens_long_lines():
+    compactor = OutputCompactor(max_line_chars=10)
+    compacted = compactor("x" * 25)
+    assert compacted.splitlines()[0] == "x" * 10 + " [... 15 characters omitted]"
+    assert compactor.recall(0) == "x" * 25
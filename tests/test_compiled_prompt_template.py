@@ -0,0 +1,42 @@
+from codebuddy.utils import CompiledPromptTemplate
+
+
+def test_compiled_prompt_template_format():
+    template = CompiledPromptTemplate("Hello, {{name}}! Welcome to {{place}}.")
+    assert template.format(name="Alice", place="Wonderland") == "Hello, Alice! Welcome to Wonderland."
+
+
+def test_compiled_prompt_template_format_missing_key():
+    template = CompiledPromptTemplate("Hello, {{name}}! Welcome to {{place}}.")
+    assert template.format(name="Alice") == "Hello, Alice! Welcome to {{place}}."
+
+
+def test_compiled_prompt_template_format_no_keys():
+    template = CompiledPromptTemplate("Hello, World!")
+    assert template.format(name="Alice") == "Hello, World!"
+
+
+def test_compiled_prompt_template_split():
+    template = CompiledPromptTemplate(
+        "You are {{role}}.\nProject:\n{{project}}\nEnd.", dynamic_keys=["project"]
+    )
+    prefix, suffix = template.split(role="helpful", project="a.py")
+    assert prefix == "You are helpful.\nProject:\n"
+    assert suffix == "a.py\nEnd."
+
+
+def test_compiled_prompt_template_split_without_dynamic_keys():
+    template = CompiledPromptTemplate("Hello, {{name}}!")
+    assert template.split(name="World") == ("Hello, World!", "")
+
+
+def test_compiled_prompt_template_stable_fingerprint():
+    template = CompiledPromptTemplate("Static.\n{{project}}", dynamic_keys=["project"])
+    assert template.prefix_fingerprint(project="a") == template.prefix_fingerprint(project="b")
+
+
+def test_compiled_prompt_template_render_cache():
+    template = CompiledPromptTemplate("{{a}}", cache_size=2)
+    for value in ("1", "2", "3", "3"):
+        assert template.format(a=value) == value
+    assert len(template._renders) == 2
@@ -0,0 +1,93 @@
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from typing import List
+
+from codebuddy.backend import Backend
+from codebuddy.chat_module import ChatModule
+from codebuddy.conversation_store import ConversationStore, DialogHistory
+from codebuddy.utils import Dialog, Message
+
+
+@dataclass
+class EchoModule(ChatModule, Backend):
+    def call_api(self, messages, retries=0):
+        return "echo: " + messages[-1].content
+
+
+def test_store_appends_and_finds_messages(tmp_path):
+    store = ConversationStore(str(tmp_path / "store.db"))
+    dialog_id = store.new_dialog("a")
+    start = time.time()
+    store.append(dialog_id, [Message("user", "hi"), Message("assistant", "hello")])
+    store.append(dialog_id, [Message("user", "bye")], start=2)
+    other_id = store.new_dialog("b")
+    store.append(other_id, [Message("user", "other")])
+
+    assert [x.content for x in store.load_dialog(dialog_id).turns] == ["hi", "hello", "bye"]
+    assert [x.content for x in store.load_dialog(dialog_id, start=2).turns] == ["bye"]
+    found = store.find_messages(conversation_id="a", since=start - 1)
+    assert [x[2].content for x in found] == ["hi", "hello", "bye"]
+    assert store.find_messages(until=start - 1) == []
+    assert store.dialog_ids("a") == []
+    store.end_dialog(dialog_id)
+    assert store.dialog_ids("a") == [dialog_id]
+    assert [x[0] for x in store.conversations()] == ["a", "b"]
+
+
+def test_dialog_history_is_lazy_and_bounded(tmp_path):
+    history = DialogHistory(ConversationStore(str(tmp_path / "store.db")), "a", max_cached=2)
+    for idx in range(5):
+        history.append(Dialog([Message("user", f"q{idx}"), Message("assistant", f"a{idx}")]))
+    assert len(history) == 5
+    assert len(history._cache) == 2
+    assert history[0].turns[0].content == "q0"
+    assert [x.turns[1].content for x in history[-2:]] == ["a3", "a4"]
+    assert len(history._cache) == 2
+
+
+def test_chat_module_persists_messages_as_produced(tmp_path):
+    path = str(tmp_path / "store.db")
+    module = EchoModule(store_path=path, conversation_id="c1")
+    for _ in module("one"):
+        pass
+    store = ConversationStore(path)
+    assert [x[2].content for x in store.find_messages("c1")] == ["one", "echo: one"]
+
+    for _ in module("two", clear=True):
+        pass
+    assert len(module.dialog_history) == 1
+    assert [x.content for x in module.dialog_history[0].turns] == ["one", "echo: one"]
+    assert [x[2].content for x in store.find_messages("c1")][-2:] == ["two", "echo: two"]
+
+    # A shorter message list, as sent by a cleared chat interface, starts a new dialog
+    for _ in module("three", messages=[]):
+        pass
+    assert len(module.dialog_history) == 2
+    assert [x.content for x in module.dialog_history[1].turns] == ["two", "echo: two"]
+
+
+def test_store_round_trips_tool_calls(tmp_path):
+    path = str(tmp_path / "store.db")
+    # A store created before tool calls were stored
+    connection = sqlite3.connect(path)
+    connection.executescript(
+        "CREATE TABLE messages (id INTEGER PRIMARY KEY, dialog_id INTEGER NOT NULL, "
+        "conversation_id TEXT NOT NULL, position INTEGER NOT NULL, role TEXT NOT NULL, "
+        "content TEXT NOT NULL, created REAL NOT NULL);"
+        "INSERT INTO messages VALUES (1, 0, 'a', 0, 'user', 'old', 0.);"
+    )
+    connection.close()
+    store = ConversationStore(path)
+    assert store.find_messages()[0][2] == Message("user", "old")
+
+    call = {"id": "call_1", "name": "terminal", "arguments": {"command": "ls"}}
+    messages = [
+        Message("user", "list files"),
+        Message("assistant", "", tool_calls=[call]),
+        Message("tool", "a.py", tool_call_id="call_1"),
+    ]
+    dialog_id = store.new_dialog("b")
+    store.append(dialog_id, messages)
+    assert store.load_dialog(dialog_id).turns == messages
+    assert [x[2] for x in store.find_messages(conversation_id="b")] == messages
@@ -0,0 +1,69 @@
+from dataclasses import dataclass
+
+from codebuddy.http_backend import HttpBackend
+from codebuddy.stub_server import StubServer
+from codebuddy.utils import Message, TRIPLE_BACKTICKS
+from conftest import FakeTmuxModule
+
+T = TRIPLE_BACKTICKS
+RESPONSE = (
+    f"Checking first.\n{T}terminal\nls\n{T}\nIf that works I will run the tests and then "
+    f"fix whatever fails.\n{T}terminal\npytest -q\n{T}\nThe tests should pass now."
+)
+
+
+@dataclass
+class StubModule(FakeTmuxModule, HttpBackend):
+    pass
+
+
+def test_cancelled_stream_closes_the_connection():
+    server = StubServer(responses=["one two three four five six"], token_delay=0.01).start()
+    try:
+        backend = HttpBackend(base_url=server.base_url)
+        prompt = [Message("user", "x" * 4000)]
+        stream = backend.stream_api(prompt)
+        assert [next(stream) for _ in range(3)] == ["one ", "two ", "three "]
+        stream.close()
+        assert backend.output_tokens == [3]
+        assert backend.call_api(prompt).startswith("one two")
+        assert server.connections == 2
+        # The cancelled response still counts its prompt, estimated like the server does
+        assert backend.input_tokens == [1000, 1000]
+    finally:
+        server.stop()
+
+
+def test_action_end(tmp_path):
+    module = StubModule(project_path=str(tmp_path), checkpoint_edits=False, transcript_dir="")
+    end = module._action_end(RESPONSE)
+    assert RESPONSE[:end].endswith(f"ls\n{T}")
+    # A closing fence without a newline may still be an opening fence being written
+    assert module._action_end(f"{T}terminal\nls\n{T}") is None
+    # Blocks of file edits are not actions, even if they are marked terminal
+    text = f"OVERWRITE run.sh\n{T}terminal\nls\n{T}\n{T}ipython\nprint(1)\n{T}\nMore"
+    assert text[:module._action_end(text)].endswith(f"print(1)\n{T}")
+    assert module._action_end("No blocks.\n") is None
+    module.close()
+
+
+def test_early_stop_runs_only_the_first_block(tmp_path):
+    server = StubServer(responses=[RESPONSE, "Done."], token_delay=0.005).start()
+    try:
+        module = StubModule(
+            base_url=server.base_url,
+            project_path=str(tmp_path),
+            checkpoint_edits=False,
+            transcript_dir="",
+            early_stop=True,
+        )
+        list(module("List the files"))
+        assert module.messages[1].content == f"Checking first.\n{T}terminal\nls\n{T}"
+        assert module.terminal_session.commands == ["ls\n"]
+        assert module.messages[-1].content == "Done."
+        # The cancelled response is counted up to the closing fence
+        assert module.output_tokens[0] < len(RESPONSE.split(" "))
+        assert all(module.input_tokens)
+        module.close()
+    finally:
+        server.stop()
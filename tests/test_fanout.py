@@ -0,0 +1,85 @@
+import time
+from dataclasses import dataclass
+
+from codebuddy import tmux_module
+from codebuddy.backend import Backend
+from codebuddy.checkpoint import CheckpointStore
+from codebuddy.fanout import FanoutModule, parse_subtasks
+from codebuddy.file_locks import FileLocks
+from codebuddy.utils import Message
+
+
+def test_parse_subtasks():
+    response = 'Here you go:\n```json\n[{"title": "A", "task": "do a"}, {"task": "do b"}, {"x": 1}]\n```'
+    assert parse_subtasks(response, max_subtasks=8) == [
+        {"title": "A", "task": "do a"}, {"title": "do b", "task": "do b"}
+    ]
+    assert parse_subtasks(response, max_subtasks=1) == [{"title": "A", "task": "do a"}]
+    assert parse_subtasks("no json here", max_subtasks=8) == []
+    assert parse_subtasks("[not json]", max_subtasks=8) == []
+
+
+def test_file_locks(tmp_path):
+    locks = FileLocks()
+    path = str(tmp_path / "a.py")
+    assert locks.acquire(path, "w1") is None
+    assert locks.acquire(path, "w1") is None
+    assert locks.acquire(str(tmp_path / "." / "a.py"), "w2") == "w1"
+    locks.release("w1")
+    assert locks.acquire(path, "w2") is None
+
+
+WORKERS = []
+
+
+class FakeWorker(Backend):
+    def __init__(self, terminal_session_id, file_locks, **kwargs):
+        Backend.__init__(self)
+        self.terminal_session_id = terminal_session_id
+        self.file_locks = file_locks
+        self.kwargs = kwargs
+        WORKERS.append(self)
+        self.messages, self.step_info = [], {}
+
+    def __call__(self, prompt):
+        time.sleep(0.2)
+        self.input_tokens.append(1)
+        self.output_tokens.append(1)
+        self.messages += [Message("user", prompt), Message("assistant", f"did {prompt.split()[0]}")]
+        yield self.messages
+
+    def close(self):
+        pass
+
+
+@dataclass
+class ScriptedCoordinator(FanoutModule, Backend):
+    def call_api(self, messages, retries=0):
+        self.input_tokens.append(1)
+        self.output_tokens.append(1)
+        if "JSON" in messages[0].content:
+            return '[{"title": "one", "task": "one"}, {"title": "two", "task": "two"}, {"title": "three", "task": "three"}]'
+        return "Summary of " + messages[-1].content
+
+
+def test_fanout_runs_workers_in_parallel(monkeypatch, tmp_path):
+    monkeypatch.setitem(tmux_module.TMUX_MODULES, "fake", FakeWorker)
+    (tmp_path / "a.py").write_text("a = 1\n")
+    module = ScriptedCoordinator(
+        worker_backend="fake",
+        project_path=str(tmp_path),
+        max_workers=3,
+        checkpoints=CheckpointStore(project_path=str(tmp_path), root=str(tmp_path / ".store")),
+    )
+    WORKERS.clear()
+    start = time.time()
+    chunks = list(module("do everything"))
+    assert time.time() - start < 0.5
+    assert chunks[0].startswith("Running 3 subtasks")
+    assert "did one" in chunks[-1] and "did three" in chunks[-1]
+    assert [x.role for x in module.messages] == ["user", "assistant", "user", "assistant"]
+    assert module.tokens["llm_calls"] == 5
+    assert module.input_tokens == module.output_tokens == [1] * 5
+    # Only the coordinator checkpoints the project
+    assert module.step_info["checkpoint"] == 1
+    assert [x.kwargs["checkpoint_edits"] for x in WORKERS] == [False] * 3
@@ -0,0 +1,84 @@
+import time
+from dataclasses import dataclass
+
+import pytest
+
+from codebuddy.backend import Backend
+from codebuddy.hedged_backend import HedgedBackend
+from codebuddy.utils import Message
+
+
+@dataclass
+class FakeBackend(Backend):
+    response: str = ""
+    delay: float = 0.
+    error: bool = False
+
+    def call_api(self, messages, retries=0):
+        time.sleep(self.delay)
+        if self.error:
+            raise RuntimeError("backend failure")
+        self.input_tokens.append(10)
+        self.output_tokens.append(len(self.response))
+        return self.response
+
+
+def test_hedged_backend_primary_wins():
+    backend = HedgedBackend(backends=[FakeBackend(response="a"), FakeBackend(response="b")])
+    assert backend.call_api([Message("user", "Hello")]) == "a"
+    assert backend.backends[1].tokens["llm_calls"] == 0
+    assert backend.tokens["llm_calls"] == 1
+
+
+def test_hedged_backend_hedges_slow_request():
+    slow = FakeBackend(response="slow", delay=0.5)
+    fast = FakeBackend(response="fast")
+    backend = HedgedBackend(backends=[slow, fast], hedge_delay=0.05, min_hedge_delay=0.)
+    assert backend.call_api([Message("user", "Hello")]) == "fast"
+    assert backend.output_tokens == [4]
+    time.sleep(0.6)
+    # The losing request still completes and is billed to its own backend
+    assert slow.tokens["llm_calls"] == 1
+    assert backend.tokens["llm_calls"] == 2
+
+
+def test_hedged_backend_falls_over_on_error():
+    backend = HedgedBackend(backends=[FakeBackend(error=True), FakeBackend(response="b")])
+    assert backend.call_api([Message("user", "Hello")]) == "b"
+
+
+def test_hedged_backend_all_fail():
+    backend = HedgedBackend(backends=[FakeBackend(error=True), FakeBackend(error=True)])
+    with pytest.raises(RuntimeError):
+        backend.call_api([Message("user", "Hello")])
+
+
+def test_hedged_backend_percentile_deadline():
+    backend = HedgedBackend(min_samples=4, hedge_percentile=0.5, min_hedge_delay=0.)
+    assert backend.deadline == backend.hedge_delay
+    backend.latencies = [4., 1., 3., 2.]
+    assert backend.deadline == 3.
+
+
+def test_hedged_backend_records_the_latency_of_losing_requests():
+    slow = FakeBackend(response="slow", delay=0.3)
+    backend = HedgedBackend(
+        backends=[slow, FakeBackend(response="fast")], hedge_delay=0.05, min_hedge_delay=0.
+    )
+    assert backend.call_api([Message("user", "Hello")]) == "fast"
+    assert len(backend.latencies) == 1
+    time.sleep(0.4)
+    assert len(backend.latencies) == 2 and max(backend.latencies) >= 0.3
+
+
+def test_hedged_backend_usage_excludes_earlier_losing_requests():
+    slow = FakeBackend(response="slow", delay=0.3)
+    backend = HedgedBackend(
+        backends=[slow, FakeBackend(response="fast")], hedge_delay=0.05, min_hedge_delay=0.
+    )
+    assert backend.call_api([Message("user", "Hello")]) == "fast"
+    # The next call is still running when the losing request of the first one finishes
+    slow.delay, backend.hedge_delay = 0.5, 10.
+    assert backend.call_api([Message("user", "Hello")]) == "slow"
+    assert backend.output_tokens == [4, 4]
+    assert slow.output_tokens == [4, 4]
@@ -0,0 +1,81 @@
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from codebuddy.chat_module import CHAT_MODULES
+from codebuddy.http_backend import HttpBackend
+from codebuddy.stub_server import StubServer
+from codebuddy.utils import Message
+
+
+@pytest.fixture
+def server():
+    server = StubServer(responses=["Hello there, friend.", "Second response."]).start()
+    yield server
+    server.stop()
+
+
+def test_streaming_reuses_connection(server):
+    backend = HttpBackend(base_url=server.base_url)
+    chunks = list(backend.stream_api([Message("system", "Be nice."), Message("user", "Hi")]))
+    assert chunks == ["Hello ", "there, ", "friend."]
+    assert backend.call_api([Message("user", "Again")]) == "Second response."
+    assert backend.call_api([Message("user", "Again")]) == "Hello there, friend."
+    assert server.connections == 1
+    assert backend.tokens["llm_calls"] == 3
+    assert backend.output_tokens == [3, 2, 3]
+    request = server.requests[0]
+    assert request["stream"] and request["stream_options"] == {"include_usage": True}
+    assert request["messages"] == [
+        {"role": "system", "content": "Be nice."}, {"role": "user", "content": "Hi"}
+    ]
+
+
+def test_without_streaming(server):
+    backend = HttpBackend(base_url=server.base_url, stream=False, model="my-model")
+    assert backend.call_api([Message("user", "Hi")]) == "Hello there, friend."
+    assert server.requests[0]["model"] == "my-model"
+    assert backend.input_tokens == [0]
+    assert backend.output_tokens == [3]
+
+
+def test_concurrent_calls_share_the_pool():
+    server = StubServer(latency=0.05).start()
+    try:
+        backend = HttpBackend(base_url=server.base_url, max_connections=4)
+        with ThreadPoolExecutor(4) as executor:
+            for _ in range(3):
+                results = list(executor.map(
+                    lambda x: backend.call_api([Message("user", f"echo {x}")]), range(4)
+                ))
+                assert results == [f"echo {x}" for x in range(4)]
+        assert server.connections <= 4
+    finally:
+        server.stop()
+
+
+def test_stale_connection_is_replaced(server):
+    backend = HttpBackend(base_url=server.base_url)
+    backend.call_api([Message("user", "Hi")])
+    # Simulate the server closing the idle connection
+    conn = backend.pool._idle.get()
+    conn.sock.shutdown(socket.SHUT_RDWR)
+    backend.pool._idle.put(conn)
+    start = time.time()
+    assert backend.call_api([Message("user", "Hi")]) == "Second response."
+    # The request is resent at once rather than retried after a delay
+    assert time.time() - start < 0.5
+
+
+def test_http_error():
+    backend = HttpBackend(base_url="http://127.0.0.1:1/v1")
+    with pytest.raises(OSError):
+        backend.call_api([Message("user", "Hi")], retries=3)
+
+
+def test_local_chat_module(server):
+    module = CHAT_MODULES["local"](base_url=server.base_url, instruction="Be brief.")
+    assert list(module("Hi")) == ["Hello there, friend."]
+    assert [x.role for x in module.messages] == ["user", "assistant"]
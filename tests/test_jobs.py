@@ -0,0 +1,33 @@
+import pytest
+
+from codebuddy.jobs import JobManager
+
+
+def test_job_manager_incremental_output(tmp_path):
+    manager = JobManager(project_path=str(tmp_path), log_dir=str(tmp_path / "logs"))
+    job_id = manager.start("echo first; sleep 0.2; echo second")
+    assert manager.wait(job_id, timeout=5) == "exited with code 0"
+    assert manager.output(job_id) == "first\nsecond\n"
+    assert manager.output(job_id) == ""
+    assert manager.output(job_id, incremental=False) == "first\nsecond\n"
+
+
+def test_job_manager_runs_in_project_path(tmp_path):
+    manager = JobManager(project_path=str(tmp_path), log_dir=str(tmp_path / "logs"))
+    job_id = manager.start("pwd; echo $PROJECT_PATH")
+    manager.wait(job_id, timeout=5)
+    assert manager.output(job_id) == f"{tmp_path}\n{tmp_path}\n"
+
+
+def test_job_manager_wait_timeout_and_kill(tmp_path):
+    manager = JobManager(project_path=str(tmp_path), log_dir=str(tmp_path / "logs"))
+    job_id = manager.start("sleep 30")
+    assert manager.wait(job_id, timeout=0.1).startswith("running")
+    assert manager.kill(job_id) == "exited with code -15"
+    assert "sleep 30" in manager.summary()
+
+
+def test_job_manager_unknown_job(tmp_path):
+    manager = JobManager(project_path=str(tmp_path), log_dir=str(tmp_path / "logs"))
+    with pytest.raises(KeyError):
+        manager.status(1)
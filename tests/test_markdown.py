@@ -0,0 +1,65 @@
+from codebuddy.markdown import scan_markdown
+from codebuddy.utils import TRIPLE_BACKTICKS
+
+T = TRIPLE_BACKTICKS
+KEYWORDS = ["OVERWRITE", "REPLACE", "SEARCH", "HISTORY", "HISTORY_SEARCH"]
+
+
+def _summary(chunks):
+    return [(x.type, x.content) for x in chunks]
+
+
+def test_code_blocks_and_text():
+    text = f"Intro\n{T}terminal\nls -la\n{T}\nMiddle\n{T}\nplain\n{T}\nEnd"
+    assert _summary(scan_markdown(text)) == [
+        ("text", "Intro\n"),
+        ("terminal", "ls -la\n"),
+        ("text", "\nMiddle\n"),
+        ("code", "plain\n"),
+        ("text", "\nEnd"),
+    ]
+    chunk = scan_markdown(text)[1]
+    assert text[chunk.start:chunk.end] == chunk.content
+
+
+def test_keyword_lines():
+    text = (
+        f"I will search first.\nSEARCH `OutputCompactor`\nHISTORY_SEARCH error|fail\n"
+        f"OVERWRITE $PROJECT_PATH/app.py\n{T}python\nprint(1)\n{T}\nDone."
+    )
+    chunks = scan_markdown(text, KEYWORDS)
+    assert [(x.type, x.keyword, x.argument) for x in chunks] == [
+        ("text", "SEARCH", "OutputCompactor"),
+        ("text", "HISTORY_SEARCH", "error|fail"),
+        ("text", "OVERWRITE", "$PROJECT_PATH/app.py"),
+        ("python", None, None),
+    ]
+    assert chunks[2].is_edit and not chunks[0].is_edit
+    assert chunks[2].content == "OVERWRITE $PROJECT_PATH/app.py"
+
+
+def test_keywords_inside_code_blocks_are_ignored():
+    text = f"{T}python\nSEARCH = 1\nREPLACE this\n{T}\nSEARCH foo"
+    chunks = scan_markdown(text, KEYWORDS)
+    assert _summary(chunks) == [("python", "SEARCH = 1\nREPLACE this\n"), ("text", "SEARCH foo")]
+
+
+def test_four_backtick_fences_contain_triple_backtick_blocks():
+    inner = f"# Title\n\n{T}python\nprint(1)\n{T}\n"
+    text = f"OVERWRITE README.md\n`{T}markdown\n{inner}`{T}\nSEARCH after"
+    chunks = scan_markdown(text, KEYWORDS)
+    assert _summary(chunks) == [
+        ("text", "OVERWRITE README.md"), ("markdown", inner), ("text", "SEARCH after")
+    ]
+
+
+def test_closing_fence_at_end_of_line():
+    assert _summary(scan_markdown(f"{T}bash\necho hi{T}\n")) == [("bash", "echo hi"), ("text", "\n")]
+
+
+def test_inline_and_unclosed_fences():
+    text = f"Use {T}ls{T} to list.\nSEARCH one\n{T}python\nprint(1)\nSEARCH two"
+    chunks = scan_markdown(text, KEYWORDS)
+    # The unclosed block is not run, but keywords after its fence are still found
+    assert [x.argument for x in chunks] == ["one", "two"]
+    assert _summary(scan_markdown(f"{T}python\n{T}\nText")) == [("text", "\nText")]
@@ -0,0 +1,41 @@
+import pytest
+
+from codebuddy.python_worker import PythonWorker
+
+
+@pytest.fixture
+def worker(tmp_path):
+    worker = PythonWorker(project_path=str(tmp_path), timeout=10)
+    yield worker
+    worker.close()
+
+
+def test_python_worker_persistent_state(worker):
+    assert worker("x = 40") == ""
+    assert worker("x + 2") == "42"
+
+
+def test_python_worker_captures_stdout_and_stderr(worker):
+    response = worker.execute("import sys, os\nprint('out')\nprint('err', file=sys.stderr)\nos.system('echo sub')")
+    assert response["stdout"] == "out\nsub\n"
+    assert response["stderr"] == "err\n"
+    assert response["result"] == "0"
+
+
+def test_python_worker_reports_exceptions(worker):
+    response = worker.execute("1 / 0")
+    assert response["error"]["type"] == "ZeroDivisionError"
+    assert "Traceback" in response["error"]["traceback"]
+    assert worker("'>>> still works'") == "'>>> still works'"
+
+
+def test_python_worker_timeout_interrupts_block(worker):
+    worker("y = 1")
+    output = worker("import time\ntime.sleep(30)", timeout=0.2)
+    assert "KeyboardInterrupt" in output
+    assert "Execution timed out after 0.2s" in output
+    assert worker("y") == "1"
+
+
+def test_python_worker_runs_in_project_path(worker, tmp_path):
+    assert worker("import os\nos.getcwd()") == repr(str(tmp_path))
@@ -0,0 +1,38 @@
+from codebuddy.bedrock_backend import BedrockBackend
+from codebuddy.openai_backend import OpenaiBackend
+from codebuddy.utils import Message
+
+
+MESSAGES = [
+    Message("system", "Static prefix. "),
+    Message("system", "Project tree."),
+    Message("user", "Hello"),
+    Message("assistant", "Hi there!"),
+    Message("user", "List files"),
+]
+
+
+def test_bedrock_request_body_without_caching():
+    body = BedrockBackend().request_body(MESSAGES)
+    assert body["system"] == "Static prefix. Project tree."
+    assert body["messages"][1] == {"role": "assistant", "content": "Hi there!"}
+
+
+def test_bedrock_request_body_with_caching():
+    body = BedrockBackend(prompt_caching=True).request_body(MESSAGES)
+    assert body["system"][0]["cache_control"] == {"type": "ephemeral"}
+    assert "cache_control" not in body["system"][1]
+    assert body["messages"][1]["content"][0]["cache_control"] == {"type": "ephemeral"}
+    assert body["messages"][2] == {"role": "user", "content": "List files"}
+
+
+def test_bedrock_request_body_no_system():
+    body = BedrockBackend(prompt_caching=True).request_body([Message("user", "Hello")])
+    assert "system" not in body
+    assert body["messages"] == [{"role": "user", "content": "Hello"}]
+
+
+def test_openai_format_messages_merges_system():
+    messages = OpenaiBackend().format_messages(MESSAGES)
+    assert messages[0] == {"role": "system", "content": "Static prefix. Project tree."}
+    assert len(messages) == 4
@@ -0,0 +1,51 @@
+from dataclasses import dataclass
+
+from codebuddy.backend import Backend
+from codebuddy.routing_backend import RoutingBackend
+from codebuddy.utils import Message
+
+
+@dataclass
+class FakeBackend(Backend):
+    response: str = ""
+
+    def call_api(self, messages, retries=0):
+        self.input_tokens.append(1000)
+        self.output_tokens.append(100)
+        return self.response
+
+
+def get_backend(**kwargs):
+    return RoutingBackend(
+        cheap=FakeBackend(response="cheap"), strong=FakeBackend(response="strong"), **kwargs
+    )
+
+
+def test_routing_backend_initial_step_is_strong():
+    backend = get_backend()
+    assert backend.call_api([Message("user", "Hello")]) == "strong"
+    assert backend.routing_log[-1]["savings"] == 0
+
+
+def test_routing_backend_follow_up_step_is_cheap():
+    backend = get_backend(step_info={"depth": 1, "previous_tools": ["terminal"]})
+    assert backend.call_api([Message("user", "file1.py")]) == "cheap"
+    assert backend.savings > 0
+    assert backend.tokens["input_tokens"] == 1000
+
+
+def test_routing_backend_escalates_after_edit_failure():
+    backend = get_backend(step_info={"depth": 2, "previous_tools": ["REPLACE"], "edit_failed": True})
+    assert backend.route([Message("user", "Content to replace not found")]) == (
+        "strong", "previous edit failed"
+    )
+
+
+def test_routing_backend_previous_edit_is_strong():
+    backend = get_backend(step_info={"depth": 1, "previous_tools": ["terminal", "OVERWRITE"]})
+    assert backend.route([Message("user", "ok")])[0] == "strong"
+
+
+def test_routing_backend_large_prompt_is_strong():
+    backend = get_backend(step_info={"depth": 1}, max_cheap_prompt_chars=10)
+    assert backend.route([Message("user", "x" * 11)])[0] == "strong"
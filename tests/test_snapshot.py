@@ -0,0 +1,148 @@
+import json
+import shlex
+from dataclasses import dataclass
+from types import SimpleNamespace
+
+from codebuddy.backend import Backend
+from codebuddy.command_cache import CommandCache
+from codebuddy.compaction import OutputCompactor
+from codebuddy.conversation_store import ConversationStore
+from codebuddy.snapshot import SessionSnapshot, read_snapshot
+from codebuddy.utils import Dialog, Message
+from conftest import FakeSession, FakeTmuxModule
+
+
+def make_module():
+    return SimpleNamespace(
+        messages=[], dialog_history=[], input_tokens=[], output_tokens=[],
+        cache_read_tokens=[], cache_write_tokens=[], compactor=OutputCompactor(), python_history=[],
+    )
+
+
+def test_snapshot_is_incremental(tmp_path):
+    path = str(tmp_path / "session.jsonl")
+    module = make_module()
+    snapshot = SessionSnapshot(path=path)
+    module.messages += [Message("user", "hi"), Message("assistant", "hello")]
+    module.input_tokens.append(10)
+    module.output_tokens.append(2)
+    snapshot.write(module)
+    n_lines = len(open(path).readlines())
+    snapshot.write(module)
+    assert len(open(path).readlines()) == n_lines
+
+    module.messages.append(Message("user", "again"))
+    module.compactor.outputs.append("long output")
+    module.python_history.append("x = 1")
+    snapshot.write(module)
+    assert len(open(path).readlines()) == n_lines + 3
+
+    state = read_snapshot(path)
+    assert [x.content for x in state["messages"]] == ["hi", "hello", "again"]
+    assert state["usage"]["input_tokens"] == [10]
+    assert state["outputs"] == ["long output"]
+    assert state["python_history"] == ["x = 1"]
+
+
+def test_snapshot_tracks_clear_and_replaced_messages(tmp_path):
+    path = str(tmp_path / "session.jsonl")
+    module = make_module()
+    snapshot = SessionSnapshot(path=path)
+    module.messages.append(Message("user", "first"))
+    snapshot.write(module)
+    module.dialog_history.append(Dialog(module.messages))
+    module.messages = [Message("user", "second")]
+    snapshot.write(module)
+    state = read_snapshot(path)
+    assert [x.content for x in state["dialog_history"][0].turns] == ["first"]
+    assert [x.content for x in state["messages"]] == ["second"]
+
+    module.messages = [Message("user", "replaced")]
+    snapshot.write(module)
+    assert [x.content for x in read_snapshot(path)["messages"]] == ["replaced"]
+
+    # A new list that extends the written one only appends the new messages
+    n_lines = len(open(path).readlines())
+    module.messages = [Message("user", "replaced"), Message("assistant", "reply")]
+    snapshot.write(module)
+    assert len(open(path).readlines()) == n_lines + 1
+    assert [x.content for x in read_snapshot(path)["messages"]] == ["replaced", "reply"]
+
+
+def test_new_snapshot_keeps_the_old_one_and_corrupt_lines_are_skipped(tmp_path):
+    path = str(tmp_path / "session.jsonl")
+    with open(path, "w") as f:
+        f.write('{"type": "message", "role": "user", "content": "old"}\n')
+    module = make_module()
+    module.messages.append(Message("user", "new"))
+    SessionSnapshot(path=path).write(module)
+    with open(path, "a") as f:
+        f.write('{"type": "mess')
+    assert [x.content for x in read_snapshot(path)["messages"]] == ["new"]
+    assert [x.content for x in read_snapshot(path + ".bak")["messages"]] == ["old"]
+
+
+def test_restore_quotes_the_cwd(tmp_path):
+    path = str(tmp_path / "session $HOME.jsonl")
+    cwd = str(tmp_path / "dir $(touch pwned) `id`")
+    with open(path, "w") as f:
+        f.write(json.dumps({"type": "session", "session_id": "fake-session", "cwd": cwd, "env": ""}))
+    module = make_module()
+    module.terminal_session = FakeSession(str(tmp_path))
+    module.terminal_pool = [module.terminal_session]
+    module.command_cache = CommandCache()
+    SessionSnapshot(path=path).restore(module)
+    command = module.terminal_session.commands[0]
+    # Single quotes stop the shell from expanding $ and backticks
+    assert f"source {shlex.quote(path + '.restore.env')} " in command
+    assert command.endswith(f"cd {shlex.quote(cwd)}")
+
+
+def test_python_blocks_are_only_replayed_on_request(tmp_path):
+    path = str(tmp_path / "session.jsonl")
+    with open(path, "w") as f:
+        f.write(json.dumps({"type": "python", "code": "open('out', 'w')"}) + "\n")
+    ran = []
+    module = make_module()
+    module.terminal_session = FakeSession(str(tmp_path))
+    module.command_cache = CommandCache()
+    module._run_python = ran.append
+    SessionSnapshot(path=path).restore(module)
+    assert ran == [] and module.python_history == ["open('out', 'w')"]
+    SessionSnapshot(path=path).restore(module, replay_python=True)
+    assert ran == ["open('out', 'w')"]
+
+
+@dataclass
+class EchoModule(FakeTmuxModule, Backend):
+    def call_api(self, messages, retries=0):
+        self.record_usage((1, 1, 0, 0))
+        return f"Echo: {messages[-1].content}"
+
+
+def test_resume_keeps_recording_to_the_store(tmp_path):
+    kwargs = {
+        "project_path": str(tmp_path),
+        "store_path": str(tmp_path / "store.db"),
+        "snapshot_path": str(tmp_path / "session.jsonl"),
+        "checkpoint_edits": False,
+        "transcript_dir": "",
+    }
+    module = EchoModule(**kwargs)
+    list(module("first", clear=True))
+    list(module("second", clear=True))
+    module.close()
+
+    resumed = EchoModule(**kwargs)
+    resumed.resume()
+    assert [x.content for x in resumed.messages] == ["second", "Echo: second"]
+    list(resumed("third"))
+    store = ConversationStore(str(tmp_path / "store.db"))
+    dialog_ids = store.dialog_ids(resumed.conversation_id, finished=False)
+    # The restored past dialog is copied into the new conversation, followed by the current one
+    assert [x.content for x in store.load_dialog(dialog_ids[0]).turns] == ["first", "Echo: first"]
+    assert [x.content for x in store.load_dialog(dialog_ids[-1]).turns] == [
+        "second", "Echo: second", "third", "Echo: third"
+    ]
+    store.close()
+    resumed.close()
@@ -0,0 +1,145 @@
+import os
+import shutil
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from codebuddy.command_cache import CommandCache
+from codebuddy.markdown import scan_markdown
+from codebuddy.tmux import TmuxSession
+from codebuddy.tmux_module import TmuxModule
+from codebuddy.utils import TRIPLE_BACKTICKS
+
+T = TRIPLE_BACKTICKS
+
+requires_tmux = pytest.mark.skipif(shutil.which("tmux") is None, reason="tmux is not installed")
+
+
+@pytest.fixture
+def make_session(tmp_path):
+    """Returns a factory for tmux sessions with unique names, killed after the test."""
+    (tmp_path / "env" / "bin").mkdir(parents=True)
+    (tmp_path / "env" / "bin" / "activate").write_text("")
+    sessions = []
+
+    def make(name="terminal", **kwargs):
+        kwargs = {
+            "session_id": f"codebuddy-test-{os.getpid()}-{name}",
+            "python_env": str(tmp_path / "env"),
+            "project_path": str(tmp_path),
+            "sleep_duration": 0.05,
+            "interrupt_grace": 1.,
+            **kwargs,
+        }
+        session = TmuxSession(**kwargs)
+        sessions.append(session)
+        return session
+
+    yield make
+    for session in sessions:
+        session.close()
+
+
+@requires_tmux
+def test_command_timeout_interrupts_the_command(make_session):
+    session = make_session()
+    start = time.monotonic()
+    output = session("sleep 30", timeout=0.5)
+    assert time.monotonic() - start < 10
+    assert output.endswith("[Command timed out after 0.5s. Interrupt sent, output may be partial.]")
+    assert session("echo after").endswith("after")
+
+
+@requires_tmux
+def test_cancel_interrupts_the_running_command(make_session):
+    session = make_session()
+    threading.Timer(0.5, session.cancel).start()
+    start = time.monotonic()
+    output = session("sleep 30")
+    assert time.monotonic() - start < 10
+    assert "[Command cancelled. Interrupt sent, output may be partial.]" in output
+    # The cancel flag is cleared for the next command
+    assert session("echo next").endswith("next")
+
+
+def test_parallel_group():
+    module = SimpleNamespace(command_cache=CommandCache())
+    text = (
+        f"{T}terminal\nls\n{T}\n{T}terminal\ngrep -rn x .\n{T}\n"
+        f"{T}parallel\npytest pkg_a\n{T}\n{T}parallel\npytest pkg_b\n{T}\n"
+        f"{T}terminal\nrm -rf build\n{T}\n{T}terminal\ncat a.py\n{T}\n"
+        f"OVERWRITE a.py\n{T}python\nx = 1\n{T}\n{T}terminal\nls\n{T}\n"
+    )
+    chunks = scan_markdown(text, ["OVERWRITE"])
+    assert [x.type for x in chunks[:6]] == ["terminal"] * 2 + ["parallel"] * 2 + ["terminal"] * 2
+    # Read-only terminal blocks and parallel blocks run together, other terminal blocks do not
+    assert TmuxModule._parallel_group(module, chunks, 0) == 4
+    assert TmuxModule._parallel_group(module, chunks, 2) == 2
+    assert TmuxModule._parallel_group(module, chunks, 4) == 0
+    assert TmuxModule._parallel_group(module, chunks, 5) == 1
+    # A file edit ends the group
+    assert TmuxModule._parallel_group(module, chunks, 6) == 0
+
+
+def test_command_cache_is_thread_safe(tmp_path):
+    cache = CommandCache()
+    cwd = str(tmp_path)
+    (tmp_path / "a.py").write_text("a")
+    errors = []
+
+    def work(idx):
+        try:
+            for jdx in range(200):
+                command = f"cat a.py # {idx} {jdx}"
+                cache.put(command, cwd, "a")
+                cache.get(command, cwd)
+                if jdx % 50 == 0:
+                    cache.invalidate()
+        except Exception as ex:
+            errors.append(ex)
+
+    threads = [threading.Thread(target=work, args=(x,)) for x in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert cache.hits + cache.misses == 8 * 200
+
+
+@requires_tmux
+def test_reuse_keeps_a_session_with_a_matching_fingerprint(make_session):
+    session = make_session("reuse")
+    session("export CODEBUDDY_MARKER=warm")
+    reused = make_session("reuse", reuse=True)
+    assert reused.fingerprint == session.fingerprint
+    assert reused("echo $CODEBUDDY_MARKER").endswith("warm")
+    # Different settings change the fingerprint, so the session is restarted
+    restarted = make_session("reuse", reuse=True, session_width=200)
+    assert restarted.fingerprint != session.fingerprint
+    assert not restarted("echo marker=$CODEBUDDY_MARKER").endswith("warm")
+
+
+@requires_tmux
+def test_wait_ready(make_session):
+    session = make_session("ready")
+    assert session._wait_ready(timeout=5.)
+    # A busy session does not answer the sentinel before the timeout
+    session._send_keys("sleep 3")
+    assert not session._wait_ready(timeout=0.3)
+    assert session._wait_ready(timeout=10.)
+
+
+@requires_tmux
+def test_transcripts_are_kept_per_project(make_session, tmp_path):
+    transcript_dir = str(tmp_path / "transcripts")
+    for name in ("one", "two"):
+        (tmp_path / name).mkdir()
+    first = make_session("shared", project_path=str(tmp_path / "one"), transcript_dir=transcript_dir)
+    first("echo from-project-one")
+    first.close()
+    second = make_session("shared", project_path=str(tmp_path / "two"), transcript_dir=transcript_dir)
+    assert second.transcript.path != first.transcript.path
+    assert not second.transcript.search("from-project-one")
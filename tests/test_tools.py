@@ -0,0 +1,188 @@
+from dataclasses import dataclass, field
+
+import pytest
+
+from codebuddy.backend import Backend
+from codebuddy.bedrock_backend import BedrockBackend
+from codebuddy.http_backend import HttpBackend
+from codebuddy.openai_backend import OpenaiBackend
+from codebuddy.stub_server import StubServer
+from codebuddy.tools import TOOLS
+from codebuddy.utils import Message
+from conftest import FakeTmuxModule
+
+
+CALL = {"id": "call_1", "name": "terminal", "arguments": {"command": "ls"}}
+MESSAGES = [
+    Message("system", "Prompt."),
+    Message("user", "List files"),
+    Message("assistant", "", tool_calls=[CALL]),
+    Message("tool", "a.py", tool_call_id="call_1"),
+]
+
+
+def test_openai_format_messages():
+    messages = OpenaiBackend().format_messages(MESSAGES)
+    assert messages[1] == {"role": "user", "content": "List files"}
+    assert messages[2]["tool_calls"] == [
+        {
+            "id": "call_1",
+            "type": "function",
+            "function": {"name": "terminal", "arguments": '{"command": "ls"}'},
+        }
+    ]
+    assert messages[3] == {"role": "tool", "content": "a.py", "tool_call_id": "call_1"}
+
+
+def test_bedrock_request_body():
+    body = BedrockBackend(prompt_caching=True).request_body(
+        MESSAGES + [Message("user", "Thanks")], TOOLS
+    )
+    assert body["tools"][0]["name"] == "terminal"
+    assert body["tools"][0]["input_schema"]["required"] == ["command"]
+    assert body["messages"][1] == {
+        "role": "assistant",
+        "content": [
+            {
+                "type": "tool_use",
+                "id": "call_1",
+                "name": "terminal",
+                "input": {"command": "ls"},
+                "cache_control": {"type": "ephemeral"},
+            }
+        ],
+    }
+    # The tool result and the next user message are merged, since roles must alternate
+    assert body["messages"][2] == {
+        "role": "user",
+        "content": [
+            {"type": "tool_result", "tool_use_id": "call_1", "content": "a.py"},
+            {"type": "text", "text": "Thanks"},
+        ],
+    }
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_http_tool_calls(stream):
+    server = StubServer(responses=[{
+        "content": "Reading both.",
+        "tool_calls": [
+            {"name": "terminal", "arguments": {"command": "cat a.py"}},
+            {"name": "ipython", "arguments": {"code": "print(1)"}},
+        ],
+    }]).start()
+    try:
+        backend = HttpBackend(base_url=server.base_url, stream=stream)
+        response = backend.call_api_with_tools(MESSAGES, TOOLS)
+        assert response.content == "Reading both."
+        assert [(x["name"], x["arguments"]) for x in response.tool_calls] == [
+            ("terminal", {"command": "cat a.py"}), ("ipython", {"code": "print(1)"})
+        ]
+        request = server.requests[0]
+        assert request["tools"][0]["function"]["name"] == "terminal"
+        assert request["messages"][-1]["tool_call_id"] == "call_1"
+    finally:
+        server.stop()
+
+
+@dataclass
+class ScriptedToolModule(FakeTmuxModule, Backend):
+    responses: list = field(default_factory=list)
+    requests: list = field(default_factory=list)
+
+    def call_api_with_tools(self, messages, tools, retries=0):
+        self.requests.append(list(messages))
+        self.record_usage((1, 1, 0, 0))
+        return self.responses.pop(0)
+
+
+def _call(call_id, name, **arguments):
+    return {"id": call_id, "name": name, "arguments": arguments}
+
+
+def _module(tmp_path, responses):
+    (tmp_path / "a.py").write_text("x = 1\n")
+    (tmp_path / "b.py").write_text("y = 2\n")
+    return ScriptedToolModule(
+        project_path=str(tmp_path),
+        tool_mode=True,
+        terminal_pool_size=2,
+        checkpoint_edits=False,
+        transcript_dir="",
+        responses=responses,
+    )
+
+
+def test_tool_mode_runs_independent_calls_together(tmp_path):
+    module = _module(tmp_path, [
+        Message("assistant", "Looking.", tool_calls=[
+            _call("1", "terminal", command="cat a.py"),
+            _call("2", "terminal", command="ls"),
+            _call("3", "replace_in_file", path="a.py", old="x = 1", new="x = 3"),
+            _call("4", "overwrite_file", path="$PROJECT_PATH/b.py", content="y = 4\n"),
+        ]),
+        Message("assistant", "Done."),
+    ])
+    list(module("Update the files"))
+    assert [x.role for x in module.messages] == ["user", "assistant"] + ["tool"] * 4 + ["assistant"]
+    assert [x.tool_call_id for x in module.messages[2:6]] == ["1", "2", "3", "4"]
+    # The read-only commands ran on different sessions of the pool
+    assert sorted(x.commands for x in module.terminal_pool) == [["cat a.py"], ["ls"]]
+    assert module.messages[2].content == "$ cat a.py\noutput of cat a.py"
+    assert (tmp_path / "a.py").read_text() == "x = 3\n"
+    assert (tmp_path / "b.py").read_text() == "y = 4\n"
+    # The second request sends the tool results back with the tool instruction
+    assert module.requests[1][-1].tool_call_id == "4"
+    assert "Tool calls" in module.requests[1][0].content
+    module.close()
+
+
+def test_tool_mode_stops_after_a_failed_edit(tmp_path):
+    module = _module(tmp_path, [
+        Message("assistant", "", tool_calls=[
+            _call("1", "delete_from_file", path="a.py", text="missing"),
+            _call("2", "terminal", command="python a.py"),
+            _call("3", "unknown_tool"),
+        ]),
+        Message("assistant", "Retrying."),
+    ])
+    list(module("Delete it"))
+    results = [x.content for x in module.messages if x.role == "tool"]
+    assert results[0].startswith("Content to delete not found")
+    assert results[1:] == ["Not run because a previous edit failed."] * 2
+    assert module.terminal_pool[0].commands == []
+    assert module.step_info["depth"] == 1
+    module.close()
+
+
+def test_run_tool_reports_invalid_arguments(tmp_path):
+    module = _module(tmp_path, [])
+    assert module._run_tool(_call("1", "terminal")) == (
+        "Invalid arguments for terminal. Expected string arguments: command.", False
+    )
+    assert module._run_tool(_call("1", "run_function", line="RECALL 9")) == ("Output 9 not found.", True)
+    module.close()
+
+
+def test_chat_turns_keep_tool_messages(tmp_path):
+    module = _module(tmp_path, [
+        Message("assistant", "", tool_calls=[_call("1", "terminal", command="ls")]),
+        Message("assistant", "Listed."),
+        Message("assistant", "Again."),
+    ])
+    messages, clear = module._turn_messages([])
+    list(module("List files", messages=messages, clear=clear))
+    # The chat pairs of the first turn are not sent back as text
+    messages, clear = module._turn_messages([["List files", "rendered tool calls"]])
+    assert messages is None and not clear
+    list(module("And again", messages=messages, clear=clear))
+    request = module.requests[-1]
+    assert [x.role for x in request[1:]] == ["user", "assistant", "tool", "assistant", "user"]
+    assert request[2].tool_calls[0]["id"] == "1" and request[3].tool_call_id == "1"
+    # A cleared chat starts a new dialog
+    assert module._turn_messages([]) == (None, True)
+    module.tool_mode = False
+    assert module._turn_messages([["a", "b"]]) == (
+        [Message("user", "a"), Message("assistant", "b")], False
+    )
+    module.close()
@@ -0,0 +1,70 @@
+import threading
+
+from codebuddy.transcript import Transcript
+
+
+def _write(transcript, text):
+    with open(transcript._segment_path(transcript.segment), "a") as f:
+        f.write(text)
+
+
+def test_output_and_line_ranges(tmp_path):
+    transcript = Transcript(path=str(tmp_path))
+    assert transcript.begin("seq 3") == 0
+    _write(transcript, "$ seq 3\n1\n2\n3\n")
+    assert transcript.begin("echo done") == 1
+    _write(transcript, "$ echo done\ndone\n")
+    assert transcript.output(0) == "$ seq 3\n1\n2\n3"
+    assert transcript.output(0, 1, 3) == "1\n2"
+    assert transcript.output(1) == "$ echo done\ndone"
+    assert "seq 3" in transcript.summary()
+
+
+def test_search_returns_latest_matches_first(tmp_path):
+    transcript = Transcript(path=str(tmp_path))
+    _write(transcript, "startup error\n")
+    transcript.begin("make")
+    _write(transcript, "$ make\nerror: one\nok\n")
+    transcript.begin("make")
+    _write(transcript, "$ make\nerror: two\n")
+    matches = transcript.search("error: \\w+")
+    assert [(x.entry_id, x.line_number, x.line) for x in matches] == [
+        (1, 1, "error: two"),
+        (0, 1, "error: one"),
+    ]
+    # Invalid regular expressions are searched as literal text
+    assert transcript.search("error: (") == []
+    assert len(transcript.search("error", max_results=1)) == 1
+
+
+def test_index_is_reloaded(tmp_path):
+    transcript = Transcript(path=str(tmp_path))
+    transcript.begin("ls")
+    _write(transcript, "$ ls\na.py\n")
+    transcript = Transcript(path=str(tmp_path))
+    assert transcript.output(0) == "$ ls\na.py"
+    assert transcript.begin("pwd") == 1
+
+
+def test_rotation_prunes_old_segments(tmp_path):
+    transcript = Transcript(path=str(tmp_path), segment_bytes=10, max_segments=2)
+    for idx in range(4):
+        transcript.begin(f"echo {idx}")
+        _write(transcript, f"$ echo {idx}\n{idx}\n")
+    assert transcript.segments() == [3, 4]
+    assert [x["id"] for x in transcript.entries] == [2, 3]
+    assert transcript.output(3) == "$ echo 3\n3"
+    assert [x.entry_id for x in transcript.search("echo")] == [3, 2]
+    assert Transcript(path=str(tmp_path)).segment == 4
+
+
+def test_offset_waits_for_late_output(tmp_path):
+    transcript = Transcript(path=str(tmp_path), settle_interval=0.1)
+    transcript.begin("seq 2")
+    _write(transcript, "$ seq 2\n1\n")
+    # The pipe flushes the rest of the output after the next command is sent
+    threading.Timer(0.01, _write, args=(transcript, "2\n")).start()
+    transcript.begin("echo done")
+    _write(transcript, "$ echo done\ndone\n")
+    assert transcript.output(0) == "$ seq 2\n1\n2"
+    assert transcript.output(1) == "$ echo done\ndone"
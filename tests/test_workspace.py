@@ -0,0 +1,210 @@
+import json
+import os
+import subprocess
+import sys
+from dataclasses import dataclass
+
+import pytest
+
+from codebuddy.http_backend import HttpBackend
+from codebuddy.workspace import WorkspaceManager, break_link
+from conftest import FakeTmuxModule
+
+
+def make_project(path):
+    (path / "pkg").mkdir(parents=True)
+    (path / "pkg" / "main.py").write_text("print('hi')\n")
+    (path / "README.md").write_text("readme\n")
+    (path / "objects").mkdir()
+    (path / "objects" / "blob").write_text("immutable\n")
+    os.chmod(path / "objects" / "blob", 0o444)
+    os.symlink("pkg/main.py", path / "main_link.py")
+    return path
+
+
+def check_isolated(workspace, source):
+    path = workspace.path
+    assert open(os.path.join(path, "pkg", "main.py")).read() == "print('hi')\n"
+    assert os.readlink(os.path.join(path, "main_link.py")) == "pkg/main.py"
+    with open(os.path.join(path, "pkg", "main.py"), "a") as f:
+        f.write("print('changed')\n")
+    with open(os.path.join(path, "new.py"), "w") as f:
+        f.write("new\n")
+    os.remove(os.path.join(path, "README.md"))
+    assert (source / "pkg" / "main.py").read_text() == "print('hi')\n"
+    assert (source / "README.md").exists() and not (source / "new.py").exists()
+
+
+@pytest.mark.parametrize("strategy", ["auto", "reflink", "copy"])
+def test_workspace_is_isolated(tmp_path, strategy):
+    source = make_project(tmp_path / "project")
+    manager = WorkspaceManager(root=str(tmp_path / "workspaces"), strategy=strategy)
+    workspace = manager.create(str(source), "session/1")
+    assert workspace.path == str(tmp_path / "workspaces" / "session_1")
+    if strategy != "auto":
+        assert workspace.strategy in ("reflink", "copy") and not workspace.linked
+    check_isolated(workspace, source)
+    assert manager.names() == ["session_1"]
+    workspace.close()
+    assert manager.names() == [] and not os.path.exists(workspace.path)
+
+
+def test_writing_a_read_only_file_leaves_the_source_unchanged(tmp_path):
+    source = make_project(tmp_path / "project")
+    manager = WorkspaceManager(root=str(tmp_path / "workspaces"), strategy="copy")
+    workspace = manager.create(str(source), "read-only")
+    blob = os.path.join(workspace.path, "objects", "blob")
+    os.chmod(blob, 0o644)
+    with open(blob, "w") as f:
+        f.write("changed\n")
+    assert (source / "objects" / "blob").read_text() == "immutable\n"
+    assert (source / "objects" / "blob").stat().st_mode & 0o777 == 0o444
+    workspace.close()
+
+
+def test_link_read_only(tmp_path):
+    source = make_project(tmp_path / "project")
+    manager = WorkspaceManager(
+        root=str(tmp_path / "workspaces"), strategy="copy", link_read_only=True
+    )
+    workspace = manager.create(str(source), "linked")
+    blob = os.path.join(workspace.path, "objects", "blob")
+    assert workspace.linked
+    assert os.stat(blob).st_ino == (source / "objects" / "blob").stat().st_ino
+    assert os.stat(os.path.join(workspace.path, "README.md")).st_nlink == 1
+    workspace.close()
+
+
+def test_overlay_workspace(tmp_path):
+    source = make_project(tmp_path / "project")
+    manager = WorkspaceManager(root=str(tmp_path / "workspaces"), strategy="overlay")
+    try:
+        workspace = manager.create(str(source), "overlay")
+    except OSError:
+        pytest.skip("overlayfs is not available")
+    assert os.path.ismount(workspace.path)
+    check_isolated(workspace, source)
+    workspace.close()
+    assert not os.path.exists(workspace.path)
+
+
+def test_detach_turns_an_overlay_into_a_copy(tmp_path):
+    source = make_project(tmp_path / "project")
+    manager = WorkspaceManager(root=str(tmp_path / "workspaces"), strategy="overlay")
+    try:
+        workspace = manager.create(str(source), "kept")
+    except OSError:
+        pytest.skip("overlayfs is not available")
+    with open(os.path.join(workspace.path, "new.py"), "w") as f:
+        f.write("new\n")
+    os.makedirs(os.path.join(workspace.internal_path, "checkpoints"))
+    manager.detach("kept")
+    assert not os.path.ismount(workspace.path)
+    assert open(os.path.join(workspace.path, "new.py")).read() == "new\n"
+    assert os.readlink(os.path.join(workspace.path, "main_link.py")) == "pkg/main.py"
+    assert manager.metadata("kept")["strategy"] == "copy"
+    assert sorted(os.listdir(workspace.internal_path)) == ["checkpoints", "meta.json"]
+    workspace.close()
+    assert manager.names() == []
+
+
+def test_hardlink_workspace(tmp_path):
+    source = make_project(tmp_path / "project")
+    manager = WorkspaceManager(root=str(tmp_path / "workspaces"), strategy="hardlink")
+    workspace = manager.create(str(source), "links")
+    path = os.path.join(workspace.path, "pkg", "main.py")
+    assert workspace.strategy == "hardlink" and os.stat(path).st_nlink == 2
+    break_link(path)
+    with open(path, "w") as f:
+        f.write("changed\n")
+    assert (source / "pkg" / "main.py").read_text() == "print('hi')\n"
+    workspace.close()
+
+
+def test_gc_removes_workspaces_of_exited_processes(tmp_path):
+    source = make_project(tmp_path / "project")
+    root = str(tmp_path / "workspaces")
+    script = (
+        "from codebuddy.workspace import WorkspaceManager\n"
+        f"WorkspaceManager(root={root!r}, strategy='copy').create({str(source)!r}, 'orphan')\n"
+    )
+    env = {**os.environ, "PYTHONPATH": os.path.dirname(os.path.dirname(__file__))}
+    subprocess.run([sys.executable, "-c", script], check=True, env=env)
+    manager = WorkspaceManager(root=root, strategy="copy", collect_garbage=False)
+    manager.create(str(source), "mine")
+    assert manager.names() == ["mine", "orphan"]
+    assert manager.gc() == ["orphan"]
+    assert manager.names() == ["mine"] and not os.path.exists(os.path.join(root, "orphan"))
+    assert manager.gc(max_age=0.) == ["mine"]
+
+
+def test_workspace_in_use_by_another_process(tmp_path):
+    source = make_project(tmp_path / "project")
+    manager = WorkspaceManager(root=str(tmp_path / "workspaces"), strategy="copy")
+    manager.create(str(source), "busy")
+    meta_path = os.path.join(manager.root, ".busy", "meta.json")
+    with open(meta_path) as f:
+        metadata = json.load(f)
+    with open(meta_path, "w") as f:
+        json.dump({**metadata, "pid": os.getppid()}, f)
+    with pytest.raises(FileExistsError):
+        manager.create(str(source), "busy")
+
+
+@dataclass
+class StubModule(FakeTmuxModule, HttpBackend):
+    pass
+
+
+def test_module_works_in_an_isolated_workspace(tmp_path):
+    source = make_project(tmp_path / "project")
+    manager = WorkspaceManager(root=str(tmp_path / "workspaces"), strategy="hardlink")
+    module = StubModule(
+        project_path=str(source),
+        isolate=True,
+        workspace_manager=manager,
+        checkpoint_edits=False,
+        transcript_dir="",
+    )
+    assert module.project_path == module.workspace.path
+    assert module.terminal_session.cwd == module.workspace.path
+    path = os.path.join(module.project_path, "pkg", "main.py")
+    _, applied = module._edit_file("REPLACE", path, ["'hi'", "'bye'"])
+    assert applied and open(path).read() == "print('bye')\n"
+    assert (source / "pkg" / "main.py").read_text() == "print('hi')\n"
+    module.close()
+    assert not os.path.exists(path) and manager.names() == []
+
+
+def test_module_edits_break_links_to_read_only_files(tmp_path):
+    source = make_project(tmp_path / "project")
+    manager = WorkspaceManager(
+        root=str(tmp_path / "workspaces"), strategy="copy", link_read_only=True
+    )
+    module = StubModule(
+        project_path=str(source),
+        isolate=True,
+        workspace_manager=manager,
+        checkpoint_edits=False,
+        transcript_dir="",
+    )
+    path = os.path.join(module.project_path, "objects", "blob")
+    os.chmod(path, 0o644)
+    _, applied = module._edit_file("OVERWRITE", path, ["changed\n"])
+    assert applied and open(path).read() == "changed\n"
+    assert (source / "objects" / "blob").read_text() == "immutable\n"
+    module.close()
+
+
+def test_checkpoints_are_removed_with_the_workspace(tmp_path):
+    source = make_project(tmp_path / "project")
+    manager = WorkspaceManager(root=str(tmp_path / "workspaces"), strategy="copy")
+    module = StubModule(
+        project_path=str(source), isolate=True, workspace_manager=manager, transcript_dir=""
+    )
+    internal_path = module.workspace.internal_path
+    assert module.checkpoints.root == os.path.join(internal_path, "checkpoints")
+    module.checkpoints.create("before edit")
+    assert module.checkpoints.ids() == [1]
+    module.close()
+    assert not os.path.exists(internal_path)